@@ -3,6 +3,13 @@ set -e
 
 export DJANGO_SETTINGS_MODULE=setup.settings
 
+# WEB_WORKERS também é lido pelas settings: com mais de um worker o cache
+# padrão passa a ser o de arquivo, compartilhado entre eles
+export WEB_WORKERS=${WEB_WORKERS:-2}
+
+echo "==> Checking configuration"
+python manage.py check
+
 echo "==> Running migrations"
 python manage.py migrate --noinput
 
@@ -25,5 +32,16 @@ print("AWS_S3_CUSTOM_DOMAIN=", os.getenv('AWS_S3_CUSTOM_DOMAIN'))
 print("AWS_MEDIA_LOCATION=", os.getenv('AWS_MEDIA_LOCATION'))
 PY
 
-echo "==> Starting gunicorn"
-gunicorn setup.wsgi:application --bind 0.0.0.0:${PORT:-8000}
+# SERVER_MODE=asgi: workers uvicorn (setup.asgi, views assíncronas);
+# wsgi (padrão): workers síncronos do gunicorn, com WEB_THREADS threads cada
+WEB_THREADS=${WEB_THREADS:-1}
+WEB_TIMEOUT=${WEB_TIMEOUT:-30}
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+  echo "==> Starting gunicorn (ASGI, uvicorn workers=${WEB_WORKERS})"
+  exec gunicorn setup.asgi:application -k uvicorn_worker.UvicornWorker \
+    --workers "$WEB_WORKERS" --timeout "$WEB_TIMEOUT" --bind 0.0.0.0:${PORT:-8000}
+else
+  echo "==> Starting gunicorn (WSGI, workers=${WEB_WORKERS} threads=${WEB_THREADS})"
+  exec gunicorn setup.wsgi:application \
+    --workers "$WEB_WORKERS" --threads "$WEB_THREADS" --timeout "$WEB_TIMEOUT" --bind 0.0.0.0:${PORT:-8000}
+fi
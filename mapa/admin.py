@@ -1,5 +1,5 @@
 from django.contrib import admin
-from mapa.models import Bioma, Loja, Personagem, Assentamento, MapaMundo
+from mapa.models import Bioma, Loja, Personagem, Assentamento, MapaMundo, Tarefa, Blob
 
 class Biomas(admin.ModelAdmin):
     list_display = ('id','nome','tipo',)
@@ -40,5 +40,18 @@ admin.site.register(Assentamento,Assentamentos)
 
 @admin.register(MapaMundo)
 class MapaMundoAdmin(admin.ModelAdmin):
-    list_display = ('id', 'nome', 'largura', 'altura', 'criado_em')
+    list_display = ('id', 'nome', 'largura', 'altura', 'status', 'criado_em')
+    list_filter = ('status',)
     search_fields = ('nome',)
+
+@admin.register(Tarefa)
+class TarefaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'nome', 'estado', 'tentativas', 'criado_em', 'disponivel_em', 'concluido_em')
+    list_filter = ('estado', 'nome')
+    readonly_fields = ('erro',)
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'sha256', 'nome', 'tamanho', 'referencias', 'criado_em')
+    search_fields = ('sha256', 'nome')
+    readonly_fields = ('sha256', 'nome', 'tamanho', 'referencias')
@@ -0,0 +1,53 @@
+"""
+Agrupamento (clustering) de marcadores de assentamento em grade, por zoom do Leaflet.
+
+A célula tem LADO_CELULA px de tela, ou seja LADO_CELULA * 2^-zoom px da imagem;
+como a grade é ancorada na origem da imagem, o mesmo ponto cai sempre na mesma
+célula de um dado zoom, qualquer que seja o bbox pedido.
+"""
+import math
+
+# Lado da célula em px de tela (potência de 2: células alinham com a grade de tiles)
+LADO_CELULA = 64
+# Quantos ids de cada grupo são devolvidos (o grupo inteiro pode ser bem maior)
+MAX_IDS_POR_GRUPO = 10
+
+
+def lado_celula(zoom):
+    """Lado da célula em px da imagem no zoom dado."""
+    return LADO_CELULA * 2.0 ** -zoom
+
+
+def agrupar_em_grade(marcadores, zoom):
+    """Agrupa marcadores (dicts com id, pos_x, pos_y) por célula da grade do zoom.
+
+    Retorna {'zoom', 'lado', 'grupos', 'assentamentos'}: células com mais de um
+    marcador viram grupos (centroide, quantidade, representante = o mais próximo
+    do centroide, até MAX_IDS_POR_GRUPO ids); marcadores sozinhos na célula vêm
+    como estão.
+    """
+    lado = lado_celula(zoom)
+    celulas = {}
+    for m in marcadores:
+        if m.get('pos_x') is None or m.get('pos_y') is None:
+            continue
+        chave = (math.floor(m['pos_x'] / lado), math.floor(m['pos_y'] / lado))
+        celulas.setdefault(chave, []).append(m)
+
+    grupos, sozinhos = [], []
+    for (cx, cy), membros in sorted(celulas.items()):
+        if len(membros) == 1:
+            sozinhos.append(membros[0])
+            continue
+        x = sum(m['pos_x'] for m in membros) / len(membros)
+        y = sum(m['pos_y'] for m in membros) / len(membros)
+        representante = min(membros, key=lambda m: ((m['pos_x'] - x) ** 2 + (m['pos_y'] - y) ** 2, m['id']))
+        grupos.append({
+            'chave': f'{cx}:{cy}',
+            'x': round(x, 1),
+            'y': round(y, 1),
+            'quantidade': len(membros),
+            'representante': representante['id'],
+            'ids': sorted(m['id'] for m in membros)[:MAX_IDS_POR_GRUPO],
+        })
+    return {'zoom': zoom, 'lado': lado, 'grupos': grupos, 'assentamentos': sozinhos}
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MapaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mapa'
+
+    def ready(self):
+        from mapa import checks, signals  # noqa: F401
@@ -0,0 +1,196 @@
+"""
+Benchmark da API do mapa: latência, consultas SQL e bytes por endpoint conforme
+o mundo cresce, num relatório JSON comparável entre versões.
+
+Modo local: semeia mundos sintéticos de tamanhos crescentes (mapa.gerador) e
+mede cada endpoint com o cliente de teste do Django, em processo, contando as
+consultas; com o cache limpo antes de cada requisição (``frio``) e com o cache
+já preenchido (``quente``). Modo remoto: dispara requisições concorrentes
+contra um servidor já no ar (estilo locust), medindo latência, vazão e bytes.
+Usado pelo comando ``benchmark_api``.
+"""
+import itertools
+import json
+import platform
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from mapa.gerador import gerar_mundo
+from mapa.metricas import percentil
+from mapa.models import Assentamento, Bioma, MapaMundo
+
+TAMANHOS = (100, 1000, 5000)
+REPETICOES = 20
+# Lado da imagem sintética (px) e biomas por eixo (grade de retângulos)
+LADO_MUNDO = 8192
+BIOMAS_POR_EIXO = 4
+
+
+def resumir(latencias_ms):
+    return {
+        'n': len(latencias_ms),
+        'media_ms': round(statistics.fmean(latencias_ms), 2),
+        'p50_ms': round(percentil(latencias_ms, 50), 2),
+        'p95_ms': round(percentil(latencias_ms, 95), 2),
+        'max_ms': round(max(latencias_ms), 2),
+    }
+
+
+def endpoints(mapa):
+    """{nome: (método, caminho ou função que devolve o caminho/corpo)} medidos para o mapa."""
+    ids = itertools.cycle(list(Assentamento.objects.filter(mapa=mapa).values_list('pk', flat=True)[:50]) or [0])
+    contador = itertools.count()
+    return {
+        'markers': ('get', lambda: f'/api/assentamentos/markers/?mapa={mapa.pk}'),
+        'markers_zoom': ('get', lambda: f'/api/assentamentos/markers/?mapa={mapa.pk}&zoom=-3'),
+        'biomas': ('get', lambda: f'/api/biomas/?mapa={mapa.pk}'),
+        'assentamento': ('get', lambda: f'/api/assentamentos/{next(ids)}/'),
+        'bootstrap': ('get', lambda: f'/api/mapas/{mapa.pk}/bootstrap/'),
+        'criar_assentamento': ('post', lambda: ('/api/assentamentos/', {
+            'nome': f'Benchmark {mapa.pk}-{next(contador)}', 'mapa': mapa.pk,
+            'pos_x': LADO_MUNDO / 3, 'pos_y': LADO_MUNDO / 3,
+        })),
+    }
+
+
+def semear_mundo(tamanho, semente=0):
+    """Mapa sintético com uma grade de biomas e `tamanho` assentamentos gerados."""
+    mapa = MapaMundo.objects.create(nome=f'Benchmark {tamanho} #{timezone.now():%H%M%S%f}')
+    MapaMundo.objects.filter(pk=mapa.pk).update(largura=LADO_MUNDO, altura=LADO_MUNDO)
+    lado = LADO_MUNDO / BIOMAS_POR_EIXO
+    for i, j in itertools.product(range(BIOMAS_POR_EIXO), repeat=2):
+        x, y = i * lado, j * lado
+        Bioma.objects.create(
+            nome=f'{mapa.nome} bioma {i}-{j}', mapa=mapa, tipo=str(1 + (i + j) % 11),
+            poligonos=[[[x, y], [x + lado, y], [x + lado, y + lado], [x, y + lado]]],
+        )
+    gerar_mundo(mapa, tamanho, semente=semente)
+    return mapa
+
+
+def _medir(cliente, metodo, alvo, frio):
+    caminho, corpo = alvo() if metodo == 'post' else (alvo(), None)
+    if frio:
+        cache.clear()
+    with CaptureQueriesContext(connection) as consultas:
+        inicio = time.perf_counter()
+        resposta = (cliente.post(caminho, corpo, content_type='application/json') if metodo == 'post'
+                    else cliente.get(caminho))
+        decorrido = (time.perf_counter() - inicio) * 1000
+    return decorrido, len(consultas), len(resposta.content), resposta.status_code
+
+
+def executar_local(tamanhos=TAMANHOS, repeticoes=REPETICOES, semente=0, progresso=None):
+    """Semeia um mundo por tamanho e mede os endpoints no banco atual; lista de resultados."""
+    cliente = Client()
+    resultados = []
+    for tamanho in tamanhos:
+        if progresso:
+            progresso(f'semeando mundo com {tamanho} assentamentos')
+        mapa = semear_mundo(tamanho, semente)
+        for nome, (metodo, alvo) in endpoints(mapa).items():
+            modos = ('frio',) if metodo == 'post' else ('frio', 'quente')
+            for modo in modos:
+                if modo == 'quente':
+                    _medir(cliente, metodo, alvo, frio=False)  # aquece o cache
+                medidas = [_medir(cliente, metodo, alvo, frio=modo == 'frio') for _ in range(repeticoes)]
+                resultados.append({
+                    'endpoint': nome, 'tamanho': tamanho, 'cache': modo,
+                    **resumir([m[0] for m in medidas]),
+                    'consultas': max(m[1] for m in medidas),
+                    'bytes': max(m[2] for m in medidas),
+                    'status': sorted({m[3] for m in medidas}),
+                })
+                if progresso:
+                    r = resultados[-1]
+                    progresso(f"{nome:>20} {tamanho:>7} {modo:>6}  p50={r['p50_ms']}ms "
+                              f"p95={r['p95_ms']}ms consultas={r['consultas']} bytes={r['bytes']}")
+    return resultados
+
+
+def executar_remoto(url_base, mapa_id, requisicoes=200, concorrencia=8, timeout=30):
+    """Requisições GET concorrentes contra um servidor no ar; um resultado por endpoint."""
+    caminhos = {
+        'markers': f'/api/assentamentos/markers/?mapa={mapa_id}',
+        'markers_zoom': f'/api/assentamentos/markers/?mapa={mapa_id}&zoom=-3',
+        'biomas': f'/api/biomas/?mapa={mapa_id}',
+        'bootstrap': f'/api/mapas/{mapa_id}/bootstrap/',
+    }
+    resultados = []
+    for nome, caminho in caminhos.items():
+        url = url_base.rstrip('/') + caminho
+        medidas, lock = [], threading.Lock()
+
+        def uma(_):
+            inicio = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as resposta:
+                    tamanho, status = len(resposta.read()), resposta.status
+            except Exception as exc:
+                tamanho, status = 0, getattr(exc, 'code', 'erro')
+            with lock:
+                medidas.append(((time.perf_counter() - inicio) * 1000, tamanho, status))
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            list(executor.map(uma, range(requisicoes)))
+        total_s = time.perf_counter() - inicio
+        resultados.append({
+            'endpoint': nome, 'concorrencia': concorrencia,
+            **resumir([m[0] for m in medidas]),
+            'vazao_rps': round(len(medidas) / total_s, 1),
+            'bytes': max(m[1] for m in medidas),
+            'status': sorted({str(m[2]) for m in medidas}),
+        })
+    return resultados
+
+
+def relatorio(modo, resultados, **parametros):
+    return {
+        'gerado_em': timezone.now().isoformat(),
+        'modo': modo,
+        'parametros': parametros,
+        'ambiente': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'banco': connection.vendor,
+        },
+        'resultados': resultados,
+    }
+
+
+def _chave(r):
+    return (r['endpoint'], r.get('tamanho', r.get('concorrencia')), r.get('cache', ''))
+
+
+def comparar(anterior, atual):
+    """Linhas de texto com a variação de p50/p95/consultas/bytes entre dois relatórios."""
+    antes = {_chave(r): r for r in anterior['resultados']}
+    linhas = []
+    for r in atual['resultados']:
+        a = antes.get(_chave(r))
+        if a is None:
+            continue
+        variacao = (r['p50_ms'] - a['p50_ms']) / a['p50_ms'] * 100 if a['p50_ms'] else 0.0
+        endpoint, escala, modo = _chave(r)
+        linhas.append(
+            f"{endpoint:>20} {escala!s:>7} {modo:>6}  p50 {a['p50_ms']} -> {r['p50_ms']}ms ({variacao:+.0f}%)  "
+            f"p95 {a['p95_ms']} -> {r['p95_ms']}ms  consultas {a.get('consultas')} -> {r.get('consultas')}  "
+            f"bytes {a['bytes']} -> {r['bytes']}"
+        )
+    return linhas
+
+
+def carregar(caminho):
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
@@ -0,0 +1,122 @@
+"""
+Armazenamento das imagens de mapa endereçado pelo conteúdo (SHA-256).
+
+Imagens idênticas ficam num só objeto do storage, sob ``mapas/sha256/<ab>/<hash>.<ext>``,
+registrado em Blob com contagem de referências (mapas que o usam). Tiles e
+derivados também são chaveados pelo hash (mapa.imagens), então são gerados uma
+vez por conteúdo. O objeto e seus derivados só são apagados quando a última
+referência some.
+"""
+import hashlib
+import logging
+import os
+
+from django.core.files.storage import storages
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from mapa.imagens import DERIVADOS_PREFIXO, TILES_PREFIXO
+from mapa.models import Blob, MapaMundo
+
+logger = logging.getLogger(__name__)
+
+PREFIXO = 'mapas/sha256'
+
+
+def calcular_hash(arquivo) -> tuple[str, int]:
+    """(sha256 hex, tamanho) lendo o arquivo em blocos; volta o cursor ao início."""
+    sha = hashlib.sha256()
+    tamanho = 0
+    arquivo.seek(0)
+    for bloco in arquivo.chunks():
+        sha.update(bloco)
+        tamanho += len(bloco)
+    arquivo.seek(0)
+    return sha.hexdigest(), tamanho
+
+
+def nome_para(sha256: str, nome_original: str) -> str:
+    extensao = os.path.splitext(nome_original or '')[1].lower()
+    return f"{PREFIXO}/{sha256[:2]}/{sha256}{extensao}"
+
+
+def armazenar(arquivo) -> tuple[str, str]:
+    """Grava o arquivo enviado sob a chave do conteúdo, se ainda não existir.
+
+    Retorna (nome no storage, sha256). A referência é contada depois, em
+    MapaMundo.save (trocar_referencia).
+    """
+    sha256, tamanho = calcular_hash(arquivo)
+    existente = Blob.objects.filter(sha256=sha256).values_list('nome', flat=True).first()
+    if existente:
+        return existente, sha256
+    storage = storages['default']
+    nome = storage.save(nome_para(sha256, arquivo.name), arquivo)
+    try:
+        with transaction.atomic():
+            Blob.objects.create(sha256=sha256, nome=nome, tamanho=tamanho)
+    except IntegrityError:
+        # Outro request gravou o mesmo conteúdo ao mesmo tempo: fica o dele
+        storage.delete(nome)
+        nome = Blob.objects.get(sha256=sha256).nome
+    return nome, sha256
+
+
+def registrar(nome: str, sha256: str, tamanho: int) -> str:
+    """Deduplica um arquivo já gravado fora de armazenar() (ex.: upload direto ao S3).
+
+    Se o conteúdo já tem Blob, retorna o nome dele (o chamador repõe a referência
+    e o arquivo duplicado pode ser apagado); senão registra o arquivo como Blob.
+    """
+    blob, criado = Blob.objects.get_or_create(
+        sha256=sha256,
+        defaults={'nome': nome, 'tamanho': tamanho, 'referencias': MapaMundo.objects.filter(imagem=nome).count()},
+    )
+    return blob.nome
+
+
+def trocar_referencia(anterior: str, novo: str):
+    """Conta uma referência ao novo arquivo e libera o anterior."""
+    if novo:
+        Blob.objects.filter(nome=novo).update(referencias=F('referencias') + 1)
+    if anterior and anterior != novo:
+        liberar(anterior)
+
+
+def liberar(nome: str):
+    """Descarta uma referência; sem referências, apaga o arquivo e tiles/derivados do conteúdo."""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(nome=nome).first()
+        if blob is None:
+            # Arquivo anterior aos Blobs: apaga se nenhum mapa o usa mais
+            if not MapaMundo.objects.filter(imagem=nome).exists():
+                transaction.on_commit(lambda: _apagar(nome, None))
+            return
+        if blob.referencias > 1:
+            Blob.objects.filter(pk=blob.pk).update(referencias=F('referencias') - 1)
+            return
+        sha256 = blob.sha256
+        blob.delete()
+    transaction.on_commit(lambda: _apagar(nome, sha256))
+
+
+def _apagar(nome, sha256):
+    try:
+        storages['default'].delete(nome)
+        if sha256:
+            _apagar_prefixo(storages['tiles'], f"{TILES_PREFIXO}/{sha256}")
+            _apagar_prefixo(storages['derivados'], f"{DERIVADOS_PREFIXO}/{sha256}")
+    except Exception:
+        # Sobras no bucket não devem impedir a remoção do mapa
+        logger.exception("Falha ao apagar arquivos de %s", nome)
+
+
+def _apagar_prefixo(storage, prefixo):
+    try:
+        diretorios, arquivos = storage.listdir(prefixo)
+    except FileNotFoundError:
+        return
+    for arquivo in arquivos:
+        storage.delete(f"{prefixo}/{arquivo}")
+    for diretorio in diretorios:
+        _apagar_prefixo(storage, f"{prefixo}/{diretorio}")
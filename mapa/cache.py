@@ -0,0 +1,79 @@
+"""
+Cache de payloads da API por mapa.
+
+Cada mapa tem uma versão no cache (timestamp em ns da última alteração). As
+chaves de payload incluem essa versão, então invalidar um mapa é só trocar a
+versão: todas as entradas antigas deixam de ser usadas e expiram sozinhas.
+A versão também serve de Last-Modified para as respostas HTTP.
+
+Como a versão mora no cache, com vários processos web o cache tem de ser
+compartilhado entre eles (checagem mapa.E001 em mapa.checks).
+"""
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from mapa.models import MapaMundo
+
+# Chave usada quando a consulta não é filtrada por mapa
+TODOS = 'todos'
+
+
+def _chave_versao(mapa_id):
+    return f"mapa:{mapa_id}:versao"
+
+
+def versao(mapa_id) -> int:
+    return cache.get_or_set(_chave_versao(mapa_id), time.time_ns, timeout=None)
+
+
+def invalidar_mapa(mapa_id):
+    """Descarta os payloads em cache do mapa (e das consultas sem filtro de mapa).
+
+    Só vale após o commit; antes disso outro request poderia guardar dados
+    ainda não confirmados sob a versão nova. Também incrementa MapaMundo.revisao,
+    na mesma transação da edição: a revisão fica no banco, então vale para todos
+    os processos mesmo com cache local a cada um.
+    """
+    MapaMundo.objects.filter(pk=mapa_id).update(revisao=F('revisao') + 1)
+
+    def trocar_versao():
+        agora = time.time_ns()
+        cache.set_many({_chave_versao(mapa_id): agora, _chave_versao(TODOS): agora}, timeout=None)
+    transaction.on_commit(trocar_versao)
+
+
+def obter_payload(mapa_id, nome, montar, *partes):
+    """Payload versionado do mapa: {'dados', 'etag', 'modificado'}; `montar()` só roda em cache miss."""
+    v = versao(mapa_id)
+    chave = ':'.join(str(p) for p in ('mapa', mapa_id, f'v{v}', nome, *partes))
+    payload = cache.get(chave)
+    if payload is None:
+        dados = montar()
+        corpo = json.dumps(dados, sort_keys=True, separators=(',', ':'), default=str)
+        payload = {
+            'dados': dados,
+            'etag': '"%s"' % hashlib.md5(corpo.encode()).hexdigest(),
+            'modificado': v // 1_000_000_000,
+        }
+        cache.set(chave, payload)
+    return payload
+
+
+def resposta_condicional(request, payload):
+    """304 quando o cliente já tem a versão (If-None-Match / If-Modified-Since), senão None."""
+    return get_conditional_response(request, etag=payload['etag'], last_modified=payload['modificado'])
+
+
+def aplicar_validadores(response, payload):
+    response['ETag'] = payload['etag']
+    response['Last-Modified'] = http_date(payload['modificado'])
+    # Sempre revalida; o 304 evita refazer a consulta e retransmitir o corpo
+    response['Cache-Control'] = 'private, no-cache'
+    return response
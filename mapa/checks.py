@@ -0,0 +1,19 @@
+"""Checagens de configuração do app (``manage.py check``)."""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+
+@register(Tags.caches)
+def cache_compartilhado(app_configs, **kwargs):
+    """Com vários workers a versão dos mapas (mapa.cache) precisa de um cache comum a todos."""
+    workers = getattr(settings, 'WEB_WORKERS', 1)
+    if workers > 1 and isinstance(caches['default'], LocMemCache):
+        return [Error(
+            f'WEB_WORKERS={workers} com cache em memória (locmem): cada worker teria a sua versão '
+            'dos mapas e serviria payloads antigos depois de edições feitas em outro worker.',
+            hint='Use CACHE_BACKEND=file (ou outro cache compartilhado) ou WEB_WORKERS=1.',
+            id='mapa.E001',
+        )]
+    return []
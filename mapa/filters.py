@@ -0,0 +1,65 @@
+"""
+Filtros da API (django-filter), incluindo o recorte por viewport ``bbox=min_x,min_y,max_x,max_y``
+em px da imagem do mapa.
+"""
+import django_filters
+from django import forms
+
+from mapa.models import Assentamento, Bioma
+
+
+def ler_caixa(valor):
+    """Converte 'min_x,min_y,max_x,max_y' em tupla de floats; ValueError se inválido."""
+    partes = [float(p) for p in str(valor).split(',')]
+    if len(partes) != 4 or partes[0] > partes[2] or partes[1] > partes[3]:
+        raise ValueError(valor)
+    return tuple(partes)
+
+
+def pontos_na_caixa(qs, caixa):
+    """Assentamentos com (pos_x, pos_y) dentro da caixa, bordas inclusas."""
+    min_x, min_y, max_x, max_y = caixa
+    return qs.filter(pos_x__gte=min_x, pos_x__lte=max_x, pos_y__gte=min_y, pos_y__lte=max_y)
+
+
+def biomas_na_caixa(qs, caixa):
+    """Biomas cuja caixa envolvente intersecta a caixa."""
+    min_x, min_y, max_x, max_y = caixa
+    return qs.filter(bbox_min_x__lte=max_x, bbox_max_x__gte=min_x, bbox_min_y__lte=max_y, bbox_max_y__gte=min_y)
+
+
+class CaixaField(forms.CharField):
+    def to_python(self, value):
+        value = super().to_python(value)
+        if not value:
+            return None
+        try:
+            return ler_caixa(value)
+        except ValueError:
+            raise forms.ValidationError('Use bbox=min_x,min_y,max_x,max_y (números, min <= max).')
+
+
+class CaixaFilter(django_filters.Filter):
+    field_class = CaixaField
+
+
+class AssentamentoFilter(django_filters.FilterSet):
+    bbox = CaixaFilter(method='filtrar_bbox')
+
+    class Meta:
+        model = Assentamento
+        fields = ['mapa', 'tipo']
+
+    def filtrar_bbox(self, queryset, name, value):
+        return pontos_na_caixa(queryset, value)
+
+
+class BiomaFilter(django_filters.FilterSet):
+    bbox = CaixaFilter(method='filtrar_bbox')
+
+    class Meta:
+        model = Bioma
+        fields = ['mapa', 'tipo', 'nome']
+
+    def filtrar_bbox(self, queryset, name, value):
+        return biomas_na_caixa(queryset, value)
@@ -0,0 +1,290 @@
+"""
+Utilitários geométricos em coordenadas de imagem (px) para os polígonos de Bioma.
+
+Bioma.poligonos aceita dois formatos: lista de anéis ``[[[x,y],...], ...]`` ou,
+como grava o bioma_editor, lista de conjuntos de anéis ``[[[[x,y],...], ...], ...]``.
+
+O teste ponto-em-polígono em lote (pontos_em_poligonos) usa NumPy quando
+disponível e cai para o ray casting escalar (ponto_em_poligono) caso contrário.
+
+Níveis de detalhe (niveis_de_detalhe) são versões simplificadas por Douglas-Peucker
+em tolerâncias fixas, servidas conforme o zoom do cliente.
+"""
+try:
+    import numpy as np
+except ImportError:  # NumPy é opcional
+    np = None
+
+NUMPY_DISPONIVEL = np is not None
+
+# Limite de elementos (pontos x arestas) das matrizes intermediárias por bloco
+_BLOCO_ELEMENTOS = 2_000_000
+
+
+def _eh_ponto(valor) -> bool:
+    return (isinstance(valor, (list, tuple)) and len(valor) >= 2
+            and isinstance(valor[0], (int, float)) and isinstance(valor[1], (int, float)))
+
+
+def aneis(poligonos):
+    """Itera sobre cada anel (lista de [x,y]) de Bioma.poligonos, em qualquer nível de aninhamento."""
+    for item in poligonos or []:
+        if not isinstance(item, (list, tuple)) or not item:
+            continue
+        if _eh_ponto(item[0]):
+            yield item
+        else:
+            yield from aneis(item)
+
+
+def caixa_envolvente(poligonos):
+    """(min_x, min_y, max_x, max_y) de todos os anéis, ou None se não houver vértices."""
+    xs, ys = [], []
+    for anel in aneis(poligonos):
+        for ponto in anel:
+            if _eh_ponto(ponto):
+                xs.append(ponto[0])
+                ys.append(ponto[1])
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+# Utilitário: checa se um ponto (x,y) está dentro de um anel do bioma
+def ponto_em_poligono(x: float, y: float, poligono: list[list[float]]):
+    # Ray casting (par ímpar)
+    inside = False
+    n = len(poligono)
+    if n < 3:
+        return False
+    j = n - 1
+    for i in range(n):
+        xi, yi = poligono[i]
+        xj, yj = poligono[j]
+        intersect = ((yi > y) != (yj > y)) and (
+            x < (xj - xi) * (y - yi) / (yj - yi + 1e-12) + xi
+        )
+        if intersect:
+            inside = not inside
+        j = i
+    return inside
+
+
+class ArranjoAneis:
+    """Arestas de vários anéis em arrays NumPy contíguos, prontas para o teste em lote.
+
+    A aresta k liga o vértice i ao anterior j = i-1 do mesmo anel, como em
+    ponto_em_poligono. Anéis com menos de 3 vértices nunca contêm pontos.
+    """
+
+    def __init__(self, lista_aneis):
+        self.n_aneis = len(lista_aneis)
+        coords = [np.asarray(anel, dtype=float)[:, :2] for anel in lista_aneis]
+        self.validos = np.array([len(c) >= 3 for c in coords], dtype=bool)
+        coords = [c for c in coords if len(c) >= 3]
+        if coords:
+            atual = np.concatenate(coords)
+            anterior = np.concatenate([np.roll(c, 1, axis=0) for c in coords])
+            tamanhos = np.array([len(c) for c in coords])
+            self.inicios = np.concatenate(([0], np.cumsum(tamanhos)[:-1]))
+        else:
+            atual = anterior = np.empty((0, 2))
+            self.inicios = np.empty(0, dtype=int)
+        self.xi, self.yi = atual[:, 0], atual[:, 1]
+        self.xj, self.yj = anterior[:, 0], anterior[:, 1]
+
+    def contem(self, pontos):
+        """Matriz booleana (n_pontos, n_aneis): pontos[p] está dentro do anel a?"""
+        pts = np.asarray(pontos, dtype=float).reshape(-1, 2)
+        resultado = np.zeros((len(pts), self.n_aneis), dtype=bool)
+        n_arestas = len(self.xi)
+        if not len(pts) or not n_arestas:
+            return resultado
+        bloco = max(1, _BLOCO_ELEMENTOS // n_arestas)
+        for ini in range(0, len(pts), bloco):
+            px = pts[ini:ini + bloco, 0:1]
+            py = pts[ini:ini + bloco, 1:2]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cruza = ((self.yi > py) != (self.yj > py)) & (
+                    px < (self.xj - self.xi) * (py - self.yi) / (self.yj - self.yi + 1e-12) + self.xi
+                )
+            # Paridade de cruzamentos por anel (par ímpar)
+            resultado[ini:ini + bloco, self.validos] = np.logical_xor.reduceat(cruza, self.inicios, axis=1)
+        return resultado
+
+
+def preparar_aneis(lista_aneis):
+    """Pré-processa anéis para pontos_em_poligonos (ArranjoAneis com NumPy, a própria lista sem)."""
+    lista_aneis = list(lista_aneis)
+    return ArranjoAneis(lista_aneis) if NUMPY_DISPONIVEL else lista_aneis
+
+
+def pontos_em_poligonos(pontos, aneis_preparados):
+    """Pertinência de N pontos em M anéis numa só passada.
+
+    ``aneis_preparados`` é uma lista de anéis ou o retorno de preparar_aneis.
+    Retorna uma matriz (N, M) — ndarray booleano com NumPy, lista de listas sem.
+    """
+    if NUMPY_DISPONIVEL:
+        if not isinstance(aneis_preparados, ArranjoAneis):
+            aneis_preparados = ArranjoAneis(list(aneis_preparados))
+        return aneis_preparados.contem(pontos)
+    return [[ponto_em_poligono(x, y, anel) for anel in aneis_preparados] for x, y in pontos]
+
+
+def como_pontos(pontos):
+    """Converte uma sequência de (x,y) para o formato aceito pelas funções em lote (ndarray Nx2 com NumPy)."""
+    if NUMPY_DISPONIVEL:
+        return np.asarray(pontos, dtype=float).reshape(-1, 2)
+    return list(pontos)
+
+
+def indices_na_caixa(pontos, caixa):
+    """Índices dos pontos (ver como_pontos) dentro da caixa (min_x, min_y, max_x, max_y), bordas inclusas."""
+    min_x, min_y, max_x, max_y = caixa
+    if NUMPY_DISPONIVEL:
+        pts = como_pontos(pontos)
+        dentro = (pts[:, 0] >= min_x) & (pts[:, 0] <= max_x) & (pts[:, 1] >= min_y) & (pts[:, 1] <= max_y)
+        return np.flatnonzero(dentro)
+    return [k for k, (x, y) in enumerate(pontos) if min_x <= x <= max_x and min_y <= y <= max_y]
+
+
+def selecionar(pontos, indices):
+    """Subconjunto dos pontos (ver como_pontos) nos índices dados."""
+    if NUMPY_DISPONIVEL:
+        return pontos[indices]
+    return [pontos[k] for k in indices]
+
+
+# Tolerâncias (px da imagem original) das versões simplificadas guardadas em Bioma.poligonos_simplificados
+TOLERANCIAS = (1, 2, 4, 8, 16, 32)
+
+
+def _distancia_segmento(p, a, b):
+    """Distância do ponto p ao segmento ab."""
+    ax, ay = a[0], a[1]
+    dx, dy = b[0] - ax, b[1] - ay
+    comprimento2 = dx * dx + dy * dy
+    if comprimento2 == 0:
+        return ((p[0] - ax) ** 2 + (p[1] - ay) ** 2) ** 0.5
+    t = max(0.0, min(1.0, ((p[0] - ax) * dx + (p[1] - ay) * dy) / comprimento2))
+    return ((p[0] - ax - t * dx) ** 2 + (p[1] - ay - t * dy) ** 2) ** 0.5
+
+
+def simplificar_anel(anel, tolerancia):
+    """Douglas-Peucker (iterativo) de um anel; nunca devolve menos de 3 vértices."""
+    n = len(anel)
+    if n <= 3 or tolerancia <= 0:
+        return list(anel)
+    manter = [False] * n
+    manter[0] = manter[-1] = True
+    pilha = [(0, n - 1)]
+    while pilha:
+        ini, fim = pilha.pop()
+        maior, indice = 0.0, None
+        for k in range(ini + 1, fim):
+            d = _distancia_segmento(anel[k], anel[ini], anel[fim])
+            if d > maior:
+                maior, indice = d, k
+        if indice is not None and maior > tolerancia:
+            manter[indice] = True
+            pilha.append((ini, indice))
+            pilha.append((indice, fim))
+    resultado = [ponto for ponto, fica in zip(anel, manter) if fica]
+    if len(resultado) < 3:
+        # Anel menor que a tolerância: mantém um triângulo para o bioma não sumir
+        return [anel[0], anel[n // 3], anel[2 * n // 3]]
+    return resultado
+
+
+def mapear_aneis(poligonos, funcao):
+    """Aplica funcao a cada anel de Bioma.poligonos preservando o aninhamento original."""
+    resultado = []
+    for item in poligonos or []:
+        if not isinstance(item, (list, tuple)) or not item:
+            continue
+        resultado.append(funcao(item) if _eh_ponto(item[0]) else mapear_aneis(item, funcao))
+    return resultado
+
+
+def simplificar(poligonos, tolerancia):
+    return mapear_aneis(poligonos, lambda anel: simplificar_anel(anel, tolerancia))
+
+
+def niveis_de_detalhe(poligonos):
+    """{str(tolerância): poligonos simplificados} para TOLERANCIAS.
+
+    Níveis que não removem vértices em relação ao anterior são omitidos;
+    quem consulta cai para o nível menor disponível (ou a geometria completa).
+    """
+    niveis = {}
+    anterior = sum(len(anel) for anel in aneis(poligonos))
+    for tolerancia in TOLERANCIAS:
+        simplificado = simplificar(poligonos, tolerancia)
+        total = sum(len(anel) for anel in aneis(simplificado))
+        if total < anterior:
+            niveis[str(tolerancia)] = simplificado
+            anterior = total
+    return niveis
+
+
+def tolerancia_do_zoom(zoom):
+    """Tolerância (px da imagem) equivalente a um pixel de tela no zoom Leaflet (CRS.Simple, 0 = resolução total)."""
+    return 2.0 ** -zoom
+
+
+def escolher_nivel(niveis, tolerancia):
+    """Chave do maior nível de niveis_de_detalhe com tolerância <= tolerancia, ou None (geometria completa)."""
+    candidatos = [float(chave) for chave in niveis if float(chave) <= tolerancia]
+    if not candidatos:
+        return None
+    maior = max(candidatos)
+    return next(chave for chave in niveis if float(chave) == maior)
+
+
+def _recortar_lado(pontos, dentro, intersecao):
+    resultado = []
+    n = len(pontos)
+    for k in range(n):
+        atual, anterior = pontos[k], pontos[k - 1]
+        if dentro(atual):
+            if not dentro(anterior):
+                resultado.append(intersecao(anterior, atual))
+            resultado.append(atual)
+        elif dentro(anterior):
+            resultado.append(intersecao(anterior, atual))
+    return resultado
+
+
+def recortar_anel(anel, caixa):
+    """Recorta um anel à caixa (min_x, min_y, max_x, max_y) por Sutherland-Hodgman.
+
+    Retorna o anel recortado, ou lista vazia se ele não intersecta a caixa.
+    """
+    min_x, min_y, max_x, max_y = caixa
+    pontos = [(p[0], p[1]) for p in anel if _eh_ponto(p)]
+    if len(pontos) < 3:
+        return []
+    xs = [p[0] for p in pontos]
+    ys = [p[1] for p in pontos]
+    if max(xs) < min_x or min(xs) > max_x or max(ys) < min_y or min(ys) > max_y:
+        return []
+    if min(xs) >= min_x and max(xs) <= max_x and min(ys) >= min_y and max(ys) <= max_y:
+        return [list(p) for p in pontos]
+
+    def em_x(limite):
+        return lambda a, b: (limite, a[1] + (b[1] - a[1]) * (limite - a[0]) / (b[0] - a[0]))
+
+    def em_y(limite):
+        return lambda a, b: (a[0] + (b[0] - a[0]) * (limite - a[1]) / (b[1] - a[1]), limite)
+
+    for dentro, intersecao in (
+        (lambda p: p[0] >= min_x, em_x(min_x)),
+        (lambda p: p[0] <= max_x, em_x(max_x)),
+        (lambda p: p[1] >= min_y, em_y(min_y)),
+        (lambda p: p[1] <= max_y, em_y(max_y)),
+    ):
+        pontos = _recortar_lado(pontos, dentro, intersecao)
+        if not pontos:
+            return []
+    return [list(p) for p in pontos] if len(pontos) >= 3 else []
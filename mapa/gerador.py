@@ -0,0 +1,165 @@
+"""
+Geração procedural de mundos: assentamentos sorteados dentro dos biomas de um
+mapa, com atributos rolados nas tabelas dos modelos (Assentamento.CARACTERISTICAS,
+FAMA, CALAMIDADES, LIDER; Personagem.APARENCIA, SEGREDO; Loja.TIPO) e
+personagens e lojas conforme o porte (Vilarejo, Cidade, Metrópole).
+
+Tudo é gravado com bulk_create em lotes, numa transação, o que também serve
+para popular bancos de teste de carga. Com a mesma semente e o mesmo mapa o
+resultado se repete.
+"""
+import random
+
+from django.db import transaction
+
+from mapa.cache import invalidar_mapa
+from mapa.indice import indice_do_mapa
+from mapa.models import Assentamento, Loja, Personagem
+
+LOTE = 2000
+
+# Porte do assentamento: peso no sorteio, personagens notáveis e lojas
+PORTES = {
+    'V': {'peso': 70, 'personagens': 2, 'lojas': 1},
+    'C': {'peso': 25, 'personagens': 4, 'lojas': 3},
+    'M': {'peso': 5, 'personagens': 8, 'lojas': 6},
+}
+
+RACAS = ('Humano', 'Elfo', 'Anão', 'Halfling', 'Gnomo', 'Meio-Elfo', 'Meio-Orc', 'Tiefling', 'Draconato')
+_PREFIXOS = ('Pedra', 'Rio', 'Vale', 'Monte', 'Lago', 'Porto', 'Bosque', 'Forte', 'Alto', 'Campo',
+             'Serra', 'Ponte', 'Torre', 'Vila', 'Fonte', 'Cruz', 'Brejo', 'Pinhal', 'Lapa', 'Ermo')
+_SUFIXOS = ('alva', 'negra', 'verde', 'dourada', 'fria', 'serena', 'velha', 'nova', 'funda', 'clara',
+            'rubra', 'bela', 'seca', 'branca', 'torta', 'real', 'grande', 'menor', 'sombria', 'alta')
+_NOMES = ('Ana', 'Bento', 'Caio', 'Dora', 'Elias', 'Flora', 'Gil', 'Helena', 'Iago', 'Joana', 'Lia',
+          'Marcos', 'Nina', 'Otto', 'Paula', 'Rui', 'Sara', 'Teo', 'Vera', 'Yara')
+_SOBRENOMES = ('Ferreira', 'Moleiro', 'Pastor', 'Corvo', 'Lobo', 'Sal', 'Ventura', 'Cardoso', 'Prata',
+               'Sombra', 'Torres', 'Vidal', 'Brasa', 'Neves', 'Falcão', 'Rocha', 'Aragão', 'Souto')
+
+
+def _chaves(escolhas):
+    return [chave for chave, _ in escolhas]
+
+
+def sortear_posicoes(mapa, quantidade, rng):
+    """[(x, y, ids dos biomas)] uniformes na área dos biomas do mapa (na imagem toda, se não há biomas).
+
+    Sorteia um bioma pela área da caixa envolvente e um ponto na caixa; aceita se
+    o bioma contém o ponto, com chance 1/k quando k biomas o contêm (sobreposições
+    não ficam mais densas). Os pontos de cada rodada são testados em lote no índice.
+    """
+    indice = indice_do_mapa(mapa.pk)
+    entradas = [(i, e[1]) for i, e in enumerate(indice.entradas) if e[1][2] > e[1][0] and e[1][3] > e[1][1]]
+    if not entradas:
+        if not (mapa.largura and mapa.altura):
+            raise ValueError("o mapa não tem biomas nem dimensões para posicionar assentamentos")
+        return [(round(rng.uniform(0, mapa.largura), 1), round(rng.uniform(0, mapa.altura), 1), [])
+                for _ in range(quantidade)]
+    pesos = [(c[2] - c[0]) * (c[3] - c[1]) for _, c in entradas]
+    posicoes, rodadas = [], 0
+    while len(posicoes) < quantidade:
+        rodadas += 1
+        if rodadas > 100 and not posicoes:
+            raise ValueError("os polígonos dos biomas não têm área")
+        sorteados = rng.choices(entradas, weights=pesos, k=2 * (quantidade - len(posicoes)))
+        pontos = [(rng.uniform(c[0], c[2]), rng.uniform(c[1], c[3])) for _, c in sorteados]
+        for (i, _), (x, y), biomas in zip(sorteados, pontos, indice.biomas_dos_pontos(pontos)):
+            if indice.entradas[i][0] in biomas and rng.random() * len(biomas) < 1:
+                posicoes.append((round(x, 1), round(y, 1), biomas))
+                if len(posicoes) == quantidade:
+                    break
+    return posicoes
+
+
+class _Nomes:
+    """Nomes únicos (no lote e no banco) para um modelo com `nome` único."""
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.tamanho = modelo._meta.get_field('nome').max_length
+        self.usados = set()
+
+    def reservar(self, candidatos):
+        """Recebe os nomes desejados e devolve nomes livres, na mesma ordem (com sufixo numérico se preciso)."""
+        livres = list(candidatos)
+        pendentes = range(len(livres))
+        tentativa = 1
+        while pendentes:
+            no_banco = set(self.modelo.objects.filter(nome__in=[livres[i] for i in pendentes]).values_list('nome', flat=True))
+            conflitos = []
+            for i in pendentes:
+                if livres[i] in self.usados or livres[i] in no_banco:
+                    conflitos.append(i)
+                else:
+                    self.usados.add(livres[i])
+            tentativa += 1
+            sufixo = f" {tentativa}"
+            for i in conflitos:
+                # Corta o nome, não o sufixo: senão um nome no limite nunca mudaria
+                livres[i] = f"{candidatos[i][:self.tamanho - len(sufixo)]}{sufixo}"
+            pendentes = conflitos
+        return livres
+
+
+def gerar_mundo(mapa, quantidade, semente=None, lote=LOTE):
+    """Cria `quantidade` assentamentos no mapa, com personagens e lojas; retorna os totais."""
+    rng = random.Random(semente)
+    posicoes = sortear_posicoes(mapa, quantidade, rng)
+    portes = list(PORTES)
+    pesos = [PORTES[p]['peso'] for p in portes]
+    nomes = {m: _Nomes(m) for m in (Assentamento, Personagem, Loja)}
+    tipos_loja = Loja.TIPO
+    totais = {'assentamentos': 0, 'personagens': 0, 'lojas': 0, 'vinculos_bioma': 0}
+
+    with transaction.atomic():
+        for inicio in range(0, len(posicoes), lote):
+            bloco = posicoes[inicio:inicio + lote]
+            nomes_bloco = nomes[Assentamento].reservar(
+                [rng.choice(_PREFIXOS) + rng.choice(_SUFIXOS) for _ in bloco])
+            assentamentos = Assentamento.objects.bulk_create([
+                Assentamento(
+                    nome=nome, mapa=mapa, pos_x=x, pos_y=y,
+                    tipo=rng.choices(portes, weights=pesos)[0],
+                    caracteristica=rng.choice(_chaves(Assentamento.CARACTERISTICAS)),
+                    fama=rng.choice(_chaves(Assentamento.FAMA)),
+                    calamidade=rng.choice(_chaves(Assentamento.CALAMIDADES)),
+                    lider=rng.choice(_chaves(Assentamento.LIDER)),
+                )
+                for nome, (x, y, _) in zip(nomes_bloco, bloco)
+            ])
+            through = Assentamento.bioma.through
+            vinculos = through.objects.bulk_create([
+                through(assentamento_id=a.pk, bioma_id=b) for a, (_, _, biomas) in zip(assentamentos, bloco) for b in biomas
+            ])
+
+            # Personagens por porte; os primeiros de cada assentamento tocam as lojas
+            origens = [a for a in assentamentos for _ in range(PORTES[a.tipo]['personagens'])]
+            nomes_pers = nomes[Personagem].reservar(
+                [f"{rng.choice(_NOMES)} {rng.choice(_SOBRENOMES)} de {a.nome}" for a in origens])
+            personagens = Personagem.objects.bulk_create([
+                Personagem(nome=nome, raca=rng.choice(RACAS), origem=a,
+                           aparencia=rng.choice(_chaves(Personagem.APARENCIA)),
+                           segredo=rng.choice(_chaves(Personagem.SEGREDO)))
+                for nome, a in zip(nomes_pers, origens)
+            ])
+            por_assentamento = {}
+            for p in personagens:
+                por_assentamento.setdefault(p.origem_id, []).append(p)
+
+            lojas, candidatos = [], []
+            for a in assentamentos:
+                lojistas = por_assentamento.get(a.pk, [])
+                for k in range(PORTES[a.tipo]['lojas']):
+                    tipo, rotulo = rng.choice(tipos_loja)
+                    lojas.append(Loja(tipo=tipo, assentamento=a, lojista=lojistas[k] if k < len(lojistas) else None))
+                    candidatos.append(f"{rotulo} {rng.choice(_SOBRENOMES)} de {a.nome}")
+            for loja, nome in zip(lojas, nomes[Loja].reservar(candidatos)):
+                loja.nome = nome
+            Loja.objects.bulk_create(lojas)
+
+            totais['assentamentos'] += len(assentamentos)
+            totais['personagens'] += len(personagens)
+            totais['lojas'] += len(lojas)
+            totais['vinculos_bioma'] += len(vinculos)
+        # bulk_create não dispara os signals que invalidam o cache do mapa
+        invalidar_mapa(mapa.pk)
+    return totais
@@ -0,0 +1,183 @@
+"""
+Processamento das imagens de MapaMundo.
+
+Gera a pirâmide de tiles z/x/y usada pelo Leaflet (CRS.Simple) no lugar do
+``L.imageOverlay`` com a imagem original inteira, além dos derivados (miniatura
+e prévia em JPEG e, se o Pillow suportar, WebP/AVIF), checksum e dimensões.
+Executado pela fila de tarefas (mapa.tarefas), fora do request.
+"""
+import hashlib
+import io
+import math
+
+from django.core.files.base import ContentFile
+from django.core.files.images import get_image_dimensions
+from django.core.files.storage import storages
+
+TILE_SIZE = 256
+TILES_PREFIXO = 'mapas/tiles'
+DERIVADOS_PREFIXO = 'mapas/derivados'
+MINIATURA_LADO = 480
+PREVIA_LADO = 2048
+
+# Derivados gerados: nome -> lado maior (px)
+DERIVADOS = {'miniatura': MINIATURA_LADO, 'previa': PREVIA_LADO}
+# (extensão, formato do Pillow, opções de save); o JPEG é o fallback sempre gerado
+FORMATOS_DERIVADOS = (
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True}),
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('avif', 'AVIF', {'quality': 60}),
+)
+
+
+def zoom_maximo(largura: int, altura: int) -> int:
+    """Menor nível z em que a imagem original cabe em tiles de TILE_SIZE px.
+
+    O nível máximo corresponde à resolução original (zoom 0 do Leaflet);
+    cada nível abaixo reduz a imagem pela metade.
+    """
+    lado = max(largura, altura, 1)
+    return max(0, math.ceil(math.log2(lado / TILE_SIZE)))
+
+
+def caminho_tile(chave: str, z: int, x: int, y: int) -> str:
+    """Caminho do tile; `chave` é o SHA-256 da imagem (tiles compartilhados por conteúdo)."""
+    return f"{TILES_PREFIXO}/{chave}/{z}/{x}/{y}.png"
+
+
+def gerar_tiles(mapa, storage=None) -> int:
+    """Corta a imagem do mapa em uma pirâmide z/x/y e grava no storage de tiles.
+
+    Cada nível é obtido reduzindo o anterior pela metade, então a imagem
+    original só é decodificada uma vez. Tiles de borda são completados com
+    transparência para manter TILE_SIZE x TILE_SIZE. Retorna o zoom máximo.
+    """
+    from PIL import Image
+
+    storage = storage or storages['tiles']
+    with mapa.imagem.open('rb') as f:
+        nivel = Image.open(f)
+        nivel.load()
+    if nivel.mode != 'RGBA':
+        nivel = nivel.convert('RGBA')
+
+    z_max = zoom_maximo(*nivel.size)
+    for z in range(z_max, -1, -1):
+        if z < z_max:
+            nivel = nivel.resize(
+                (max(1, math.ceil(nivel.width / 2)), max(1, math.ceil(nivel.height / 2))),
+                Image.LANCZOS,
+            )
+        colunas = math.ceil(nivel.width / TILE_SIZE)
+        linhas = math.ceil(nivel.height / TILE_SIZE)
+        for x in range(colunas):
+            for y in range(linhas):
+                caixa = (x * TILE_SIZE, y * TILE_SIZE, (x + 1) * TILE_SIZE, (y + 1) * TILE_SIZE)
+                buf = io.BytesIO()
+                nivel.crop(caixa).save(buf, format='PNG')
+                storage.save(caminho_tile(mapa.checksum, z, x, y), ContentFile(buf.getvalue()))
+    return z_max
+
+
+# Faixas lidas progressivamente ao sondar o cabeçalho (bytes acumulados após cada leitura)
+SONDAGEM_FAIXAS = (16 * 1024, 128 * 1024, 1024 * 1024, 8 * 1024 * 1024)
+
+
+def _ler_faixa(storage, nome, inicio, fim):
+    """Bytes [inicio, fim) do arquivo; no S3 com GET Range, sem baixar o objeto inteiro."""
+    if hasattr(storage, 'bucket') and hasattr(storage, '_normalize_name'):
+        objeto = storage.bucket.Object(storage._normalize_name(nome))
+        try:
+            return objeto.get(Range=f"bytes={inicio}-{fim - 1}")['Body'].read()
+        except objeto.meta.client.exceptions.ClientError as e:
+            # 416: o arquivo é menor que `inicio`
+            if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return b''
+            raise
+    with storage.open(nome, 'rb') as f:
+        f.seek(inicio)
+        return f.read(fim - inicio)
+
+
+def sondar_imagem(arquivo) -> tuple[int, int, str]:
+    """(largura, altura, formato do Pillow) lendo só o começo do arquivo.
+
+    Lê faixas crescentes (SONDAGEM_FAIXAS) e alimenta um ImageFile.Parser até o
+    cabeçalho ser reconhecido; formatos com metadados longos antes das dimensões
+    caem para as faixas seguintes e, por fim, para get_image_dimensions.
+    """
+    from PIL import ImageFile
+
+    parser = ImageFile.Parser()
+    lidos = 0
+    for limite in SONDAGEM_FAIXAS:
+        pedido = limite - lidos
+        bloco = _ler_faixa(arquivo.storage, arquivo.name, lidos, limite)
+        lidos += len(bloco)
+        if bloco:
+            try:
+                parser.feed(bloco)
+            except Exception:
+                break  # decodificador recusou o fluxo parcial: tenta o caminho completo
+        if parser.image is not None:
+            return parser.image.width, parser.image.height, parser.image.format
+        if len(bloco) < pedido:
+            break  # fim do arquivo
+    largura, altura = get_image_dimensions(arquivo)
+    if not largura or not altura:
+        raise ValueError(f"Não foi possível ler as dimensões de {arquivo.name}")
+    return largura, altura, ''
+
+
+def calcular_checksum(mapa) -> str:
+    """SHA-256 da imagem original, lida em blocos para não carregar o arquivo inteiro."""
+    sha = hashlib.sha256()
+    with mapa.imagem.open('rb') as f:
+        for bloco in f.chunks():
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def formatos_suportados():
+    """FORMATOS_DERIVADOS que o Pillow instalado consegue gravar."""
+    from PIL import Image
+
+    Image.init()
+    return [f for f in FORMATOS_DERIVADOS if f[1] in Image.SAVE]
+
+
+def chave_derivado(nome: str, extensao: str) -> str:
+    """Chave em MapaMundo.derivados: 'previa' para o JPEG, 'previa_webp' para as variantes."""
+    return nome if extensao == 'jpg' else f"{nome}_{extensao}"
+
+
+def gerar_derivados(mapa, storage=None) -> dict:
+    """Grava miniatura e prévia em cada formato suportado e retorna {chave: nome no storage}.
+
+    A imagem original é decodificada uma vez, já reduzida (draft) ao maior derivado.
+    """
+    from PIL import Image
+
+    storage = storage or storages['derivados']
+    maior = max(DERIVADOS.values())
+    with mapa.imagem.open('rb') as f:
+        img = Image.open(f)
+        img.draft('RGB', (maior, maior))
+        img.thumbnail((maior, maior), Image.LANCZOS)
+        # thumbnail não decodifica imagens já menores que o alvo: carrega antes de fechar o arquivo
+        img.load()
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    formatos = formatos_suportados()
+    resultado = {}
+    for nome, lado in DERIVADOS.items():
+        reduzida = img.copy()
+        reduzida.thumbnail((lado, lado), Image.LANCZOS)
+        for extensao, formato, opcoes in formatos:
+            buf = io.BytesIO()
+            reduzida.save(buf, format=formato, **opcoes)
+            resultado[chave_derivado(nome, extensao)] = storage.save(
+                f"{DERIVADOS_PREFIXO}/{mapa.checksum}/{nome}.{extensao}", ContentFile(buf.getvalue())
+            )
+    return resultado
@@ -0,0 +1,251 @@
+"""
+Índice espacial dos biomas de cada mapa.
+
+As caixas envolventes persistidas em Bioma (bbox_*) alimentam uma grade
+uniforme em memória; a consulta de um ponto só testa os anéis dos biomas cuja
+caixa cai na mesma célula. Consultas em lote (biomas_dos_pontos) filtram os
+pontos pela caixa de cada bioma e testam todos de uma vez (mapa.geometria). O índice de cada mapa fica em
+cache no processo e é descartado quando algum Bioma do mapa é gravado
+(mapa.signals) ou quando a assinatura (quantidade, última alteração) do banco
+muda — o que cobre escritas feitas por outros processos.
+"""
+import math
+import threading
+
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from mapa.cache import invalidar_mapa
+from mapa.geometria import aneis, como_pontos, indices_na_caixa, pontos_em_poligonos, preparar_aneis, selecionar
+from mapa.models import Assentamento, Bioma
+
+# Quantidade máxima de células por eixo da grade
+CELULAS_POR_EIXO = 64
+
+
+class IndiceBiomas:
+    """Grade uniforme sobre as caixas envolventes dos biomas de um mapa."""
+
+    def __init__(self, entradas):
+        # entradas: [(bioma_id, (min_x, min_y, max_x, max_y), aneis_preparados), ...]
+        self.entradas = entradas
+        self.grade = {}
+        if not entradas:
+            self.origem, self.celula = (0.0, 0.0), 1.0
+            return
+        min_x = min(e[1][0] for e in entradas)
+        min_y = min(e[1][1] for e in entradas)
+        max_x = max(e[1][2] for e in entradas)
+        max_y = max(e[1][3] for e in entradas)
+        self.origem = (min_x, min_y)
+        self.celula = max(max_x - min_x, max_y - min_y, 1.0) / CELULAS_POR_EIXO
+        for i, (_, caixa, _) in enumerate(entradas):
+            cx0, cy0 = self._celula(caixa[0], caixa[1])
+            cx1, cy1 = self._celula(caixa[2], caixa[3])
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self.grade.setdefault((cx, cy), []).append(i)
+
+    def _celula(self, x, y):
+        return (math.floor((x - self.origem[0]) / self.celula),
+                math.floor((y - self.origem[1]) / self.celula))
+
+    def candidatos(self, x: float, y: float):
+        """Entradas cuja caixa envolvente contém o ponto."""
+        for i in self.grade.get(self._celula(x, y), ()):
+            entrada = self.entradas[i]
+            min_x, min_y, max_x, max_y = entrada[1]
+            if min_x <= x <= max_x and min_y <= y <= max_y:
+                yield entrada
+
+    def biomas_do_ponto(self, x: float, y: float) -> list[int]:
+        """Ids dos biomas que contêm o ponto (x,y), na ordem padrão de Bioma."""
+        return [bioma_id for bioma_id, _, preparados in self.candidatos(x, y)
+                if any(pontos_em_poligonos([(x, y)], preparados)[0])]
+
+    def biomas_dos_pontos(self, pontos) -> list[list[int]]:
+        """Para cada ponto (x,y), os ids dos biomas que o contêm."""
+        pts = como_pontos(pontos)
+        resultado = [[] for _ in range(len(pts))]
+        for bioma_id, caixa, preparados in self.entradas:
+            indices = indices_na_caixa(pts, caixa)
+            if not len(indices):
+                continue
+            matriz = pontos_em_poligonos(selecionar(pts, indices), preparados)
+            for k, linha in zip(indices, matriz):
+                if any(linha):
+                    resultado[k].append(bioma_id)
+        return resultado
+
+    @classmethod
+    def do_banco(cls, mapa_id):
+        linhas = (Bioma.objects
+                  .filter(mapa_id=mapa_id, bbox_min_x__isnull=False)
+                  .values_list('id', 'bbox_min_x', 'bbox_min_y', 'bbox_max_x', 'bbox_max_y', 'poligonos'))
+        entradas = []
+        for bioma_id, min_x, min_y, max_x, max_y, poligonos in linhas:
+            # Anéis inválidos (menos de 3 vértices ou pontos malformados) são ignorados
+            validos = [anel for anel in aneis(poligonos)
+                       if len(anel) >= 3 and all(len(p) >= 2 for p in anel)]
+            if validos:
+                entradas.append((bioma_id, (min_x, min_y, max_x, max_y), preparar_aneis(validos)))
+        return cls(entradas)
+
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _assinatura(mapa_id):
+    agregado = Bioma.objects.filter(mapa_id=mapa_id).aggregate(n=Count('id'), ultima=Max('atualizado_em'))
+    return agregado['n'], agregado['ultima']
+
+
+def indice_do_mapa(mapa_id) -> IndiceBiomas:
+    assinatura = _assinatura(mapa_id)
+    with _lock:
+        em_cache = _cache.get(mapa_id)
+    if em_cache and em_cache[0] == assinatura:
+        return em_cache[1]
+    indice = IndiceBiomas.do_banco(mapa_id)
+    with _lock:
+        _cache[mapa_id] = (assinatura, indice)
+    return indice
+
+
+def invalidar(mapa_id):
+    with _lock:
+        _cache.pop(mapa_id, None)
+
+
+def biomas_do_ponto(mapa_id, x: float, y: float) -> list[int]:
+    return indice_do_mapa(mapa_id).biomas_do_ponto(x, y)
+
+
+def atribuir_biomas(assentamentos) -> int:
+    """Vincula assentamentos recém-criados (ainda sem biomas) aos biomas que contêm seus pontos.
+
+    Um cálculo em lote por mapa e um único bulk_create na tabela intermediária;
+    retorna quantos vínculos foram criados.
+    """
+    through = Assentamento.bioma.through
+    por_mapa = {}
+    for a in assentamentos:
+        if a.mapa_id and a.pos_x is not None and a.pos_y is not None:
+            por_mapa.setdefault(a.mapa_id, []).append(a)
+    inserir = []
+    for mapa_id, lista in por_mapa.items():
+        calculados = indice_do_mapa(mapa_id).biomas_dos_pontos([(a.pos_x, a.pos_y) for a in lista])
+        inserir.extend(through(assentamento_id=a.pk, bioma_id=b) for a, biomas in zip(lista, calculados) for b in biomas)
+    if inserir:
+        through.objects.bulk_create(inserir)
+    return len(inserir)
+
+
+def reatribuir_biomas(mapa_id, lote: int = 2000) -> dict:
+    """Recalcula o M2M Assentamento.bioma de todos os assentamentos posicionados do mapa.
+
+    Processa em lotes: cada lote consulta os vínculos atuais uma vez, calcula os
+    biomas de todos os pontos de uma só vez e aplica a diferença com um DELETE
+    e um bulk_create na tabela intermediária, tudo numa única transação.
+    Vínculos com biomas sem mapa (dados antigos) são preservados; os demais
+    passam a refletir exatamente os polígonos, inclusive escolhas manuais.
+    """
+    through = Assentamento.bioma.through
+    indice = indice_do_mapa(mapa_id)
+    totais = {'assentamentos': 0, 'inseridos': 0, 'removidos': 0}
+    linhas = (Assentamento.objects
+              .filter(mapa_id=mapa_id, pos_x__isnull=False, pos_y__isnull=False)
+              .order_by('pk')
+              .values_list('pk', 'pos_x', 'pos_y'))
+    with transaction.atomic():
+        buffer = []
+        for linha in linhas.iterator(chunk_size=lote):
+            buffer.append(linha)
+            if len(buffer) >= lote:
+                _aplicar_lote(indice, through, buffer, totais, lote)
+                buffer = []
+        if buffer:
+            _aplicar_lote(indice, through, buffer, totais, lote)
+    # bulk_create/delete na tabela intermediária não disparam m2m_changed
+    if totais['inseridos'] or totais['removidos']:
+        invalidar_mapa(mapa_id)
+    return totais
+
+
+def caixa_do_bioma(bioma):
+    """(min_x, min_y, max_x, max_y) persistida do bioma, ou None sem polígonos."""
+    caixa = (bioma.bbox_min_x, bioma.bbox_min_y, bioma.bbox_max_x, bioma.bbox_max_y)
+    return None if None in caixa else caixa
+
+
+def reatribuir_bioma(bioma, mapa_anterior=None, caixa_anterior=None, lote: int = 2000) -> dict:
+    """Atualiza só os vínculos do bioma criado ou editado, e só nos assentamentos
+    dentro da caixa envolvente atual ou da anterior (``mapa_anterior``/``caixa_anterior``).
+
+    Vínculos com outros biomas não mudam, então escolhas manuais feitas com eles
+    são preservadas. Um vínculo manual com este bioma, de um assentamento na
+    região afetada mas fora do polígono, é removido: ali os vínculos com o bioma
+    passam a refletir o polígono.
+    """
+    through = Assentamento.bioma.through
+    totais = {'assentamentos': 0, 'inseridos': 0, 'removidos': 0}
+    regioes = [(m, c) for m, c in ((bioma.mapa_id, caixa_do_bioma(bioma)), (mapa_anterior, caixa_anterior)) if m and c]
+    if not regioes:
+        return totais
+    filtro = Q()
+    for mapa_id, (min_x, min_y, max_x, max_y) in regioes:
+        filtro |= Q(mapa_id=mapa_id, pos_x__gte=min_x, pos_x__lte=max_x, pos_y__gte=min_y, pos_y__lte=max_y)
+    preparados = None
+    if bioma.mapa_id:
+        preparados = next((e[2] for e in indice_do_mapa(bioma.mapa_id).entradas if e[0] == bioma.pk), None)
+    linhas = Assentamento.objects.filter(filtro).order_by('pk').values_list('pk', 'mapa_id', 'pos_x', 'pos_y')
+    with transaction.atomic():
+        buffer = []
+        for linha in linhas.iterator(chunk_size=lote):
+            buffer.append(linha)
+            if len(buffer) >= lote:
+                _aplicar_lote_do_bioma(bioma, preparados, through, buffer, totais)
+                buffer = []
+        if buffer:
+            _aplicar_lote_do_bioma(bioma, preparados, through, buffer, totais)
+    if totais['inseridos'] or totais['removidos']:
+        for mapa_id in {m for m, _ in regioes}:
+            invalidar_mapa(mapa_id)
+    return totais
+
+
+def _aplicar_lote_do_bioma(bioma, preparados, through, linhas, totais):
+    ids = [pk for pk, _, _, _ in linhas]
+    no_mapa = [(pk, x, y) for pk, mapa_id, x, y in linhas if mapa_id == bioma.mapa_id]
+    desejado = set()
+    if preparados is not None and no_mapa:
+        matriz = pontos_em_poligonos(como_pontos([(x, y) for _, x, y in no_mapa]), preparados)
+        desejado = {pk for (pk, _, _), linha in zip(no_mapa, matriz) if any(linha)}
+    atual = set(through.objects.filter(bioma_id=bioma.pk, assentamento_id__in=ids).values_list('assentamento_id', flat=True))
+    remover = atual - desejado
+    if remover:
+        through.objects.filter(bioma_id=bioma.pk, assentamento_id__in=remover).delete()
+    if desejado - atual:
+        through.objects.bulk_create([through(assentamento_id=a, bioma_id=bioma.pk) for a in desejado - atual])
+    totais['assentamentos'] += len(ids)
+    totais['inseridos'] += len(desejado - atual)
+    totais['removidos'] += len(remover)
+
+
+def _aplicar_lote(indice, through, linhas, totais, lote):
+    ids = [pk for pk, _, _ in linhas]
+    calculados = indice.biomas_dos_pontos([(x, y) for _, x, y in linhas])
+    desejado = {(a, b) for a, biomas in zip(ids, calculados) for b in biomas}
+    atual = {(a, b): pk for pk, a, b in (through.objects
+                                         .filter(assentamento_id__in=ids, bioma__mapa__isnull=False)
+                                         .values_list('pk', 'assentamento_id', 'bioma_id'))}
+    remover = [pk for par, pk in atual.items() if par not in desejado]
+    inserir = [through(assentamento_id=a, bioma_id=b) for a, b in desejado if (a, b) not in atual]
+    if remover:
+        through.objects.filter(pk__in=remover).delete()
+    if inserir:
+        through.objects.bulk_create(inserir, batch_size=lote)
+    totais['assentamentos'] += len(ids)
+    totais['inseridos'] += len(inserir)
+    totais['removidos'] += len(remover)
@@ -0,0 +1,197 @@
+"""
+Exportação e importação de um mundo (MapaMundo com biomas, assentamentos,
+personagens e lojas) em NDJSON: um objeto JSON por linha, com o tipo em ``registro``.
+
+A ordem dos registros é a das dependências (mapa, biomas, assentamentos,
+personagens, lojas) e as chaves estrangeiras vão pelo nome (chave natural), não
+pelo id. Os dois lados são geradores: a exportação lê o banco em blocos
+(``iterator``) e a importação grava em lotes de ``lote`` registros, resolvendo
+os nomes de cada lote com uma consulta; a memória usada não depende do tamanho
+do mundo. A imagem não viaja no arquivo, só a chave no storage (e o checksum,
+que reaproveita um Blob idêntico já existente no destino).
+"""
+import itertools
+import json
+
+from django.db import DatabaseError, transaction
+from django.db.models import Prefetch
+
+from mapa.cache import invalidar_mapa
+from mapa.models import Assentamento, Bioma, Blob, Loja, MapaMundo, Personagem
+
+LOTE = 2000
+ORDEM = ('mapa', 'bioma', 'assentamento', 'personagem', 'loja')
+
+_CAMPOS_ASSENTAMENTO = ('nome', 'tipo', 'caracteristica', 'fama', 'calamidade', 'lider', 'pos_x', 'pos_y', 'descricao')
+
+
+class ImportacaoInvalida(ValueError):
+    """Arquivo fora do formato (linha inválida, ordem errada, referência inexistente)."""
+
+
+# ----------------------- Exportação -----------------------
+
+def exportar(mapa, lote=LOTE):
+    """Registros (dicts) do mundo do mapa, na ordem de ORDEM."""
+    yield {
+        'registro': 'mapa', 'nome': mapa.nome, 'imagem': mapa.imagem.name if mapa.imagem else '',
+        'checksum': mapa.checksum, 'largura': mapa.largura, 'altura': mapa.altura,
+    }
+    for b in Bioma.objects.filter(mapa=mapa).order_by('pk').values('nome', 'tipo', 'cor', 'poligonos').iterator(lote):
+        yield {'registro': 'bioma', **b}
+
+    assentamentos = (Assentamento.objects.filter(mapa=mapa).order_by('pk')
+                     .only('pk', *_CAMPOS_ASSENTAMENTO)
+                     .prefetch_related(Prefetch('bioma', queryset=Bioma.objects.only('nome'))))
+    for a in assentamentos.iterator(lote):
+        registro = {'registro': 'assentamento', **{c: getattr(a, c) for c in _CAMPOS_ASSENTAMENTO}}
+        registro['biomas'] = sorted(b.nome for b in a.bioma.all())
+        yield registro
+
+    personagens = (Personagem.objects.filter(origem__mapa=mapa).order_by('pk')
+                   .values('nome', 'raca', 'aparencia', 'segredo', 'origem__nome'))
+    for p in personagens.iterator(lote):
+        yield {'registro': 'personagem', 'origem': p.pop('origem__nome'), **p}
+
+    lojas = (Loja.objects.filter(assentamento__mapa=mapa).order_by('pk')
+             .values('nome', 'tipo', 'catalogo', 'assentamento__nome', 'lojista__nome'))
+    for loja in lojas.iterator(lote):
+        yield {'registro': 'loja', 'assentamento': loja.pop('assentamento__nome'), 'lojista': loja.pop('lojista__nome'), **loja}
+
+
+def linhas_ndjson(registros):
+    for registro in registros:
+        yield json.dumps(registro, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+# ----------------------- Importação -----------------------
+
+def ler_ndjson(linhas):
+    """Registros (dicts) das linhas NDJSON (str ou bytes); linhas vazias são ignoradas."""
+    for numero, linha in enumerate(linhas, 1):
+        if isinstance(linha, bytes):
+            linha = linha.decode('utf-8')
+        if not linha.strip():
+            continue
+        try:
+            registro = json.loads(linha)
+        except ValueError as exc:
+            raise ImportacaoInvalida(f"linha {numero}: JSON inválido ({exc})")
+        if not isinstance(registro, dict) or registro.get('registro') not in ORDEM:
+            raise ImportacaoInvalida(f"linha {numero}: sem 'registro' válido ({', '.join(ORDEM)})")
+        yield registro
+
+
+def _nomes_para_pk(modelo, nomes, **filtros):
+    nomes = set(nomes) - {None}
+    return dict(modelo.objects.filter(nome__in=nomes, **filtros).values_list('nome', 'pk')) if nomes else {}
+
+
+def _pk_do_nome(mapeamento, nome, o_que):
+    if nome is None:
+        return None
+    if nome not in mapeamento:
+        raise ImportacaoInvalida(f"{o_que} inexistente: {nome!r}")
+    return mapeamento[nome]
+
+
+class _Importador:
+    def __init__(self, nome):
+        self.nome = nome
+        self.mapa = None
+        self.biomas = {}  # nome -> pk (poucos por mapa)
+        self.totais = dict.fromkeys(ORDEM, 0)
+
+    def mapa_de(self, registro):
+        nome = self.nome or registro['nome']
+        if MapaMundo.objects.filter(nome=nome).exists():
+            raise ImportacaoInvalida(f"já existe um mapa chamado {nome!r}")
+        imagem = registro.get('imagem') or ''
+        # Mesmo conteúdo já no destino: aponta para o arquivo existente
+        if registro.get('checksum'):
+            imagem = Blob.objects.filter(sha256=registro['checksum']).values_list('nome', flat=True).first() or imagem
+        self.mapa = MapaMundo(nome=nome)
+        self.mapa.imagem.name = imagem
+        self.mapa.save()
+
+    def biomas_de(self, registros):
+        # save() individual: calcula bbox e níveis de detalhe (bulk_create não chama save)
+        for r in registros:
+            bioma = Bioma.objects.create(mapa=self.mapa, nome=r['nome'], tipo=r.get('tipo', '2'),
+                                         cor=r.get('cor', '#88cc66'), poligonos=r.get('poligonos', []))
+            self.biomas[bioma.nome] = bioma.pk
+
+    def assentamentos_de(self, registros):
+        criados = Assentamento.objects.bulk_create([
+            Assentamento(mapa=self.mapa, **{c: r[c] for c in _CAMPOS_ASSENTAMENTO if c in r}) for r in registros
+        ])
+        through = Assentamento.bioma.through
+        through.objects.bulk_create([
+            through(assentamento_id=a.pk, bioma_id=_pk_do_nome(self.biomas, nome, 'bioma'))
+            for a, r in zip(criados, registros) for nome in r.get('biomas', [])
+        ])
+
+    def personagens_de(self, registros):
+        origens = _nomes_para_pk(Assentamento, (r.get('origem') for r in registros), mapa=self.mapa)
+        Personagem.objects.bulk_create([
+            Personagem(nome=r['nome'], raca=r['raca'], aparencia=r.get('aparencia', '1'), segredo=r.get('segredo', '1'),
+                       origem_id=_pk_do_nome(origens, r.get('origem'), 'assentamento'))
+            for r in registros
+        ])
+
+    def lojas_de(self, registros):
+        assentamentos = _nomes_para_pk(Assentamento, (r.get('assentamento') for r in registros), mapa=self.mapa)
+        lojistas = _nomes_para_pk(Personagem, (r.get('lojista') for r in registros), origem__mapa=self.mapa)
+        Loja.objects.bulk_create([
+            Loja(nome=r['nome'], tipo=r.get('tipo', '13'), catalogo=r.get('catalogo'),
+                 assentamento_id=_pk_do_nome(assentamentos, r.get('assentamento'), 'assentamento'),
+                 lojista_id=_pk_do_nome(lojistas, r.get('lojista'), 'personagem'))
+            for r in registros
+        ])
+
+    def gravar(self, tipo, registros):
+        if tipo == 'mapa':
+            if self.mapa is not None or len(registros) != 1:
+                raise ImportacaoInvalida('o arquivo deve ter um único registro de mapa')
+            self.mapa_de(registros[0])
+        elif self.mapa is None:
+            raise ImportacaoInvalida('o primeiro registro deve ser o mapa')
+        else:
+            gravar = {'bioma': self.biomas_de, 'assentamento': self.assentamentos_de,
+                      'personagem': self.personagens_de, 'loja': self.lojas_de}[tipo]
+            gravar(registros)
+        self.totais[tipo] += len(registros)
+
+
+def importar(registros, nome=None, lote=LOTE):
+    """Cria o mundo a partir dos registros, numa transação; retorna (mapa, totais por tipo).
+
+    Registros de um mesmo tipo são gravados em lotes de ``lote``; cada tipo só pode
+    aparecer depois dos tipos de que depende (ORDEM), como exportar() produz. Um
+    lote recusado pelo banco vira ImportacaoInvalida com a posição dos seus registros.
+    """
+    importador = _Importador(nome)
+    posicao = -1
+    lidos = 0
+    try:
+        with transaction.atomic():
+            for tipo, grupo in itertools.groupby(registros, key=lambda r: r['registro']):
+                if ORDEM.index(tipo) < posicao:
+                    raise ImportacaoInvalida(f"registro de {tipo} fora de ordem")
+                posicao = ORDEM.index(tipo)
+                while bloco := list(itertools.islice(grupo, lote)):
+                    try:
+                        importador.gravar(tipo, bloco)
+                    except DatabaseError as exc:
+                        # Violação de unicidade, valor longo demais para a coluna (DataError no
+                        # PostgreSQL) etc.: recusado como os demais erros do arquivo
+                        faixa = f"registro {lidos + 1}" if len(bloco) == 1 else f"registros {lidos + 1} a {lidos + len(bloco)}"
+                        raise ImportacaoInvalida(f"{faixa} ({tipo}) rejeitado pelo banco: {exc}")
+                    lidos += len(bloco)
+            if importador.mapa is None:
+                raise ImportacaoInvalida('arquivo sem registro de mapa')
+            # bulk_create não dispara os signals que invalidam o cache do mapa
+            invalidar_mapa(importador.mapa.pk)
+    except KeyError as exc:
+        raise ImportacaoInvalida(f"campo obrigatório ausente: {exc}")
+    return importador.mapa, importador.totais
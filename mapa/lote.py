@@ -0,0 +1,226 @@
+"""
+Operações em lote da API: criar, atualizar e remover listas de objetos numa requisição.
+
+``POST``, ``PATCH`` e ``DELETE`` em ``/api/<recurso>/lote/``. O lote inteiro é
+validado antes de gravar, com as consultas agrupadas: chaves estrangeiras e
+campos únicos custam uma consulta por campo, não uma por item. Se algum item é
+inválido nada é gravado; senão tudo vai numa transação com bulk_create/bulk_update.
+A resposta traz um resultado por item, na ordem enviada.
+"""
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueValidator
+
+from mapa.cache import invalidar_mapa
+from mapa.signals import invalidacao_suspensa
+
+MAX_ITENS = 1000
+
+
+def _pk(modelo, valor):
+    """Valor convertido para o tipo da pk do modelo, ou None se inválido."""
+    if valor is None or isinstance(valor, bool):
+        return None
+    try:
+        return modelo._meta.pk.to_python(valor)
+    except (TypeError, ValueError, DjangoValidationError):
+        return None
+
+
+class RelacionadoEmLote(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField que, dentro de um lote, busca o objeto entre os pré-carregados."""
+
+    def to_internal_value(self, data):
+        carregados = self.context.get('relacionados_em_lote', {}).get(self.field_name)
+        if carregados is None:
+            return super().to_internal_value(data)
+        pk = _pk(self.get_queryset().model, data)
+        if pk is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in carregados:
+            self.fail('does_not_exist', pk_value=data)
+        return carregados[pk]
+
+
+class LoteSerializer(serializers.ListSerializer):
+    """Lista de itens do serializer filho validada e gravada em lote.
+
+    Para atualizar, ``instance`` é {pk: objeto} e cada item traz o ``id`` do seu objeto.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('allow_empty', False)
+        kwargs.setdefault('max_length', MAX_ITENS)
+        super().__init__(*args, **kwargs)
+        self._alvos = []
+
+    def _id_do_item(self, item):
+        return _pk(self.child.Meta.model, item.get('id')) if isinstance(item, dict) else None
+
+    def _precarregar(self, itens):
+        """Carrega as chaves estrangeiras do lote e confere os campos únicos; {índice: erros}."""
+        relacionados, erros = {}, {}
+        for nome, campo in self.child.fields.items():
+            if campo.read_only:
+                continue
+            if isinstance(campo, RelacionadoEmLote):
+                modelo = campo.get_queryset().model
+                pks = {_pk(modelo, item.get(nome)) for item in itens} - {None}
+                relacionados[nome] = campo.get_queryset().in_bulk(pks)
+            unicos = [v for v in campo.validators if isinstance(v, UniqueValidator)]
+            if unicos:
+                # Conferidos aqui, para o lote todo, em vez de uma consulta por item
+                campo.validators = [v for v in campo.validators if not isinstance(v, UniqueValidator)]
+                for i, mensagem in self._conferir_unicos(campo, unicos[0], itens).items():
+                    erros.setdefault(i, {})[nome] = [mensagem]
+        self._context['relacionados_em_lote'] = relacionados
+        return erros
+
+    def _conferir_unicos(self, campo, validador, itens):
+        campo_modelo = validador.queryset.model._meta.get_field(campo.source)
+        por_valor = {}
+        for i, item in enumerate(itens):
+            if item.get(campo.field_name) in (None, ''):
+                continue
+            try:
+                valor = campo_modelo.to_python(item[campo.field_name])
+            except DjangoValidationError:
+                continue  # o tipo inválido aparece na validação do item
+            por_valor.setdefault(valor, []).append(i)
+        existentes = dict(validador.queryset
+                          .filter(**{f'{campo.source}__in': list(por_valor)})
+                          .values_list(campo.source, 'pk'))
+        erros = {}
+        for valor, indices in por_valor.items():
+            for i in indices:
+                proprio = self._id_do_item(itens[i]) if self.instance is not None else None
+                if len(indices) > 1:
+                    erros[i] = 'Valor repetido no lote.'
+                elif valor in existentes and existentes[valor] != proprio:
+                    erros[i] = str(validador.message)
+        return erros
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data or len(data) > self.max_length:
+            return super().to_internal_value(data)
+        conflitos = self._precarregar([item if isinstance(item, dict) else {} for item in data])
+        self._alvos = []
+        validados, erros = [], []
+        for i, item in enumerate(data):
+            try:
+                validados.append(self.run_child_validation(item))
+                erro = {}
+            except serializers.ValidationError as exc:
+                erro = exc.detail if isinstance(exc.detail, dict) else {api_settings.NON_FIELD_ERRORS_KEY: exc.detail}
+            erros.append({**erro, **conflitos.get(i, {})})
+        if any(erros):
+            raise serializers.ValidationError(erros)
+        return validados
+
+    def run_child_validation(self, data):
+        if self.instance is not None:
+            alvo = self.instance.get(self._id_do_item(data))
+            if alvo is None:
+                raise serializers.ValidationError({'id': ['Informe o id de um objeto existente.']})
+            if alvo in self._alvos:
+                raise serializers.ValidationError({'id': ['Objeto repetido no lote.']})
+            self.child.instance = alvo
+            self._alvos.append(alvo)
+        return super().run_child_validation(data)
+
+    def create(self, validated_data):
+        modelo = self.child.Meta.model
+        return modelo.objects.bulk_create([modelo(**dados) for dados in validated_data])
+
+    def update(self, instance, validated_data):
+        campos = set()
+        for alvo, dados in zip(self._alvos, validated_data):
+            for campo, valor in dados.items():
+                setattr(alvo, campo, valor)
+            campos.update(dados)
+        if campos:
+            self.child.Meta.model.objects.bulk_update(self._alvos, sorted(campos))
+        return self._alvos
+
+
+def _resultados_invalidos(erros):
+    return [
+        {'indice': i, 'status': 'erro', 'erros': erro} if erro else {'indice': i, 'status': 'valido'}
+        for i, erro in enumerate(erros)
+    ]
+
+
+class LoteMixin:
+    """Ação ``lote`` (POST cria, PATCH atualiza, DELETE remove) para ModelViewSets.
+
+    bulk_create/bulk_update não disparam os signals, e na remoção eles ficam
+    suspensos: a subclasse informa os mapas afetados (``mapas_do_lote``) para
+    invalidar o cache, e pode completar os objetos criados (``depois_de_criar_lote``).
+    """
+
+    def mapas_do_lote(self, objetos):
+        return set()
+
+    def depois_de_criar_lote(self, objetos):
+        pass
+
+    @action(detail=False, methods=['post', 'patch', 'delete'])
+    def lote(self, request):
+        if request.method == 'DELETE':
+            return self._remover_lote(request)
+        instancias = None
+        if request.method == 'PATCH':
+            modelo = self.get_queryset().model
+            itens = request.data if isinstance(request.data, list) else []
+            pks = {_pk(modelo, item.get('id')) for item in itens if isinstance(item, dict)} - {None}
+            instancias = self.get_queryset().in_bulk(pks)
+        serializer = LoteSerializer(
+            instancias, data=request.data, partial=instancias is not None,
+            child=self.get_serializer_class()(), context=self.get_serializer_context(),
+        )
+        if not serializer.is_valid():
+            if isinstance(serializer.errors, dict):
+                return Response(serializer.errors, status=400)
+            return Response({'resultados': _resultados_invalidos(serializer.errors)}, status=400)
+
+        anteriores = self.mapas_do_lote(list(instancias.values())) if instancias else set()
+        try:
+            with transaction.atomic():
+                objetos = serializer.save()
+                if instancias is None:
+                    self.depois_de_criar_lote(objetos)
+                for mapa_id in anteriores | self.mapas_do_lote(objetos):
+                    invalidar_mapa(mapa_id)
+        except IntegrityError as exc:
+            return Response({'detail': f'Lote rejeitado pelo banco: {exc}'}, status=400)
+        estado = 'criado' if instancias is None else 'atualizado'
+        return Response(
+            {'resultados': [{'indice': i, 'status': estado, 'id': o.pk} for i, o in enumerate(objetos)]},
+            status=201 if instancias is None else 200,
+        )
+
+    def _remover_lote(self, request):
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        if not isinstance(ids, list) or not 0 < len(ids) <= MAX_ITENS:
+            return Response({'ids': [f'Informe uma lista de 1 a {MAX_ITENS} ids.']}, status=400)
+        qs = self.get_queryset()
+        pks = [_pk(qs.model, valor) for valor in ids]
+        existentes = qs.in_bulk({pk for pk in pks if pk is not None})
+        erros = [
+            {} if pk in existentes and pks.index(pk) == i else {'id': ['Objeto não encontrado ou repetido no lote.']}
+            for i, pk in enumerate(pks)
+        ]
+        if any(erros):
+            return Response({'resultados': _resultados_invalidos(erros)}, status=400)
+        # QuerySet.delete dispara post_delete por objeto (e pelos removidos em cascata):
+        # com a invalidação suspensa, cada mapa é invalidado uma vez no fim
+        mapas = self.mapas_do_lote(list(existentes.values()))
+        with transaction.atomic(), invalidacao_suspensa():
+            qs.model._default_manager.filter(pk__in=existentes).delete()
+        for mapa_id in mapas:
+            invalidar_mapa(mapa_id)
+        return Response({'resultados': [{'indice': i, 'status': 'removido', 'id': pk} for i, pk in enumerate(pks)]})
@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from mapa import benchmark
+
+
+class Command(BaseCommand):
+    help = ("Mede latência, consultas e bytes dos endpoints do mapa em mundos sintéticos de tamanhos "
+            "crescentes (banco de teste descartável) ou contra um servidor no ar (--url); gera relatório JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', default=','.join(map(str, benchmark.TAMANHOS)),
+                            help="Assentamentos por mundo, separados por vírgula.")
+        parser.add_argument('--repeticoes', type=int, default=benchmark.REPETICOES,
+                            help="Requisições medidas por endpoint e modo de cache.")
+        parser.add_argument('--semente', type=int, default=0)
+        parser.add_argument('--url', help="Servidor no ar (ex.: http://localhost:8000); exige --mapa.")
+        parser.add_argument('--mapa', type=int, help="Id do mapa medido no modo --url.")
+        parser.add_argument('--requisicoes', type=int, default=200, help="Requisições por endpoint no modo --url.")
+        parser.add_argument('--concorrencia', type=int, default=8, help="Requisições simultâneas no modo --url.")
+        parser.add_argument('--saida', help="Arquivo do relatório JSON (padrão: stdout).")
+        parser.add_argument('--comparar', help="Relatório anterior: imprime a variação por endpoint.")
+
+    def handle(self, *args, **options):
+        if options['url']:
+            if not options['mapa']:
+                raise CommandError("--url exige --mapa.")
+            resultados = benchmark.executar_remoto(
+                options['url'], options['mapa'], options['requisicoes'], options['concorrencia'])
+            dados = benchmark.relatorio('remoto', resultados, url=options['url'], mapa=options['mapa'],
+                                        requisicoes=options['requisicoes'], concorrencia=options['concorrencia'])
+        else:
+            try:
+                tamanhos = [int(t) for t in options['tamanhos'].split(',')]
+            except ValueError:
+                raise CommandError("--tamanhos deve ser uma lista de inteiros separados por vírgula.")
+            # Banco de teste descartável, como no `manage.py test`: nada é gravado no banco real
+            setup_test_environment(debug=False)
+            bancos = setup_databases(verbosity=0, interactive=False)
+            try:
+                resultados = benchmark.executar_local(
+                    tamanhos, options['repeticoes'], options['semente'], progresso=self.stderr.write)
+                dados = benchmark.relatorio('local', resultados, tamanhos=tamanhos,
+                                            repeticoes=options['repeticoes'], semente=options['semente'])
+            finally:
+                teardown_databases(bancos, verbosity=0)
+                teardown_test_environment()
+
+        texto = json.dumps(dados, indent=2, ensure_ascii=False)
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8') as arquivo:
+                arquivo.write(texto + '\n')
+        else:
+            self.stdout.write(texto)
+        if options['comparar']:
+            for linha in benchmark.comparar(benchmark.carregar(options['comparar']), dados):
+                self.stderr.write(linha)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mapa.intercambio import LOTE, exportar, linhas_ndjson
+from mapa.models import MapaMundo
+
+
+class Command(BaseCommand):
+    help = "Exporta um mapa com biomas, assentamentos, personagens e lojas em NDJSON (um registro por linha)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mapa', type=int, required=True, help="Id do MapaMundo.")
+        parser.add_argument('--saida', default='-', help="Arquivo de saída (padrão: stdout).")
+        parser.add_argument('--lote', type=int, default=LOTE, help="Registros lidos do banco por consulta.")
+
+    def handle(self, *args, **options):
+        mapa = MapaMundo.objects.filter(pk=options['mapa']).first()
+        if mapa is None:
+            raise CommandError(f"MapaMundo {options['mapa']} não existe.")
+        linhas = linhas_ndjson(exportar(mapa, lote=options['lote']))
+        if options['saida'] == '-':
+            for linha in linhas:
+                self.stdout.write(linha, ending='')
+            return
+        with open(options['saida'], 'w', encoding='utf-8') as saida:
+            saida.writelines(linhas)
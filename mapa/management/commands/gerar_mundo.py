@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mapa.gerador import LOTE, gerar_mundo
+from mapa.models import MapaMundo
+
+
+class Command(BaseCommand):
+    help = ("Gera assentamentos dentro dos biomas de um mapa, com atributos, personagens e lojas "
+            "sorteados nas tabelas dos modelos (também serve de massa para testes de carga).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mapa', type=int, required=True, help="Id do MapaMundo.")
+        parser.add_argument('--assentamentos', type=int, default=100, help="Quantos assentamentos criar.")
+        parser.add_argument('--semente', type=int, help="Semente do sorteio (repete o mesmo mundo).")
+        parser.add_argument('--lote', type=int, default=LOTE, help="Assentamentos por bulk insert.")
+
+    def handle(self, *args, **options):
+        mapa = MapaMundo.objects.filter(pk=options['mapa']).first()
+        if mapa is None:
+            raise CommandError(f"MapaMundo {options['mapa']} não existe.")
+        if options['assentamentos'] < 1:
+            raise CommandError("--assentamentos deve ser positivo.")
+        inicio = time.monotonic()
+        try:
+            totais = gerar_mundo(mapa, options['assentamentos'], semente=options['semente'], lote=options['lote'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(
+            f"{totais['assentamentos']} assentamentos, {totais['personagens']} personagens, "
+            f"{totais['lojas']} lojas e {totais['vinculos_bioma']} vínculos com biomas "
+            f"em {time.monotonic() - inicio:.1f}s."
+        )
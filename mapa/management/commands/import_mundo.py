@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mapa.intercambio import LOTE, ImportacaoInvalida, importar, ler_ndjson
+
+
+class Command(BaseCommand):
+    help = "Importa um mundo exportado por export_mundo (NDJSON), em lotes e numa única transação."
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help="Arquivo NDJSON ('-' lê do stdin).")
+        parser.add_argument('--nome', help="Nome do novo mapa (padrão: o do arquivo).")
+        parser.add_argument('--lote', type=int, default=LOTE, help="Registros por bulk insert.")
+
+    def handle(self, *args, **options):
+        entrada = sys.stdin if options['arquivo'] == '-' else open(options['arquivo'], encoding='utf-8')
+        try:
+            mapa, totais = importar(ler_ndjson(entrada), nome=options['nome'], lote=options['lote'])
+        except ImportacaoInvalida as exc:
+            raise CommandError(str(exc))
+        finally:
+            if entrada is not sys.stdin:
+                entrada.close()
+        self.stdout.write(
+            f"Mapa {mapa.nome} (#{mapa.pk}): {totais['bioma']} biomas, {totais['assentamento']} assentamentos, "
+            f"{totais['personagem']} personagens, {totais['loja']} lojas."
+        )
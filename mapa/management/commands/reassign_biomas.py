@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mapa.indice import reatribuir_biomas
+from mapa.models import MapaMundo
+
+
+class Command(BaseCommand):
+    help = "Recalcula os biomas de todos os assentamentos de um mapa a partir dos polígonos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mapa', type=int, required=True, help="Id do MapaMundo.")
+        parser.add_argument('--lote', type=int, default=2000, help="Assentamentos por lote.")
+
+    def handle(self, *args, **options):
+        if not MapaMundo.objects.filter(pk=options['mapa']).exists():
+            raise CommandError(f"MapaMundo {options['mapa']} não existe.")
+        totais = reatribuir_biomas(options['mapa'], lote=options['lote'])
+        self.stdout.write(
+            f"{totais['assentamentos']} assentamentos verificados, "
+            f"{totais['inseridos']} vínculos criados, {totais['removidos']} removidos."
+        )
@@ -0,0 +1,40 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from mapa.tarefas import executar_proxima
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Consome a fila de tarefas (processamento de imagens de mapa)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=2.0,
+                            help="Segundos de espera quando a fila está vazia (ou após uma falha).")
+        parser.add_argument('--uma-vez', action='store_true',
+                            help="Esvazia a fila e encerra, sem aguardar novas tarefas.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Worker de tarefas iniciado.")
+        while True:
+            # Como entre requests: descarta conexões vencidas (DB_CONN_MAX_AGE) ou quebradas
+            close_old_connections()
+            try:
+                t = executar_proxima()
+            except Exception:
+                # Banco reiniciado, conexão do pool derrubada etc.: o worker continua
+                logger.exception("Falha ao consumir a fila de tarefas")
+                if options['uma_vez']:
+                    return
+                time.sleep(options['intervalo'])
+                continue
+            if t is not None:
+                self.stdout.write(f"{t}")
+                continue
+            if options['uma_vez']:
+                return
+            time.sleep(options['intervalo'])
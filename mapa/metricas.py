@@ -0,0 +1,265 @@
+"""
+Métricas por request: consultas SQL (quantidade e tempo), tempo de serialização
+(renderização JSON das respostas do DRF, no JSONRendererMedido), tempo de
+chamadas ao storage e tamanho da resposta.
+
+O MetricasMiddleware abre uma medição por request (num contextvar, que também
+chega às threads de sync_to_async), devolve os tempos no cabeçalho
+``Server-Timing``, registra uma linha JSON no logger ``mapa.metricas`` (INFO;
+WARNING acima de METRICAS_LENTO_MS) e acumula as últimas METRICAS_AMOSTRAS
+medições de cada rota, cujos percentis saem em ``/health/metrics``. A
+serialização é medida num ponto só, o renderer padrão do DRF: vale para toda
+view da API sem instrumentação própria (o ``.data`` montado na view entra no
+total, não em ``ser``).
+"""
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.renderers import JSONRenderer
+
+from setup.storage_backends import GeneratedStorage, MediaStorage
+
+logger = logging.getLogger(__name__)
+
+CATEGORIAS = ('db', 'ser', 'storage')
+
+_atual = ContextVar('metricas_medicao', default=None)
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) pelo método nearest-rank; None para lista vazia."""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+class Medicao:
+    """Tempos (s) por categoria e consultas de um request."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.tempos = dict.fromkeys(CATEGORIAS, 0.0)
+        self.consultas = 0
+        self._profundidade = dict.fromkeys(CATEGORIAS, 0)
+
+    def ms(self, categoria):
+        return round(self.tempos[categoria] * 1000, 2)
+
+
+@contextmanager
+def medir(categoria):
+    """Soma o tempo do bloco à categoria do request atual; blocos aninhados contam uma vez."""
+    medicao = _atual.get()
+    if medicao is None or medicao._profundidade[categoria]:
+        yield
+        return
+    medicao._profundidade[categoria] += 1
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicao.tempos[categoria] += time.perf_counter() - inicio
+        medicao._profundidade[categoria] -= 1
+
+
+def _medir_consulta(execute, sql, params, many, context):
+    medicao = _atual.get()
+    if medicao is None:
+        return execute(sql, params, many, context)
+    medicao.consultas += 1
+    with medir('db'):
+        return execute(sql, params, many, context)
+
+
+def _instrumentar_conexao(conexao):
+    if _medir_consulta not in conexao.execute_wrappers:
+        conexao.execute_wrappers.append(_medir_consulta)
+
+
+def _ao_conectar(sender, connection, **kwargs):
+    _instrumentar_conexao(connection)
+
+
+_instalado = False
+
+
+def instalar():
+    """Liga a medição de consultas (idempotente; feito pelo middleware)."""
+    global _instalado
+    if _instalado:
+        return
+    _instalado = True
+    connection_created.connect(_ao_conectar, dispatch_uid='mapa.metricas')
+    for conexao in connections.all(initialized_only=True):
+        _instrumentar_conexao(conexao)
+
+
+class JSONRendererMedido(JSONRenderer):
+    """JSONRenderer do DRF com o tempo de renderização somado à métrica ``ser``."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with medir('ser'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class StorageMedidoMixin:
+    """Mixin para backends de storage: soma o tempo das chamadas à métrica ``storage``."""
+
+    def save(self, *args, **kwargs):
+        with medir('storage'):
+            return super().save(*args, **kwargs)
+
+    def open(self, *args, **kwargs):
+        with medir('storage'):
+            return super().open(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with medir('storage'):
+            return super().delete(*args, **kwargs)
+
+    def exists(self, *args, **kwargs):
+        with medir('storage'):
+            return super().exists(*args, **kwargs)
+
+    def listdir(self, *args, **kwargs):
+        with medir('storage'):
+            return super().listdir(*args, **kwargs)
+
+    def size(self, *args, **kwargs):
+        with medir('storage'):
+            return super().size(*args, **kwargs)
+
+    def url(self, *args, **kwargs):
+        with medir('storage'):
+            return super().url(*args, **kwargs)
+
+
+class MediaStorageMedido(StorageMedidoMixin, MediaStorage):
+    """MediaStorage com as chamadas medidas (BACKEND em settings.STORAGES)."""
+
+
+class GeneratedStorageMedido(StorageMedidoMixin, GeneratedStorage):
+    """GeneratedStorage com as chamadas medidas (BACKEND em settings.STORAGES)."""
+
+
+class Agregador:
+    """Últimas medições de cada rota, num buffer circular por rota; seguro entre threads."""
+
+    def __init__(self, amostras):
+        self.amostras = amostras
+        self._rotas = {}
+        self._totais = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, rota, total_ms, db_ms, consultas, ser_ms, storage_ms, tamanho):
+        with self._lock:
+            if rota not in self._rotas:
+                self._rotas[rota] = deque(maxlen=self.amostras)
+                self._totais[rota] = 0
+            self._rotas[rota].append((total_ms, db_ms, consultas, ser_ms, storage_ms, tamanho))
+            self._totais[rota] += 1
+
+    def resumo(self):
+        """{rota: {requests, amostras, p50/p95/p99 do total e p95 de cada métrica}}."""
+        with self._lock:
+            rotas = {rota: (list(medidas), self._totais[rota]) for rota, medidas in self._rotas.items()}
+        resumo = {}
+        for rota, (medidas, total) in sorted(rotas.items()):
+            colunas = list(zip(*medidas))
+            tamanhos = [t for t in colunas[5] if t is not None]
+            resumo[rota] = {
+                'requests': total,
+                'amostras': len(medidas),
+                **{f'total_p{p}_ms': percentil(colunas[0], p) for p in (50, 95, 99)},
+                'db_p95_ms': percentil(colunas[1], 95),
+                'consultas_p95': percentil(colunas[2], 95),
+                'ser_p95_ms': percentil(colunas[3], 95),
+                'storage_p95_ms': percentil(colunas[4], 95),
+                'bytes_p95': percentil(tamanhos, 95),
+            }
+        return resumo
+
+    def limpar(self):
+        with self._lock:
+            self._rotas.clear()
+            self._totais.clear()
+
+
+agregador = Agregador(getattr(settings, 'METRICAS_AMOSTRAS', 1000))
+
+
+def _rota(request):
+    """Método e padrão da URL (sem o ``$`` das rotas do router), ou ``<sem rota>`` (ex.: 404)."""
+    rota = getattr(request, 'resolver_match', None)
+    return f"{request.method} /{rota.route.removesuffix('$')}" if rota else f"{request.method} <sem rota>"
+
+
+class MetricasMiddleware:
+    """Mede cada request (síncrono ou assíncrono) e publica Server-Timing, log e agregados."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.assincrono = iscoroutinefunction(get_response)
+        if self.assincrono:
+            markcoroutinefunction(self)
+        instalar()
+
+    def __call__(self, request):
+        if self.assincrono:
+            return self.__acall__(request)
+        for conexao in connections.all(initialized_only=True):
+            _instrumentar_conexao(conexao)
+        medicao = Medicao()
+        token = _atual.set(medicao)
+        try:
+            response = self.get_response(request)
+        finally:
+            _atual.reset(token)
+        return self.concluir(request, response, medicao)
+
+    async def __acall__(self, request):
+        medicao = Medicao()
+        token = _atual.set(medicao)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _atual.reset(token)
+        return self.concluir(request, response, medicao)
+
+    def concluir(self, request, response, medicao):
+        total_ms = round((time.perf_counter() - medicao.inicio) * 1000, 2)
+        # Respostas em streaming ainda não produziram o corpo: tamanho desconhecido
+        tamanho = None if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={medicao.ms("db")};desc="{medicao.consultas} consultas"',
+            f'ser;dur={medicao.ms("ser")}',
+            f'storage;dur={medicao.ms("storage")}',
+            f'total;dur={total_ms}',
+        ])
+        rota = _rota(request)
+        agregador.registrar(rota, total_ms, medicao.ms('db'), medicao.consultas,
+                            medicao.ms('ser'), medicao.ms('storage'), tamanho)
+
+        registro = {
+            'rota': rota, 'caminho': request.path, 'status': response.status_code,
+            'total_ms': total_ms, 'db_ms': medicao.ms('db'), 'consultas': medicao.consultas,
+            'ser_ms': medicao.ms('ser'), 'storage_ms': medicao.ms('storage'), 'bytes': tamanho,
+        }
+        nivel = logging.WARNING if total_ms >= getattr(settings, 'METRICAS_LENTO_MS', 1000) else logging.INFO
+        if logger.isEnabledFor(nivel):
+            logger.log(nivel, json.dumps(registro, ensure_ascii=False), extra={'metricas': registro})
+        return response
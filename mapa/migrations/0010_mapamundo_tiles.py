@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0009_alter_personagem_raca'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapamundo',
+            name='tiles_origem',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='mapamundo',
+            name='tiles_zoom_max',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
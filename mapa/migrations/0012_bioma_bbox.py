@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:14
+
+from django.db import migrations, models
+
+
+def _vertices(poligonos):
+    """Vértices [x, y] de Bioma.poligonos em qualquer nível de aninhamento (cópia congelada)."""
+    for item in poligonos or []:
+        if not isinstance(item, (list, tuple)) or not item:
+            continue
+        if len(item) >= 2 and all(isinstance(v, (int, float)) for v in item[:2]):
+            yield item
+        else:
+            yield from _vertices(item)
+
+
+def calcular_bbox(apps, schema_editor):
+    Bioma = apps.get_model('mapa', 'Bioma')
+    for bioma in Bioma.objects.all():
+        vertices = list(_vertices(bioma.poligonos))
+        if vertices:
+            xs = [v[0] for v in vertices]
+            ys = [v[1] for v in vertices]
+            bioma.bbox_min_x, bioma.bbox_min_y, bioma.bbox_max_x, bioma.bbox_max_y = min(xs), min(ys), max(xs), max(ys)
+            bioma.save(update_fields=['bbox_min_x', 'bbox_min_y', 'bbox_max_x', 'bbox_max_y'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0011_mapamundo_status_tarefa'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bioma',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='bioma',
+            name='bbox_max_x',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='bioma',
+            name='bbox_max_y',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='bioma',
+            name='bbox_min_x',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='bioma',
+            name='bbox_min_y',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(calcular_bbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+def _eh_ponto(valor):
+    return (isinstance(valor, (list, tuple)) and len(valor) >= 2
+            and isinstance(valor[0], (int, float)) and isinstance(valor[1], (int, float)))
+
+
+def _aneis(poligonos):
+    """Anéis de Bioma.poligonos em qualquer nível de aninhamento (cópia congelada)."""
+    for item in poligonos or []:
+        if not isinstance(item, (list, tuple)) or not item:
+            continue
+        if _eh_ponto(item[0]):
+            yield item
+        else:
+            yield from _aneis(item)
+
+
+def contar_vertices(apps, schema_editor):
+    Bioma = apps.get_model('mapa', 'Bioma')
+    for bioma in Bioma.objects.all():
+        bioma.n_vertices = sum(len(anel) for anel in _aneis(bioma.poligonos))
+        bioma.save(update_fields=['n_vertices'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0012_bioma_bbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bioma',
+            name='n_vertices',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(contar_vertices, migrations.RunPython.noop),
+    ]
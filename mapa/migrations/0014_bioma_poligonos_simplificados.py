@@ -0,0 +1,100 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+# Cópia congelada da simplificação de mapa.geometria (niveis_de_detalhe) no
+# momento desta migração: mudanças no código do app não alteram o que ela grava.
+TOLERANCIAS = (1, 2, 4, 8, 16, 32)
+
+
+def _eh_ponto(valor):
+    return (isinstance(valor, (list, tuple)) and len(valor) >= 2
+            and isinstance(valor[0], (int, float)) and isinstance(valor[1], (int, float)))
+
+
+def _aneis(poligonos):
+    for item in poligonos or []:
+        if not isinstance(item, (list, tuple)) or not item:
+            continue
+        if _eh_ponto(item[0]):
+            yield item
+        else:
+            yield from _aneis(item)
+
+
+def _distancia_segmento(p, a, b):
+    ax, ay = a[0], a[1]
+    dx, dy = b[0] - ax, b[1] - ay
+    comprimento2 = dx * dx + dy * dy
+    if comprimento2 == 0:
+        return ((p[0] - ax) ** 2 + (p[1] - ay) ** 2) ** 0.5
+    t = max(0.0, min(1.0, ((p[0] - ax) * dx + (p[1] - ay) * dy) / comprimento2))
+    return ((p[0] - ax - t * dx) ** 2 + (p[1] - ay - t * dy) ** 2) ** 0.5
+
+
+def _simplificar_anel(anel, tolerancia):
+    n = len(anel)
+    if n <= 3 or tolerancia <= 0:
+        return list(anel)
+    manter = [False] * n
+    manter[0] = manter[-1] = True
+    pilha = [(0, n - 1)]
+    while pilha:
+        ini, fim = pilha.pop()
+        maior, indice = 0.0, None
+        for k in range(ini + 1, fim):
+            d = _distancia_segmento(anel[k], anel[ini], anel[fim])
+            if d > maior:
+                maior, indice = d, k
+        if indice is not None and maior > tolerancia:
+            manter[indice] = True
+            pilha.append((ini, indice))
+            pilha.append((indice, fim))
+    resultado = [ponto for ponto, fica in zip(anel, manter) if fica]
+    if len(resultado) < 3:
+        return [anel[0], anel[n // 3], anel[2 * n // 3]]
+    return resultado
+
+
+def _simplificar(poligonos, tolerancia):
+    resultado = []
+    for item in poligonos or []:
+        if not isinstance(item, (list, tuple)) or not item:
+            continue
+        resultado.append(_simplificar_anel(item, tolerancia) if _eh_ponto(item[0]) else _simplificar(item, tolerancia))
+    return resultado
+
+
+def _niveis_de_detalhe(poligonos):
+    niveis = {}
+    anterior = sum(len(anel) for anel in _aneis(poligonos))
+    for tolerancia in TOLERANCIAS:
+        simplificado = _simplificar(poligonos, tolerancia)
+        total = sum(len(anel) for anel in _aneis(simplificado))
+        if total < anterior:
+            niveis[str(tolerancia)] = simplificado
+            anterior = total
+    return niveis
+
+
+def simplificar_existentes(apps, schema_editor):
+    Bioma = apps.get_model('mapa', 'Bioma')
+    for bioma in Bioma.objects.all():
+        bioma.poligonos_simplificados = _niveis_de_detalhe(bioma.poligonos)
+        bioma.save(update_fields=['poligonos_simplificados'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0013_bioma_n_vertices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bioma',
+            name='poligonos_simplificados',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(simplificar_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0014_bioma_poligonos_simplificados'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assentamento',
+            index=models.Index(fields=['mapa', 'pos_x', 'pos_y'], name='mapa_assent_mapa_id_760ce7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bioma',
+            index=models.Index(fields=['mapa', 'bbox_min_x', 'bbox_min_y'], name='mapa_bioma_mapa_id_e9d76f_idx'),
+        ),
+    ]
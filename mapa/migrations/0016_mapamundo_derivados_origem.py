@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0015_indices_viewport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapamundo',
+            name='derivados_origem',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0016_mapamundo_derivados_origem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapamundo',
+            name='formato',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+    ]
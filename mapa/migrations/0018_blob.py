@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+def reprocessar_mapas(apps, schema_editor):
+    """Reprocessa os mapas existentes: tiles e derivados passam a ser chaveados pelo hash.
+
+    Não acessa o storage: o Blob de cada imagem (com o tamanho real) é registrado
+    pelo process_mapa (blobs.registrar).
+    """
+    MapaMundo = apps.get_model('mapa', 'MapaMundo')
+    Tarefa = apps.get_model('mapa', 'Tarefa')
+    for mapa_id in MapaMundo.objects.exclude(imagem='').values_list('pk', flat=True):
+        MapaMundo.objects.filter(pk=mapa_id).update(tiles_origem='', derivados_origem='')
+        # Único reprocessamento dos mapas existentes na cadeia de migrações (tiles,
+        # derivados e checksum das migrações anteriores vêm todos daqui)
+        if not Tarefa.objects.filter(nome='process_mapa', estado='pendente', argumentos={'mapa_id': mapa_id}).exists():
+            Tarefa.objects.create(nome='process_mapa', argumentos={'mapa_id': mapa_id})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0017_mapamundo_formato'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('nome', models.CharField(max_length=255, unique=True)),
+                ('tamanho', models.PositiveBigIntegerField()),
+                ('referencias', models.PositiveIntegerField(default=0)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(reprocessar_mapas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0018_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapamundo',
+            name='revisao',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
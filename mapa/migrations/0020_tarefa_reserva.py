@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mapa', '0019_mapamundo_revisao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarefa',
+            name='disponivel_em',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='tarefa',
+            name='reservada_ate',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
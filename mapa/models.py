@@ -1,5 +1,10 @@
+from django.core.files.storage import storages
 from django.db import models
-from django.core.files.images import get_image_dimensions
+from django.utils import timezone
+
+from mapa.geometria import (  # noqa: F401 (ponto_em_poligono reexportado)
+    aneis, caixa_envolvente, escolher_nivel, niveis_de_detalhe, ponto_em_poligono,
+)
 
 class Bioma(models.Model):
     '''
@@ -31,38 +36,121 @@ class Bioma(models.Model):
     mapa = models.ForeignKey('MapaMundo', on_delete=models.CASCADE, related_name='biomas', null=True, blank=True)
     # cor sugerida para exibição
     cor = models.CharField(max_length=7, default='#88cc66', blank=True)
+    # Caixa envolvente dos polígonos (px), recalculada no save; base do índice espacial (mapa.indice)
+    bbox_min_x = models.FloatField(editable=False, null=True, blank=True)
+    bbox_min_y = models.FloatField(editable=False, null=True, blank=True)
+    bbox_max_x = models.FloatField(editable=False, null=True, blank=True)
+    bbox_max_y = models.FloatField(editable=False, null=True, blank=True)
+    # Total de vértices dos polígonos (exibido nas listagens, que não trazem a geometria)
+    n_vertices = models.PositiveIntegerField(editable=False, default=0)
+    # Versões simplificadas por tolerância em px, recalculadas no save. Ex: {"4": [...], "16": [...]}
+    poligonos_simplificados = models.JSONField(editable=False, default=dict, blank=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    # Colunas pesadas, adiadas (defer) onde só o resumo do bioma é usado
+    CAMPOS_GEOMETRIA = ('poligonos', 'poligonos_simplificados')
 
     class Meta:
         ordering = ["nome"]
+        # Consultas por viewport (bbox) e tiles vetoriais
+        indexes = [models.Index(fields=["mapa", "bbox_min_x", "bbox_min_y"])]
     
     def __str__(self):
         return self.nome
 
+    def poligonos_para(self, tolerancia=None):
+        """Polígonos no nível de detalhe adequado à tolerância (px); completos se None."""
+        if tolerancia is None:
+            return self.poligonos
+        chave = escolher_nivel(self.poligonos_simplificados or {}, tolerancia)
+        return self.poligonos if chave is None else self.poligonos_simplificados[chave]
+
+    def save(self, *args, **kwargs):
+        caixa = caixa_envolvente(self.poligonos) or (None, None, None, None)
+        self.bbox_min_x, self.bbox_min_y, self.bbox_max_x, self.bbox_max_y = caixa
+        self.n_vertices = sum(len(anel) for anel in aneis(self.poligonos))
+        self.poligonos_simplificados = niveis_de_detalhe(self.poligonos)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'poligonos' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {
+                'bbox_min_x', 'bbox_min_y', 'bbox_max_x', 'bbox_max_y', 'n_vertices', 'poligonos_simplificados',
+            }
+        super().save(*args, **kwargs)
+
 
 class MapaMundo(models.Model):
     """
     Mapa de Mundo para o RPG. Contém a imagem base e suas dimensões.
-    A imagem é usada como "tile" único (CRS.Simple) para posicionar Assentamentos por pixel (pos_x,pos_y).
+    A imagem é cortada em uma pirâmide de tiles z/x/y (CRS.Simple) e os Assentamentos
+    são posicionados por pixel (pos_x,pos_y) da imagem original.
+    Dimensões, tiles, derivados (miniatura/prévia) e checksum são calculados pela tarefa `process_mapa`
+    (mapa.tarefas), fora do request de upload.
     """
+    STATUS = (
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('pronto', 'Pronto'),
+        ('erro', 'Erro'),
+    )
+
     nome = models.CharField(max_length=120, unique=True)
     imagem = models.ImageField(upload_to='mapas/')
     largura = models.PositiveIntegerField(editable=False, null=True, blank=True)
     altura = models.PositiveIntegerField(editable=False, null=True, blank=True)
+    # Formato da imagem segundo o Pillow (ex.: PNG, JPEG), sondado junto com as dimensões
+    formato = models.CharField(max_length=16, editable=False, blank=True, default='')
     criado_em = models.DateTimeField(auto_now_add=True)
+    # Nível de maior resolução da pirâmide de tiles (nulo enquanto não gerada)
+    tiles_zoom_max = models.PositiveSmallIntegerField(editable=False, null=True, blank=True)
+    # SHA-256 da imagem a partir da qual os tiles atuais foram gerados
+    tiles_origem = models.CharField(max_length=255, editable=False, blank=True, default='')
+    # Estado do processamento assíncrono da imagem
+    status = models.CharField(max_length=12, choices=STATUS, default='pendente', editable=False)
+    status_erro = models.TextField(editable=False, blank=True, default='')
+    # SHA-256 da imagem original
+    checksum = models.CharField(max_length=64, editable=False, blank=True, default='')
+    # Arquivos derivados da imagem no storage (mapa.imagens.gerar_derivados).
+    # Ex: {"miniatura": "mapas/derivados/<sha256>/miniatura.jpg", "miniatura_webp": "mapas/derivados/<sha256>/miniatura.webp"}
+    derivados = models.JSONField(editable=False, default=dict, blank=True)
+    # SHA-256 da imagem a partir da qual os derivados atuais foram gerados
+    derivados_origem = models.CharField(max_length=255, editable=False, blank=True, default='')
+    # Incrementada a cada edição do mapa ou de seus biomas/assentamentos/personagens
+    # (cache.invalidar_mapa); versiona o bootstrap da página do mapa
+    revisao = models.PositiveIntegerField(editable=False, default=0)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Permite detectar troca de imagem no save()
+        self._imagem_original = self.imagem.name if self.imagem else ''
 
     def save(self, *args, **kwargs):
-        # Salva primeiro para garantir que o arquivo exista em disco
+        from mapa import blobs
+        checksum = ''
+        if self.imagem and not self.imagem._committed:
+            # Upload novo: grava sob a chave do conteúdo (ou reaproveita o arquivo idêntico)
+            nome, checksum = blobs.armazenar(self.imagem)
+            self.imagem = nome
+        imagem_mudou = bool(self.imagem) and (self._state.adding or self.imagem.name != self._imagem_original)
+        if imagem_mudou:
+            self.largura = self.altura = None
+            self.formato = ''
+            self.checksum = checksum
+            self.status, self.status_erro = 'pendente', ''
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            # revisao só muda por UPDATE atômico: salvar uma instância antiga não a faz voltar
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'revisao']
         super().save(*args, **kwargs)
-        # Após salvar, se não houver dimensões persistidas, calcule-as
-        if self.imagem and (not self.largura or not self.altura):
-            try:
-                w, h = get_image_dimensions(self.imagem)
-                type(self).objects.filter(pk=self.pk).update(largura=w, altura=h)
-                # Também atualiza em memória para quem usa a instância após save
-                self.largura, self.altura = w, h
-            except Exception:
-                # Evita quebrar o fluxo caso Pillow não esteja disponível ou arquivo inválido
-                pass
+        if imagem_mudou:
+            blobs.trocar_referencia(self._imagem_original, self.imagem.name)
+            self._imagem_original = self.imagem.name
+            from mapa.tarefas import enfileirar
+            enfileirar('process_mapa', mapa_id=self.pk)
+
+    @property
+    def urls_derivados(self):
+        """{chave: url} dos derivados no storage, na mesma chave de `derivados`."""
+        storage = storages['derivados']
+        return {chave: storage.url(nome) for chave, nome in (self.derivados or {}).items()}
 
     def __str__(self):
         return self.nome
@@ -274,25 +362,56 @@ class Assentamento(models.Model):
 
     class Meta:
         ordering = ["nome"]
+        # Consultas por viewport (bbox) nos marcadores e tiles vetoriais
+        indexes = [models.Index(fields=["mapa", "pos_x", "pos_y"])]
     
     def __str__(self):
         return self.nome
 
-    # Utilitário: checa se um ponto (x,y) está dentro de algum polígono do bioma
-def ponto_em_poligono(x: float, y: float, poligono: list[list[float]]):
-    # Ray casting (par ímpar)
-    inside = False
-    n = len(poligono)
-    if n < 3:
-        return False
-    j = n - 1
-    for i in range(n):
-        xi, yi = poligono[i]
-        xj, yj = poligono[j]
-        intersect = ((yi > y) != (yj > y)) and (
-            x < (xj - xi) * (y - yi) / (yj - yi + 1e-12) + xi
-        )
-        if intersect:
-            inside = not inside
-        j = i
-    return inside
\ No newline at end of file
+class Blob(models.Model):
+    """
+    Arquivo de imagem no storage, endereçado pelo conteúdo e compartilhado
+    pelos mapas com a mesma imagem (mapa.blobs).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    nome = models.CharField(max_length=255, unique=True)
+    tamanho = models.PositiveBigIntegerField()
+    # Quantos MapaMundo usam o arquivo; em zero o arquivo e seus derivados são apagados
+    referencias = models.PositiveIntegerField(default=0)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.referencias} ref.)"
+
+class Tarefa(models.Model):
+    """
+    Fila de tarefas em banco (processamento pesado fora do request).
+    Enfileirada por mapa.tarefas.enfileirar e consumida por `python manage.py worker`.
+    """
+    ESTADO = (
+        ('pendente', 'Pendente'),
+        ('executando', 'Executando'),
+        ('concluida', 'Concluída'),
+        ('erro', 'Erro'),
+    )
+
+    nome = models.CharField(max_length=60)
+    argumentos = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=12, choices=ESTADO, default='pendente')
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    erro = models.TextField(blank=True, default='')
+    criado_em = models.DateTimeField(auto_now_add=True)
+    # Nova tentativa só a partir daqui (espera crescente após cada falha)
+    disponivel_em = models.DateTimeField(default=timezone.now)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    # Fim da reserva do worker que executa a tarefa, renovado enquanto ela avança;
+    # vencida, outro worker pode retomá-la (o anterior morreu no meio)
+    reservada_ate = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["criado_em"]
+        indexes = [models.Index(fields=["estado", "criado_em"])]
+
+    def __str__(self):
+        return f"{self.nome} #{self.pk} ({self.estado})"
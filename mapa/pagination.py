@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class NomeCursorPagination(CursorPagination):
+    """Paginação por cursor na ordem por nome (único em Bioma, Personagem, Loja e Assentamento)."""
+    ordering = 'nome'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
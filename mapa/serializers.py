@@ -1,7 +1,43 @@
 from django.contrib.auth.models import Group, User
+from mapa.lote import RelacionadoEmLote
 from mapa.models import Bioma, Personagem, Loja, Assentamento, MapaMundo
 from rest_framework import serializers
 
+class CamposDinamicosMixin:
+    """
+    Campos esparsos via query string (apenas GET, serializer raiz da requisição):
+    ?fields=id,nome restringe os campos de primeiro nível e ?expand=personagens
+    escolhe quais relações aninhadas (Meta.expansiveis) são embutidas. Sem
+    ?expand todas as relações aninhadas são embutidas, como antes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        incluidos = self.campos_incluidos(self.context.get('request'))
+        if incluidos is not None:
+            for nome in set(self.fields) - incluidos:
+                self.fields.pop(nome)
+
+    @classmethod
+    def campos_incluidos(cls, request):
+        """Nomes dos campos que serão renderizados para a requisição, ou None para todos."""
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return None
+        params = request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return None
+        campos = set(cls().get_fields()) if 'fields' not in params else _lista(params['fields'])
+        if 'expand' in params:
+            expandir = _lista(params['expand'])
+            expansiveis = set(getattr(cls.Meta, 'expansiveis', ()))
+            campos = (campos - expansiveis) | (expandir & expansiveis)
+        return campos
+
+
+def _lista(valor):
+    return {v.strip() for v in valor.split(',') if v.strip()}
+
+
 class UserSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = User
@@ -12,13 +48,42 @@ class GroupSerializer(serializers.HyperlinkedModelSerializer):
         model = Group
         fields = ["url", "name"]
 
-class BiomaSerializer(serializers.ModelSerializer):
+class BiomaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = Bioma
-        fields = '__all__'
+        exclude = ['poligonos_simplificados']
         read_only_fields = ['largura','altura']
+
+class BiomaResumoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    """Bioma sem a geometria: usado em listagens e embutido em assentamentos."""
+    bbox = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Bioma
+        fields = ["id", "nome", "tipo", "cor", "mapa", "bbox", "n_vertices"]
+
+    def get_bbox(self, obj):
+        if obj.bbox_min_x is None:
+            return None
+        return [obj.bbox_min_x, obj.bbox_min_y, obj.bbox_max_x, obj.bbox_max_y]
+
+class BiomaGeometriaSerializer(serializers.ModelSerializer):
+    """Só o necessário para desenhar o bioma no mapa.
+
+    Com ``tolerancia`` (px) no contexto, os polígonos vêm no nível de detalhe correspondente.
+    """
+    poligonos = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Bioma
+        fields = ["id", "nome", "cor", "poligonos"]
+
+    def get_poligonos(self, obj):
+        return obj.poligonos_para(self.context.get('tolerancia'))
         
-class PersonagemSerializer(serializers.ModelSerializer):
+class PersonagemSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    # Chaves estrangeiras resolvidas em uma consulta por campo nos lotes (mapa.lote)
+    serializer_related_field = RelacionadoEmLote
     aparencia_display = serializers.CharField(source='get_aparencia_display', read_only=True)
     segredo_display = serializers.CharField(source='get_segredo_display', read_only=True)
     origem_nome = serializers.CharField(source='origem.nome', read_only=True)
@@ -27,15 +92,17 @@ class PersonagemSerializer(serializers.ModelSerializer):
         model = Personagem
         fields = '__all__'
 
-class LojaSerializer(serializers.ModelSerializer):
+class LojaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    serializer_related_field = RelacionadoEmLote
     class Meta:
         model = Loja
         fields = '__all__'
 
-class AssentamentoSerializer(serializers.ModelSerializer):
+class AssentamentoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    serializer_related_field = RelacionadoEmLote
     # Embute os personagens que têm origem neste assentamento
     personagens = serializers.SerializerMethodField()
-    bioma = BiomaSerializer(many=True, read_only=True)
+    bioma = BiomaResumoSerializer(many=True, read_only=True)
     lojas = serializers.SerializerMethodField()
     tipo_display = serializers.CharField(source='get_tipo_display', read_only=True)
     lider_display = serializers.CharField(source='get_lider_display', read_only=True)
@@ -44,6 +111,7 @@ class AssentamentoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Assentamento
         fields = '__all__'
+        expansiveis = ('personagens', 'lojas', 'bioma')
 
     def get_personagens(self, obj):
         # Usa o reverse accessor padrão personagem_set
@@ -68,6 +136,24 @@ class AssentamentoMarkerSerializer(serializers.ModelSerializer):
         fields = ["id", "nome", "tipo", "tipo_display", "pos_x", "pos_y", "mapa", "personagem_count", "bioma_ids"]
 
 class MapaMundoSerializer(serializers.ModelSerializer):
+    # Template para L.tileLayer; nulo enquanto a pirâmide de tiles não existir
+    tiles_url = serializers.SerializerMethodField()
+    # URLs dos derivados (JPEG; nulos enquanto não gerados) e de todas as variantes
+    miniatura_url = serializers.SerializerMethodField()
+    previa_url = serializers.SerializerMethodField()
+    derivados_urls = serializers.ReadOnlyField(source='urls_derivados')
+
     class Meta:
         model = MapaMundo
         fields = "__all__"
+
+    def get_tiles_url(self, obj):
+        if obj.tiles_zoom_max is None:
+            return None
+        return f"/api/mapas/{obj.pk}/imagem/{{z}}/{{x}}/{{y}}/"
+
+    def get_miniatura_url(self, obj):
+        return obj.urls_derivados.get('miniatura')
+
+    def get_previa_url(self, obj):
+        return obj.urls_derivados.get('previa')
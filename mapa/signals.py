@@ -0,0 +1,83 @@
+"""Receivers que mantêm caches e arquivos derivados coerentes com as escritas no banco."""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from mapa import blobs, indice
+from mapa.cache import invalidar_mapa
+from mapa.models import Assentamento, Bioma, MapaMundo, Personagem
+
+_suspensa = ContextVar('invalidacao_suspensa', default=False)
+
+
+@contextmanager
+def invalidacao_suspensa():
+    """Desliga a invalidação do cache por objeto dentro do bloco.
+
+    Para escritas em lote que disparam signals por linha (ex.: QuerySet.delete):
+    quem usa invalida cada mapa afetado uma vez, ao sair.
+    """
+    token = _suspensa.set(True)
+    try:
+        yield
+    finally:
+        _suspensa.reset(token)
+
+
+@receiver([post_save, post_delete], sender=Bioma)
+def bioma_alterado(sender, instance, **kwargs):
+    if instance.mapa_id:
+        indice.invalidar(instance.mapa_id)
+        if not _suspensa.get():
+            invalidar_mapa(instance.mapa_id)
+
+
+@receiver(pre_save, sender=Assentamento)
+@receiver(pre_save, sender=Personagem)
+def guardar_mapa_anterior(sender, instance, **kwargs):
+    # Um assentamento (ou a origem de um personagem) pode mudar de mapa no save
+    instance._mapa_anterior = None
+    if instance.pk and not _suspensa.get():
+        if sender is Assentamento:
+            anterior = sender.objects.filter(pk=instance.pk).values_list('mapa_id', flat=True)
+        else:
+            anterior = sender.objects.filter(pk=instance.pk).values_list('origem__mapa_id', flat=True)
+        instance._mapa_anterior = anterior.first()
+
+
+def _mapa_do_personagem(personagem):
+    return Assentamento.objects.filter(pk=personagem.origem_id).values_list('mapa_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Assentamento)
+@receiver([post_save, post_delete], sender=Personagem)
+def marcador_alterado(sender, instance, **kwargs):
+    if _suspensa.get():
+        return
+    atual = instance.mapa_id if sender is Assentamento else _mapa_do_personagem(instance)
+    for mapa_id in {atual, getattr(instance, '_mapa_anterior', None)} - {None}:
+        invalidar_mapa(mapa_id)
+
+
+@receiver(m2m_changed, sender=Assentamento.bioma.through)
+def biomas_do_assentamento_alterados(sender, instance, action, **kwargs):
+    # instance é o Assentamento (assentamento.bioma.set) ou o Bioma (bioma.assentamento_set.add)
+    if action in ('post_add', 'post_remove', 'post_clear') and instance.mapa_id and not _suspensa.get():
+        invalidar_mapa(instance.mapa_id)
+
+
+@receiver(post_save, sender=MapaMundo)
+def mapa_alterado(sender, instance, **kwargs):
+    # Metadados do mapa (status, dimensões, derivados) fazem parte do bootstrap
+    if not _suspensa.get():
+        invalidar_mapa(instance.pk)
+
+
+@receiver(post_delete, sender=MapaMundo)
+def mapa_removido(sender, instance, **kwargs):
+    if instance.imagem:
+        nome = instance.imagem.name
+        transaction.on_commit(lambda: blobs.liberar(nome))
@@ -0,0 +1,196 @@
+"""
+Fila de tarefas simples baseada em banco (modelo Tarefa).
+
+As tarefas são registradas com @tarefa('nome') e enfileiradas com
+enfileirar('nome', **argumentos). O comando `python manage.py worker` consome a
+fila; com settings.MAPA_TAREFAS_SINCRONAS a tarefa roda logo após o commit.
+
+Cada reserva vale MAPA_TAREFAS_RESERVA segundos e é renovada pela tarefa
+(renovar_reserva) enquanto avança; uma tarefa em 'executando' com a reserva
+vencida é de um worker que morreu e volta a ser reservável. Após uma falha a
+tarefa espera MAPA_TAREFAS_ESPERA * 2^(tentativas-1) segundos antes de voltar.
+"""
+import logging
+import traceback
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from mapa import blobs, imagens
+from mapa.cache import invalidar_mapa
+from mapa.models import MapaMundo, Tarefa
+
+logger = logging.getLogger(__name__)
+
+_REGISTRO = {}
+_DESISTENCIA = {}
+# Tarefa em execução neste contexto (para renovar_reserva)
+_em_execucao = ContextVar('tarefa_em_execucao', default=None)
+
+
+def tarefa(nome, ao_desistir=None):
+    """Registra a função como executora das tarefas `nome`.
+
+    `ao_desistir(**argumentos)` roda quando a tarefa é abandonada sem chegar ao
+    fim (tentativas esgotadas com o worker morto no meio).
+    """
+    def decorador(func):
+        _REGISTRO[nome] = func
+        if ao_desistir:
+            _DESISTENCIA[nome] = ao_desistir
+        return func
+    return decorador
+
+
+def enfileirar(nome, **argumentos) -> Tarefa:
+    if nome not in _REGISTRO:
+        raise ValueError(f"Tarefa desconhecida: {nome}")
+    t = Tarefa.objects.create(nome=nome, argumentos=argumentos)
+    if settings.MAPA_TAREFAS_SINCRONAS:
+        transaction.on_commit(lambda: _reservar(t.pk) and executar(Tarefa.objects.get(pk=t.pk)))
+    return t
+
+
+def _reservaveis(agora):
+    """Pendentes já disponíveis e em execução com a reserva vencida."""
+    return Tarefa.objects.filter(
+        Q(estado='pendente', disponivel_em__lte=agora) | Q(estado='executando', reservada_ate__lt=agora)
+    )
+
+
+def _reservar(pk) -> bool:
+    # UPDATE condicional ao estado lido: só um processo consegue a reserva
+    agora = timezone.now()
+    return bool(_reservaveis(agora).filter(pk=pk).update(
+        estado='executando', iniciado_em=agora, tentativas=F('tentativas') + 1,
+        reservada_ate=agora + timedelta(seconds=settings.MAPA_TAREFAS_RESERVA),
+    ))
+
+
+def renovar_reserva():
+    """Estende a reserva da tarefa em execução (batimento); sem efeito fora de uma tarefa."""
+    pk = _em_execucao.get()
+    if pk is not None:
+        Tarefa.objects.filter(pk=pk, estado='executando').update(
+            reservada_ate=timezone.now() + timedelta(seconds=settings.MAPA_TAREFAS_RESERVA))
+
+
+def reservar_proxima():
+    """Reserva a tarefa disponível mais antiga para este processo.
+
+    Vários workers podem disputar a mesma fila sem executar a tarefa duas vezes.
+    Retomar uma tarefa abandonada conta uma tentativa; esgotadas, ela vai para 'erro'.
+    """
+    while True:
+        t = _reservaveis(timezone.now()).order_by('criado_em').first()
+        if t is None:
+            return None
+        if not _reservar(t.pk):
+            continue
+        t.refresh_from_db()
+        if t.tentativas <= settings.MAPA_TAREFAS_MAX_TENTATIVAS:
+            return t
+        _desistir(t)
+
+
+def _desistir(t: Tarefa):
+    logger.error("Tarefa %s abandonada após %s tentativas", t, t.tentativas - 1)
+    t.tentativas -= 1
+    t.estado, t.erro = 'erro', (t.erro or 'Worker interrompido durante a execução.')
+    t.concluido_em = timezone.now()
+    t.save(update_fields=['estado', 'erro', 'tentativas', 'concluido_em'])
+    if t.nome in _DESISTENCIA:
+        _DESISTENCIA[t.nome](**t.argumentos)
+
+
+def executar(t: Tarefa) -> Tarefa:
+    """Executa uma tarefa reservada e registra o resultado; erros voltam para a fila
+    (após a espera) até o limite de tentativas."""
+    token = _em_execucao.set(t.pk)
+    try:
+        _REGISTRO[t.nome](**t.argumentos)
+    except Exception as e:
+        logger.error("Tarefa %s falhou (tentativa %s): %s", t, t.tentativas, e)
+        t.erro = traceback.format_exc()
+        if t.tentativas < settings.MAPA_TAREFAS_MAX_TENTATIVAS:
+            t.estado = 'pendente'
+            t.disponivel_em = timezone.now() + timedelta(
+                seconds=settings.MAPA_TAREFAS_ESPERA * 2 ** (t.tentativas - 1))
+        else:
+            t.estado = 'erro'
+    else:
+        t.estado, t.erro = 'concluida', ''
+    finally:
+        _em_execucao.reset(token)
+    t.concluido_em = timezone.now()
+    t.reservada_ate = None
+    t.save(update_fields=['estado', 'erro', 'disponivel_em', 'reservada_ate', 'concluido_em'])
+    return t
+
+
+def executar_proxima():
+    t = reservar_proxima()
+    return executar(t) if t else None
+
+
+# ----------------------- Tarefas registradas -----------------------
+
+def _atualizar_mapa(mapa_id, **campos):
+    # QuerySet.update não dispara post_save: invalida os payloads em cache (bootstrap, markers, tiles) aqui
+    MapaMundo.objects.filter(pk=mapa_id).update(**campos)
+    invalidar_mapa(mapa_id)
+
+
+def _mapa_abandonado(mapa_id):
+    _atualizar_mapa(mapa_id, status='erro',
+                    status_erro='Processamento interrompido (worker encerrado durante a tarefa).')
+
+
+@tarefa('process_mapa', ao_desistir=_mapa_abandonado)
+def processar_mapa(mapa_id):
+    """Dimensões, checksum, derivados (miniatura/prévia) e pirâmide de tiles da imagem de um MapaMundo."""
+    mapa = MapaMundo.objects.filter(pk=mapa_id).first()
+    if mapa is None or not mapa.imagem:
+        return
+    _atualizar_mapa(mapa.pk, status='processando', status_erro='')
+    try:
+        # Dimensões primeiro (lidas do cabeçalho, sem baixar a imagem): o editor
+        # já funciona (com overlay) antes dos tiles
+        if not (mapa.largura and mapa.altura and mapa.formato):
+            mapa.largura, mapa.altura, mapa.formato = imagens.sondar_imagem(mapa.imagem)
+            _atualizar_mapa(mapa.pk, largura=mapa.largura, altura=mapa.altura, formato=mapa.formato)
+        if not mapa.checksum:
+            mapa.checksum = imagens.calcular_checksum(mapa)
+            _atualizar_mapa(mapa.pk, checksum=mapa.checksum)
+        # Arquivo que não passou por blobs.armazenar (ex.: upload direto ao S3):
+        # se o conteúdo já existe, o mapa passa a usar o arquivo existente
+        nome = blobs.registrar(mapa.imagem.name, mapa.checksum, mapa.imagem.size)
+        if nome != mapa.imagem.name:
+            anterior = mapa.imagem.name
+            _atualizar_mapa(mapa.pk, imagem=nome)
+            mapa.imagem.name = mapa._imagem_original = nome
+            blobs.trocar_referencia(anterior, nome)
+
+        # Tiles e derivados são chaveados pelo conteúdo: só são gerados se nenhum
+        # outro mapa com a mesma imagem já os tiver
+        renovar_reserva()
+        sha = mapa.checksum
+        mesma_imagem = MapaMundo.objects.exclude(pk=mapa.pk).filter(checksum=sha)
+        campos = {}
+        if mapa.derivados_origem != sha:
+            pronto = mesma_imagem.filter(derivados_origem=sha).values('derivados').first()
+            campos['derivados'] = pronto['derivados'] if pronto else imagens.gerar_derivados(mapa)
+            campos['derivados_origem'] = sha
+            renovar_reserva()
+        if mapa.tiles_origem != sha:
+            pronto = mesma_imagem.filter(tiles_origem=sha).values('tiles_zoom_max').first()
+            campos['tiles_zoom_max'] = pronto['tiles_zoom_max'] if pronto else imagens.gerar_tiles(mapa)
+            campos['tiles_origem'] = sha
+        _atualizar_mapa(mapa.pk, status='pronto', **campos)
+    except Exception as e:
+        _atualizar_mapa(mapa.pk, status='erro', status_erro=str(e))
+        raise
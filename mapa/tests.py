@@ -1,3 +1,1152 @@
-from django.test import TestCase
+import importlib
+import io
+import math
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from botocore.stub import ANY, Stubber
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from mapa import geometria, imagens, indice, tarefas, uploads
+from mapa.gerador import PORTES
+from mapa.geometria import aneis, ponto_em_poligono
+from mapa.models import Assentamento, Bioma, Blob, Loja, MapaMundo, Personagem, Tarefa
+from mapa.tarefas import processar_mapa
+
+
+class ConsultasApiTests(APITestCase):
+    """Regressão de N+1: o número de consultas não pode crescer com o volume de dados."""
+
+    def setUp(self):
+        cache.clear()
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        self.biomas = [
+            Bioma.objects.create(nome=f'Bioma {i}', mapa=self.mapa, poligonos=[[0, 0], [10, 0], [10, 10]])
+            for i in range(2)
+        ]
+        self.total = 0
+
+    def popular(self, quantidade):
+        for _ in range(quantidade):
+            i = self.total
+            self.total += 1
+            a = Assentamento.objects.create(nome=f'Assentamento {i}', mapa=self.mapa, pos_x=i, pos_y=i)
+            a.bioma.set(self.biomas)
+            lojista = None
+            for j in range(3):
+                lojista = Personagem.objects.create(nome=f'Personagem {i}-{j}', raca='Humano', origem=a)
+            Loja.objects.create(nome=f'Loja {i}-a', assentamento=a, lojista=lojista)
+            Loja.objects.create(nome=f'Loja {i}-b', assentamento=a)
+
+    def contar_consultas(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return len(consultas)
+
+    def assertConsultasConstantes(self, url, esperado):
+        self.popular(1)
+        self.assertEqual(self.contar_consultas(url), esperado)
+        self.popular(15)
+        self.assertEqual(self.contar_consultas(url), esperado)
+
+    def test_lista_de_assentamentos(self):
+        # assentamentos + bioma + personagens + lojas
+        self.assertConsultasConstantes('/api/assentamentos/', 4)
+
+    def test_lista_de_assentamentos_por_mapa(self):
+        # + validação do filtro mapa (django-filter)
+        self.assertConsultasConstantes(f'/api/assentamentos/?mapa={self.mapa.pk}', 5)
+
+    def test_detalhe_do_assentamento(self):
+        self.popular(1)
+        a = Assentamento.objects.get()
+        self.assertEqual(self.contar_consultas(f'/api/assentamentos/{a.pk}/'), 4)
+        resposta = self.client.get(f'/api/assentamentos/{a.pk}/').json()
+        self.assertEqual(len(resposta['personagens']), 3)
+        self.assertEqual(resposta['personagens'][0]['origem_nome'], a.nome)
+        self.assertEqual(len(resposta['lojas']), 2)
+        self.assertEqual(len(resposta['bioma']), 2)
+
+    def test_markers(self):
+        # assentamentos (com contagem de personagens) + bioma
+        self.assertConsultasConstantes(f'/api/assentamentos/markers/?mapa={self.mapa.pk}', 2)
+
+    def test_bootstrap(self):
+        # mapa + biomas + assentamentos (com contagem de personagens) + bioma
+        self.assertConsultasConstantes(f'/api/mapas/{self.mapa.pk}/bootstrap/', 4)
+
+    def test_campos_esparsos_dispensam_prefetch(self):
+        # só a consulta de assentamentos: nenhuma relação aninhada pedida
+        self.assertConsultasConstantes('/api/assentamentos/?fields=id,nome', 1)
+        dados = self.client.get('/api/assentamentos/?fields=id,nome').json()
+        self.assertEqual(set(dados['results'][0]), {'id', 'nome'})
+
+    def test_expand_escolhe_relacoes_aninhadas(self):
+        # assentamentos + personagens
+        self.assertConsultasConstantes('/api/assentamentos/?expand=personagens', 2)
+        item = self.client.get('/api/assentamentos/?expand=personagens').json()['results'][0]
+        self.assertIn('personagens', item)
+        self.assertNotIn('lojas', item)
+        self.assertIn('nome', item)
+
+    def test_paginacao_por_cursor(self):
+        self.popular(3)
+        pagina = self.client.get('/api/assentamentos/?page_size=2&fields=nome').json()
+        self.assertEqual([a['nome'] for a in pagina['results']], ['Assentamento 0', 'Assentamento 1'])
+        seguinte = self.client.get(pagina['next']).json()
+        self.assertEqual([a['nome'] for a in seguinte['results']], ['Assentamento 2'])
+        self.assertIsNone(seguinte['next'])
+
+    def test_lista_de_personagens(self):
+        self.assertConsultasConstantes('/api/personagens/', 1)
+
+    def test_lista_de_lojas(self):
+        self.assertConsultasConstantes('/api/lojas/', 1)
+
+
+class BiomaApiTests(APITestCase):
+    def setUp(self):
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        self.bioma = Bioma.objects.create(
+            nome='Floresta', mapa=self.mapa, poligonos=[[[[0, 0], [10, 0], [10, 20]], [[30, 30], [40, 30], [40, 40]]]],
+        )
+
+    def test_listagem_sem_geometria(self):
+        item = self.client.get(f'/api/biomas/?mapa={self.mapa.pk}').json()['results'][0]
+        self.assertNotIn('poligonos', item)
+        self.assertEqual(item['bbox'], [0, 0, 40, 40])
+        self.assertEqual(item['n_vertices'], 6)
+
+    def test_migracao_conta_vertices(self):
+        from django.apps import apps
+        Bioma.objects.update(n_vertices=0)
+        importlib.import_module('mapa.migrations.0013_bioma_n_vertices').contar_vertices(apps, None)
+        self.assertEqual(Bioma.objects.get(pk=self.bioma.pk).n_vertices, 6)
+
+    def test_geometria_sob_demanda(self):
+        geo = self.client.get(f'/api/biomas/{self.bioma.pk}/geometria/').json()
+        self.assertEqual(geo['poligonos'], self.bioma.poligonos)
+        lote = self.client.get(f'/api/biomas/geometrias/?mapa={self.mapa.pk}').json()['results']
+        self.assertEqual([b['id'] for b in lote], [self.bioma.pk])
+
+    def test_nivel_de_detalhe_por_zoom(self):
+        # Círculo com 400 vértices: simplificado em zoom baixo, completo em zoom 0
+        circulo = [[500 + 100 * math.cos(k * math.pi / 200), 500 + 100 * math.sin(k * math.pi / 200)] for k in range(400)]
+        bioma = Bioma.objects.create(nome='Lago', mapa=self.mapa, poligonos=[[circulo]])
+        url = f'/api/biomas/{bioma.pk}/geometria/'
+
+        completo = self.client.get(url).json()['poligonos']
+        self.assertEqual(len(completo[0][0]), 400)
+        distante = self.client.get(url, {'zoom': -4}).json()['poligonos']
+        self.assertLess(len(distante[0][0]), 40)
+        self.assertGreaterEqual(len(distante[0][0]), 3)
+        self.assertEqual(self.client.get(url, {'zoom': 'x'}).status_code, 400)
+
+    def test_migracao_gera_os_mesmos_niveis(self):
+        from django.apps import apps
+        circulo = [[500 + 100 * math.cos(k * math.pi / 200), 500 + 100 * math.sin(k * math.pi / 200)] for k in range(400)]
+        bioma = Bioma.objects.create(nome='Lago', mapa=self.mapa, poligonos=[[circulo]])
+        Bioma.objects.update(poligonos_simplificados={})
+        importlib.import_module('mapa.migrations.0014_bioma_poligonos_simplificados').simplificar_existentes(apps, None)
+        bioma.refresh_from_db()
+        self.assertEqual(bioma.poligonos_simplificados, geometria.niveis_de_detalhe(bioma.poligonos))
+        self.assertIn('32', bioma.poligonos_simplificados)
+
+
+class TilesVetoriaisTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        Bioma.objects.create(nome='Campo', mapa=self.mapa, poligonos=[[[100, 100], [400, 100], [400, 400], [100, 400]]])
+        Assentamento.objects.create(nome='Vila', mapa=self.mapa, pos_x=300, pos_y=50)
+
+    def test_recorta_ao_tile(self):
+        # Zoom 0: tile 1/0 cobre x em [256, 512), y em [0, 256)
+        dados = self.client.get(f'/api/mapas/{self.mapa.pk}/tiles/0/1/0/').json()
+        self.assertEqual(dados['caixa'], [256, 0, 512, 256])
+        anel = dados['biomas'][0]['poligonos'][0]
+        self.assertEqual(min(p[0] for p in anel), 256)
+        self.assertEqual(max(p[1] for p in anel), 256)
+        self.assertEqual([a['nome'] for a in dados['assentamentos']], ['Vila'])
+        # Zoom -1: um só tile cobre 512 px e contém o bioma inteiro
+        dados = self.client.get(f'/api/mapas/{self.mapa.pk}/tiles/-1/0/0/').json()
+        self.assertEqual(len(dados['biomas'][0]['poligonos'][0]), 4)
+
+    def test_invalida_na_edicao(self):
+        url = f'/api/mapas/{self.mapa.pk}/tiles/0/0/0/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Assentamento.objects.create(nome='Aldeia', mapa=self.mapa, pos_x=10, pos_y=10)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CacheMarkersTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        self.outro = MapaMundo.objects.create(nome='Outro')
+        Assentamento.objects.create(nome='Vila', mapa=self.mapa, pos_x=10, pos_y=10)
+        self.url = f'/api/assentamentos/markers/?mapa={self.mapa.pk}'
+
+    def test_validadores_e_304(self):
+        resposta = self.client.get(self.url)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta['Cache-Control'], 'private, no-cache')
+        etag, modificado = resposta['ETag'], resposta['Last-Modified']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=modificado).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"outro"').status_code, 200)
+
+    def test_invalidado_pelas_edicoes_do_mapa(self):
+        etag = self.client.get(self.url)['ETag']
+        etag_outro = self.client.get(f'/api/assentamentos/markers/?mapa={self.outro.pk}')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Assentamento.objects.create(nome='Aldeia', mapa=self.mapa, pos_x=20, pos_y=20)
+        resposta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(sorted(a['nome'] for a in resposta.json()), ['Aldeia', 'Vila'])
+        self.assertNotEqual(resposta['ETag'], etag)
+        # Outro mapa continua válido
+        self.assertEqual(self.client.get(f'/api/assentamentos/markers/?mapa={self.outro.pk}',
+                                         HTTP_IF_NONE_MATCH=etag_outro).status_code, 304)
+
+        etag = resposta['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Personagem.objects.create(nome='Ana', raca='Humano', origem=Assentamento.objects.get(nome='Vila'))
+        resposta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual({a['nome']: a['personagem_count'] for a in resposta.json()}, {'Vila': 1, 'Aldeia': 0})
+
+    def test_varios_workers_exigem_cache_compartilhado(self):
+        from mapa.checks import cache_compartilhado
+        with override_settings(WEB_WORKERS=2):
+            self.assertEqual([e.id for e in cache_compartilhado(None)], ['mapa.E001'])
+        self.assertEqual(cache_compartilhado(None), [])
+        arquivo = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                               'LOCATION': tempfile.mkdtemp()}}
+        self.addCleanup(shutil.rmtree, arquivo['default']['LOCATION'], True)
+        with override_settings(WEB_WORKERS=2, CACHES=arquivo):
+            self.assertEqual(cache_compartilhado(None), [])
+
+
+class FiltroBboxTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        Bioma.objects.create(nome='Norte', mapa=self.mapa, poligonos=[[[0, 0], [100, 0], [100, 100]]])
+        Bioma.objects.create(nome='Sul', mapa=self.mapa, poligonos=[[[0, 900], [100, 900], [100, 1000]]])
+        Assentamento.objects.create(nome='Perto', mapa=self.mapa, pos_x=50, pos_y=50)
+        Assentamento.objects.create(nome='Longe', mapa=self.mapa, pos_x=800, pos_y=800)
+
+    def test_markers_por_bbox(self):
+        url = f'/api/assentamentos/markers/?mapa={self.mapa.pk}'
+        self.assertEqual([a['nome'] for a in self.client.get(url + '&bbox=0,0,200,200').json()], ['Perto'])
+        self.assertEqual(len(self.client.get(url).json()), 2)
+        self.assertEqual(self.client.get(url + '&bbox=0,0,1').status_code, 400)
+
+    def test_listagens_por_bbox(self):
+        biomas = self.client.get(f'/api/biomas/?mapa={self.mapa.pk}&bbox=50,50,500,500').json()['results']
+        self.assertEqual([b['nome'] for b in biomas], ['Norte'])
+        assentamentos = self.client.get('/api/assentamentos/?bbox=700,700,900,900&fields=nome').json()['results']
+        self.assertEqual(assentamentos, [{'nome': 'Longe'}])
+        self.assertEqual(self.client.get('/api/biomas/?bbox=9,0,1,1').status_code, 400)
+
+
+class AgrupamentoMarkersTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        for i in range(5):
+            Assentamento.objects.create(nome=f'Vila {i}', mapa=self.mapa, pos_x=100 + i, pos_y=100 + i)
+        Assentamento.objects.create(nome='Isolada', mapa=self.mapa, pos_x=5000, pos_y=5000)
+
+    def test_agrupa_por_zoom(self):
+        url = f'/api/assentamentos/markers/?mapa={self.mapa.pk}'
+        dados = self.client.get(url + '&zoom=-2').json()
+        self.assertEqual(dados['lado'], 256)
+        self.assertEqual([g['quantidade'] for g in dados['grupos']], [5])
+        self.assertIn(dados['grupos'][0]['representante'], dados['grupos'][0]['ids'])
+        self.assertEqual([a['nome'] for a in dados['assentamentos']], ['Isolada'])
+        # Aproximando o suficiente, nenhuma célula tem mais de um ponto
+        dados = self.client.get(url + '&zoom=6').json()
+        self.assertEqual((len(dados['grupos']), len(dados['assentamentos'])), (0, 6))
+        self.assertEqual(self.client.get(url + '&zoom=abc').status_code, 400)
+
+
+class BootstrapTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        Bioma.objects.create(nome='Norte', mapa=self.mapa, poligonos=[[[0, 0], [500, 0], [500, 500]]])
+        Assentamento.objects.create(nome='Vila', mapa=self.mapa, pos_x=100, pos_y=100)
+        self.url = f'/api/mapas/{self.mapa.pk}/bootstrap/'
+
+    def test_resposta_em_cache_pela_revisao(self):
+        dados = self.client.get(self.url).json()
+        self.assertEqual(dados['mapa']['nome'], 'Mundo')
+        self.assertEqual([b['nome'] for b in dados['biomas']], ['Norte'])
+        self.assertNotIn('poligonos', dados['biomas'][0])
+        self.assertEqual([a['nome'] for a in dados['marcadores']], ['Vila'])
+        # Em cache: só a leitura do mapa (revisão)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).json(), dados)
+
+        Assentamento.objects.create(nome='Aldeia', mapa=self.mapa, pos_x=120, pos_y=120)
+        novo = self.client.get(self.url).json()
+        self.assertGreater(novo['revisao'], dados['revisao'])
+        self.assertEqual(len(novo['marcadores']), 2)
+        agrupado = self.client.get(self.url + '?zoom=-2').json()['marcadores']
+        self.assertEqual([g['quantidade'] for g in agrupado['grupos']], [2])
+        self.assertEqual(self.client.get(self.url + '?zoom=99').status_code, 400)
+
+    def test_save_de_instancia_antiga_nao_reverte_revisao(self):
+        antigo = MapaMundo.objects.get(pk=self.mapa.pk)
+        Assentamento.objects.create(nome='Aldeia', mapa=self.mapa, pos_x=120, pos_y=120)
+        revisao = MapaMundo.objects.values_list('revisao', flat=True).get(pk=self.mapa.pk)
+        antigo.nome = 'Mundo Novo'
+        antigo.save()
+        self.assertEqual(MapaMundo.objects.get(pk=self.mapa.pk).revisao, revisao + 1)
+
+
+class LoteTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        Bioma.objects.create(nome='Norte', mapa=self.mapa, poligonos=[[[0, 0], [500, 0], [500, 500], [0, 500]]])
+        self.vila = Assentamento.objects.create(nome='Vila', mapa=self.mapa, pos_x=900, pos_y=900)
+
+    def personagens(self, n, inicio=0):
+        return [{'nome': f'Personagem {i}', 'raca': 'Humano', 'origem': self.vila.pk} for i in range(inicio, inicio + n)]
+
+    def contar_consultas(self, dados):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.post('/api/personagens/lote/', dados, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        return len(consultas)
+
+    def test_criacao_em_consultas_constantes(self):
+        self.assertEqual(self.contar_consultas(self.personagens(2)), self.contar_consultas(self.personagens(50, 10)))
+        self.assertEqual(Personagem.objects.count(), 52)
+
+    def test_lote_invalido_nao_grava_nada(self):
+        Personagem.objects.create(nome='Existente', raca='Elfo', origem=self.vila)
+        dados = self.personagens(2) + [
+            {'nome': 'Existente', 'raca': 'Humano', 'origem': self.vila.pk},
+            {'nome': 'Personagem 0', 'raca': 'Humano', 'origem': 999},
+        ]
+        resposta = self.client.post('/api/personagens/lote/', dados, format='json')
+        self.assertEqual(resposta.status_code, 400)
+        resultados = resposta.json()['resultados']
+        self.assertEqual([r['status'] for r in resultados], ['erro', 'valido', 'erro', 'erro'])
+        self.assertIn('nome', resultados[2]['erros'])
+        self.assertEqual(set(resultados[3]['erros']), {'nome', 'origem'})
+        self.assertEqual(Personagem.objects.count(), 1)
+
+    def test_assentamentos_atualizados_e_removidos(self):
+        resposta = self.client.post('/api/assentamentos/lote/', [
+            {'nome': 'Dentro', 'mapa': self.mapa.pk, 'pos_x': 100, 'pos_y': 100},
+            {'nome': 'Fora', 'mapa': self.mapa.pk, 'pos_x': 800, 'pos_y': 800},
+        ], format='json')
+        self.assertEqual(resposta.status_code, 201)
+        dentro, fora = [r['id'] for r in resposta.json()['resultados']]
+        self.assertEqual(list(Assentamento.objects.get(pk=dentro).bioma.values_list('nome', flat=True)), ['Norte'])
+        self.assertFalse(Assentamento.objects.get(pk=fora).bioma.exists())
+
+        revisao = MapaMundo.objects.get(pk=self.mapa.pk).revisao
+        resposta = self.client.patch('/api/assentamentos/lote/', [
+            {'id': dentro, 'nome': 'Dentro Renomeado'}, {'id': fora, 'pos_x': 810},
+        ], format='json')
+        self.assertEqual([r['status'] for r in resposta.json()['resultados']], ['atualizado', 'atualizado'])
+        self.assertEqual(Assentamento.objects.get(pk=dentro).nome, 'Dentro Renomeado')
+        self.assertEqual(Assentamento.objects.get(pk=fora).pos_x, 810)
+        self.assertGreater(MapaMundo.objects.get(pk=self.mapa.pk).revisao, revisao)
+        self.assertEqual(self.client.patch('/api/assentamentos/lote/', [{'id': 999, 'nome': 'X'}], format='json').status_code, 400)
+
+        resposta = self.client.delete('/api/assentamentos/lote/', {'ids': [dentro, 999]}, format='json')
+        self.assertEqual(resposta.status_code, 400)
+        resposta = self.client.delete('/api/assentamentos/lote/', {'ids': [dentro, fora]}, format='json')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(list(Assentamento.objects.values_list('nome', flat=True)), ['Vila'])
+
+    def test_remocao_em_consultas_constantes(self):
+        def remover(n):
+            criados = Assentamento.objects.bulk_create(
+                Assentamento(nome=f'A{n}-{i}', mapa=self.mapa, pos_x=i, pos_y=i) for i in range(n))
+            Personagem.objects.bulk_create(Personagem(nome=f'P{n}-{a.pk}', raca='Humano', origem=a) for a in criados)
+            revisao = MapaMundo.objects.get(pk=self.mapa.pk).revisao
+            # Sem signals por linha: o mesmo número de consultas para 2 ou 50 (com cascata nos personagens)
+            with self.assertNumQueries(14), self.captureOnCommitCallbacks(execute=True):
+                resposta = self.client.delete('/api/assentamentos/lote/', {'ids': [a.pk for a in criados]}, format='json')
+            self.assertEqual(resposta.status_code, 200)
+            # Uma invalidação só para o lote todo
+            self.assertEqual(MapaMundo.objects.get(pk=self.mapa.pk).revisao, revisao + 1)
+
+        remover(2)
+        remover(50)
+        self.assertEqual(list(Assentamento.objects.values_list('nome', flat=True)), ['Vila'])
+
+
+class IntercambioTests(APITestCase):
+    def setUp(self):
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        Bioma.objects.create(nome='Norte', mapa=self.mapa, poligonos=[[[0, 0], [500, 0], [500, 500], [0, 500]]])
+        for i in range(5):
+            a = Assentamento.objects.create(nome=f'Vila {i}', mapa=self.mapa, pos_x=100 + i, pos_y=100, tipo='C')
+            a.bioma.set(Bioma.objects.all())
+            p = Personagem.objects.create(nome=f'Personagem {i}', raca='Anão', origem=a)
+            Loja.objects.create(nome=f'Loja {i}', assentamento=a, lojista=p if i % 2 else None)
+
+    def exportar(self):
+        resposta = self.client.get(f'/api/mapas/{self.mapa.pk}/exportar/')
+        self.assertEqual(resposta['Content-Type'], 'application/x-ndjson')
+        return b''.join(resposta.streaming_content)
+
+    def test_exporta_e_importa_em_lotes(self):
+        dados = self.exportar()
+        self.assertEqual(len(dados.splitlines()), 1 + 1 + 5 + 5 + 5)
+        self.mapa.delete()
+        Bioma.objects.all().delete()
+
+        resposta = self.client.post('/api/mapas/importar/', {'arquivo': SimpleUploadedFile('mundo.ndjson', dados)})
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(resposta.json()['totais'], {'mapa': 1, 'bioma': 1, 'assentamento': 5, 'personagem': 5, 'loja': 5})
+        self.mapa = MapaMundo.objects.get(nome='Mundo')
+        self.assertEqual(Assentamento.objects.get(nome='Vila 3').bioma.get().nome, 'Norte')
+        self.assertEqual(Loja.objects.get(nome='Loja 3').lojista.nome, 'Personagem 3')
+        self.assertEqual(self.exportar(), dados)
+
+    def test_comandos_e_arquivo_invalido(self):
+        saida = io.StringIO()
+        call_command('export_mundo', mapa=self.mapa.pk, stdout=saida)
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', encoding='utf-8', delete=False) as arquivo:
+            arquivo.write(saida.getvalue())
+        # Nomes de biomas, assentamentos etc. são únicos: no mesmo banco a importação é recusada inteira
+        with self.assertRaisesMessage(CommandError, 'rejeitado pelo banco'):
+            call_command('import_mundo', arquivo.name, nome='Cópia', lote=2, stdout=io.StringIO())
+        self.assertFalse(MapaMundo.objects.filter(nome='Cópia').exists())
+        invertido = b'{"registro":"bioma","nome":"X"}\n{"registro":"mapa","nome":"Y"}\n'
+        resposta = self.client.post('/api/mapas/importar/', {'arquivo': SimpleUploadedFile('m.ndjson', invertido)})
+        self.assertEqual(resposta.status_code, 400)
+
+    def test_erro_do_banco_vira_erro_do_arquivo(self):
+        from django.db import DataError
+        dados = self.exportar()
+        self.mapa.delete()
+        Bioma.objects.all().delete()
+        # Ex.: nome maior que a coluna no PostgreSQL
+        with mock.patch.object(Personagem.objects, 'bulk_create', side_effect=DataError('value too long')):
+            resposta = self.client.post('/api/mapas/importar/', {'arquivo': SimpleUploadedFile('mundo.ndjson', dados)})
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(resposta.json()['detail'], 'registros 8 a 12 (personagem) rejeitado pelo banco: value too long')
+        self.assertFalse(MapaMundo.objects.exists())
+
+
+class GeradorTests(TestCase):
+    def setUp(self):
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        self.norte = Bioma.objects.create(nome='Norte', mapa=self.mapa, poligonos=[[[0, 0], [400, 0], [0, 400]]])
+        self.sul = Bioma.objects.create(nome='Sul', mapa=self.mapa, poligonos=[[[600, 600], [900, 600], [900, 900]]])
+
+    def test_gera_dentro_dos_biomas_pelo_porte(self):
+        from django.core.management import call_command
+        call_command('gerar_mundo', mapa=self.mapa.pk, assentamentos=120, semente=7, lote=50, stdout=io.StringIO())
+        assentamentos = Assentamento.objects.filter(mapa=self.mapa).prefetch_related('bioma', 'personagem_set', 'lojas')
+        self.assertEqual(len(assentamentos), 120)
+        self.assertEqual({a.tipo for a in assentamentos}, {'V', 'C', 'M'})
+        for a in assentamentos:
+            biomas = list(a.bioma.all())
+            self.assertEqual(len(biomas), 1)
+            self.assertTrue(any(ponto_em_poligono(a.pos_x, a.pos_y, anel) for anel in aneis(biomas[0].poligonos)))
+            self.assertEqual(len(a.personagem_set.all()), PORTES[a.tipo]['personagens'])
+            self.assertEqual(len(a.lojas.all()), PORTES[a.tipo]['lojas'])
+        # A mesma semente repete as rolagens; os nomes já usados ganham sufixo
+        call_command('gerar_mundo', mapa=self.mapa.pk, assentamentos=120, semente=7, stdout=io.StringIO())
+        self.assertEqual(Assentamento.objects.count(), 240)
+
+    def test_nome_no_limite_ganha_sufixo(self):
+        from mapa.gerador import _Nomes
+        longo = 'N' * 120
+        Assentamento.objects.create(nome=longo, mapa=self.mapa, pos_x=0, pos_y=0)
+        nomes = _Nomes(Assentamento).reservar([longo, longo])
+        self.assertEqual(nomes, ['N' * 118 + ' 2', 'N' * 118 + ' 3'])
+
+
+class BenchmarkTests(TestCase):
+    def test_relatorio_local_e_comparacao(self):
+        from mapa import benchmark
+        resultados = benchmark.executar_local([10], repeticoes=2)
+        medidos = {(r['endpoint'], r['cache']) for r in resultados}
+        self.assertIn(('markers', 'quente'), medidos)
+        self.assertIn(('criar_assentamento', 'frio'), medidos)
+        self.assertTrue(all(r['status'] in ([200], [201]) for r in resultados))
+        markers = next(r for r in resultados if r['endpoint'] == 'markers' and r['cache'] == 'quente')
+        self.assertEqual(markers['consultas'], 0)
+        relatorio = benchmark.relatorio('local', resultados, tamanhos=[10])
+        self.assertEqual(len(benchmark.comparar(relatorio, relatorio)), len(resultados))
+        self.assertEqual(benchmark.percentil([5, 1, 3, 2, 4], 50), 3)
+
+
+class MetricasTests(TestCase):
+    def setUp(self):
+        from mapa.metricas import agregador
+        agregador.limpar()
+        cache.clear()
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        Bioma.objects.create(nome='Bioma', mapa=self.mapa, poligonos=[[0, 0], [10, 0], [10, 10]])
+
+    def test_server_timing_conta_consultas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(f'/api/biomas/?mapa={self.mapa.pk}')
+        timing = resposta['Server-Timing']
+        self.assertIn(f'desc="{len(consultas)} consultas"', timing)
+        for nome in ('db;dur=', 'ser;dur=', 'storage;dur=', 'total;dur='):
+            self.assertIn(nome, timing)
+
+    def test_serializacao_medida_no_renderer(self):
+        from rest_framework.serializers import BaseSerializer
+        from mapa.metricas import JSONRendererMedido, Medicao, _atual
+        # Sem alterar o DRF: a medição fica só no renderer padrão
+        self.assertEqual(BaseSerializer.data.fget.__module__, 'rest_framework.serializers')
+        medicao = Medicao()
+        token = _atual.set(medicao)
+        try:
+            JSONRendererMedido().render([{'nome': 'Bioma'}] * 100)
+        finally:
+            _atual.reset(token)
+        self.assertGreater(medicao.tempos['ser'], 0)
+
+        bioma = Bioma.objects.get()
+        for url in (f'/api/biomas/?mapa={self.mapa.pk}', f'/api/mapas/{self.mapa.pk}/', f'/api/biomas/{bioma.pk}/geometria/'):
+            timing = self.client.get(url, HTTP_ACCEPT='application/json')['Server-Timing']
+            self.assertNotIn('ser;dur=0.0,', timing)
+
+    async def test_request_assincrono(self):
+        resposta = await self.async_client.get(f'/api/assentamentos/markers/?mapa={self.mapa.pk}')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('consultas"', resposta['Server-Timing'])
+
+    def test_storage_medido(self):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import FileSystemStorage
+        from mapa.metricas import Medicao, StorageMedidoMixin, _atual
+
+        class Medido(StorageMedidoMixin, FileSystemStorage):
+            pass
+
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta, ignore_errors=True)
+        medicao = Medicao()
+        token = _atual.set(medicao)
+        try:
+            Medido(location=pasta).save('a.txt', ContentFile(b'abc'))
+        finally:
+            _atual.reset(token)
+        self.assertGreater(medicao.tempos['storage'], 0)
+
+        # O backend das settings não depende do app: a medição entra pelo BACKEND de STORAGES
+        from setup.storage_backends import MediaStorage
+        self.assertNotIn(StorageMedidoMixin, MediaStorage.__mro__)
+        self.assertEqual(settings.STORAGES['default']['BACKEND'], 'mapa.metricas.MediaStorageMedido')
+
+    def test_endpoint_protegido_com_percentis(self):
+        for _ in range(3):
+            self.client.get(f'/api/biomas/?mapa={self.mapa.pk}')
+        self.assertEqual(self.client.get('/health/metrics').status_code, 403)
+
+        self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+        rotas = self.client.get('/health/metrics').json()['rotas']
+        biomas = rotas['GET /api/biomas/']
+        self.assertEqual(biomas['requests'], 3)
+        self.assertLessEqual(biomas['total_p50_ms'], biomas['total_p99_ms'])
+        self.assertGreater(biomas['bytes_p95'], 0)
+
+        self.client.logout()
+        with override_settings(METRICAS_TOKEN='segredo'):
+            self.assertEqual(self.client.get('/health/metrics', HTTP_AUTHORIZATION='Bearer errado').status_code, 403)
+            self.assertEqual(self.client.get('/health/metrics', HTTP_AUTHORIZATION='Bearer segredo').status_code, 200)
+
+
+def usar_storage_local(teste):
+    """Todos os storages num diretório temporário do teste (FileSystemStorage)."""
+    pasta = tempfile.mkdtemp()
+    teste.addCleanup(shutil.rmtree, pasta, ignore_errors=True)
+    local = override_settings(STORAGES={
+        nome: {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': pasta}}
+        for nome in ('default', 'staticfiles', 'tiles', 'derivados')
+    })
+    local.enable()
+    teste.addCleanup(local.disable)
+
+
+def imagem_png(largura, altura, cor='#336699'):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new('RGB', (largura, altura), cor).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class IndiceEspacialTests(APITestCase):
+    def setUp(self):
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        # Dois quadrados que se sobrepõem em 50..100 e um triângulo no formato do editor (conjuntos de anéis)
+        self.oeste = Bioma.objects.create(nome='Oeste', mapa=self.mapa, poligonos=[[[0, 0], [100, 0], [100, 100], [0, 100]]])
+        self.leste = Bioma.objects.create(nome='Leste', mapa=self.mapa, poligonos=[[[50, 0], [150, 0], [150, 100], [50, 100]]])
+        self.sul = Bioma.objects.create(nome='Sul', mapa=self.mapa, poligonos=[[[[0, 200], [100, 200], [0, 300]]]])
+
+    def test_caixa_persistida_e_consulta_por_ponto(self):
+        self.sul.refresh_from_db()
+        self.assertEqual((self.sul.bbox_min_x, self.sul.bbox_min_y, self.sul.bbox_max_x, self.sul.bbox_max_y), (0, 200, 100, 300))
+        self.assertEqual(indice.biomas_do_ponto(self.mapa.pk, 25, 50), [self.oeste.pk])
+        self.assertEqual(sorted(indice.biomas_do_ponto(self.mapa.pk, 75, 50)), sorted([self.oeste.pk, self.leste.pk]))
+        self.assertEqual(indice.biomas_do_ponto(self.mapa.pk, 10, 210), [self.sul.pk])
+        # Na caixa do triângulo, mas fora dele; e fora de todas as caixas
+        self.assertEqual(indice.biomas_do_ponto(self.mapa.pk, 90, 290), [])
+        self.assertEqual(indice.biomas_do_ponto(self.mapa.pk, 500, 500), [])
+
+    def test_indice_em_cache_ate_o_bioma_mudar(self):
+        indice.indice_do_mapa(self.mapa.pk)
+        with self.assertNumQueries(1):  # só a assinatura
+            indice.indice_do_mapa(self.mapa.pk)
+        # Escrita sem signals (como a de outro processo): a assinatura muda
+        Bioma.objects.filter(pk=self.leste.pk).update(
+            poligonos=[[[300, 300], [400, 300], [400, 400]]], bbox_min_x=300, bbox_min_y=300,
+            bbox_max_x=400, bbox_max_y=400, atualizado_em=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(indice.biomas_do_ponto(self.mapa.pk, 75, 50), [self.oeste.pk])
+
+    def test_assentamento_criado_recebe_biomas(self):
+        self.client.force_authenticate(User.objects.create_user('mestre', password='x'))
+        resposta = self.client.post('/api/assentamentos/', {'nome': 'Vila', 'mapa': self.mapa.pk, 'pos_x': 75, 'pos_y': 50}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        vila = Assentamento.objects.get(nome='Vila')
+        self.assertEqual(set(vila.bioma.values_list('pk', flat=True)), {self.oeste.pk, self.leste.pk})
+
+    def test_migracao_preenche_caixas(self):
+        from django.apps import apps
+        migracao = importlib.import_module('mapa.migrations.0012_bioma_bbox')
+        Bioma.objects.update(bbox_min_x=None, bbox_min_y=None, bbox_max_x=None, bbox_max_y=None)
+        migracao.calcular_bbox(apps, None)
+        self.assertEqual(Bioma.objects.get(pk=self.sul.pk).bbox_max_y, 300)
+        self.assertEqual(Bioma.objects.filter(bbox_min_x__isnull=True).count(), 0)
+
+
+class ReatribuicaoBiomasTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('mestre', password='x'))
+        self.mapa = MapaMundo.objects.create(nome='Mundo')
+        self.bioma = Bioma.objects.create(nome='Floresta', mapa=self.mapa, poligonos=[[[0, 0], [100, 0], [100, 100], [0, 100]]])
+        self.outro = Bioma.objects.create(nome='Deserto', mapa=self.mapa, poligonos=[[[500, 500], [600, 500], [600, 600]]])
+        self.dentro = Assentamento.objects.create(nome='Dentro', mapa=self.mapa, pos_x=50, pos_y=50)
+        self.dentro.bioma.set([self.bioma])
+        self.longe = Assentamento.objects.create(nome='Longe', mapa=self.mapa, pos_x=1000, pos_y=1000)
+        # Escolha manual: fora dos polígonos dos dois biomas
+        self.longe.bioma.set([self.outro, self.bioma])
+
+    def biomas(self, assentamento):
+        return set(assentamento.bioma.values_list('nome', flat=True))
+
+    def test_edicao_so_afeta_a_regiao_do_bioma(self):
+        resposta = self.client.patch(f'/api/biomas/{self.bioma.pk}/', {
+            'poligonos': [[[40, 40], [300, 40], [300, 300], [40, 300]]]}, format='json')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(self.biomas(self.dentro), {'Floresta'})
+        perto = Assentamento.objects.create(nome='Perto', mapa=self.mapa, pos_x=45, pos_y=45)
+        perto.bioma.add(self.bioma)  # manual, dentro da caixa anterior e fora do polígono novo
+        self.client.patch(f'/api/biomas/{self.bioma.pk}/', {
+            'poligonos': [[[60, 60], [300, 60], [300, 300]]]}, format='json')
+        self.assertEqual(self.biomas(self.dentro), set())
+        self.assertEqual(self.biomas(perto), set())
+        # Fora das caixas anterior e nova: vínculos manuais preservados
+        self.assertEqual(self.biomas(self.longe), {'Floresta', 'Deserto'})
+
+    def test_custo_nao_depende_dos_assentamentos_fora_da_caixa(self):
+        url = f'/api/biomas/{self.bioma.pk}/'
+        def consultas():
+            with CaptureQueriesContext(connection) as capturadas:
+                self.client.patch(url, {'poligonos': [[[0, 0], [90, 0], [90, 90]]]}, format='json')
+            return len(capturadas)
+        consultas()
+        antes = consultas()
+        Assentamento.objects.bulk_create([
+            Assentamento(nome=f'Fora {i}', mapa=self.mapa, pos_x=2000 + i, pos_y=2000) for i in range(50)])
+        self.assertEqual(consultas(), antes)
+
+    def test_criacao_vincula_os_assentamentos_dentro(self):
+        self.client.post('/api/biomas/', {'nome': 'Lago', 'mapa': self.mapa.pk,
+                                          'poligonos': [[[40, 40], [60, 40], [60, 60], [40, 60]]]}, format='json')
+        self.assertEqual(self.biomas(self.dentro), {'Floresta', 'Lago'})
+
+    def test_reatribuicao_completa_descarta_vinculos_manuais(self):
+        Assentamento.bioma.through.objects.filter(assentamento=self.dentro).delete()
+        resposta = self.client.post(f'/api/mapas/{self.mapa.pk}/reatribuir-biomas/')
+        self.assertEqual(resposta.json(), {'assentamentos': 2, 'inseridos': 1, 'removidos': 2})
+        self.assertEqual(self.biomas(self.dentro), {'Floresta'})
+        self.assertEqual(self.biomas(self.longe), set())
+
+    def test_comando(self):
+        saida = io.StringIO()
+        call_command('reassign_biomas', mapa=self.mapa.pk, stdout=saida)
+        self.assertIn('2 assentamentos verificados, 0 vínculos criados, 2 removidos', saida.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('reassign_biomas', mapa=0)
+
+
+class PontoEmPoligonoTests(TestCase):
+    def setUp(self):
+        rng = random.Random(4)
+        # Estrelas côncavas, um anel degenerado e pontos aleatórios, nos vértices e em bordas horizontais
+        self.aneis = [
+            [[c + r * (1 if k % 2 else 0.4) * math.cos(k * math.pi / 7), c + r * (1 if k % 2 else 0.4) * math.sin(k * math.pi / 7)]
+             for k in range(14)]
+            for c, r in ((50, 40), (80, 30), (20, 10))
+        ] + [[[0, 0], [100, 100]], [[0, 0], [100, 0], [100, 100], [0, 100]]]
+        self.pontos = [(rng.uniform(-10, 130), rng.uniform(-10, 130)) for _ in range(400)]
+        self.pontos += [tuple(v) for anel in self.aneis[:3] for v in anel] + [(x, 0.0) for x in range(0, 101, 10)]
+
+    def escalar(self):
+        return [[geometria.ponto_em_poligono(x, y, anel) for anel in self.aneis] for x, y in self.pontos]
+
+    @unittest.skipUnless(geometria.NUMPY_DISPONIVEL, 'NumPy não instalado')
+    def test_vetorizado_igual_ao_escalar(self):
+        esperado = self.escalar()
+        self.assertTrue(any(any(linha[:3]) for linha in esperado))
+        self.assertEqual(geometria.pontos_em_poligonos(self.pontos, self.aneis).tolist(), esperado)
+        # Em blocos menores que a matriz inteira
+        with mock.patch.object(geometria, '_BLOCO_ELEMENTOS', 100):
+            preparados = geometria.preparar_aneis(self.aneis)
+            self.assertEqual(geometria.pontos_em_poligonos(self.pontos, preparados).tolist(), esperado)
+
+    def test_fallback_sem_numpy(self):
+        with mock.patch.object(geometria, 'NUMPY_DISPONIVEL', False):
+            preparados = geometria.preparar_aneis(self.aneis)
+            self.assertEqual(geometria.pontos_em_poligonos(self.pontos, preparados), self.escalar())
+            pts = geometria.como_pontos(self.pontos)
+            dentro = geometria.indices_na_caixa(pts, (0, 0, 50, 50))
+            self.assertEqual(dentro, [k for k, (x, y) in enumerate(self.pontos) if 0 <= x <= 50 and 0 <= y <= 50])
+        self.assertFalse(any(linha[3] for linha in self.escalar()))  # anel com 2 vértices
+
+
+class FilaTarefasTests(TestCase):
+    def setUp(self):
+        self.chamadas = []
+        self.durante = None
+        registro = mock.patch.dict(tarefas._REGISTRO, {'teste': self.executora})
+        registro.start()
+        self.addCleanup(registro.stop)
+
+    def executora(self, **argumentos):
+        self.chamadas.append(argumentos)
+        if self.durante:
+            self.durante()
+
+    def vencer(self, **campos):
+        """Faz o tempo passar: esperas e reservas das tarefas vencem."""
+        passado = timezone.now() - timedelta(seconds=1)
+        Tarefa.objects.update(disponivel_em=passado, **{c: passado for c in campos})
+
+    def test_worker_sobrevive_a_falha_do_banco(self):
+        from django.db import OperationalError
+        tarefas.enfileirar('teste', n=1)
+        saida = io.StringIO()
+        with mock.patch.object(tarefas, 'reservar_proxima', side_effect=OperationalError('servidor reiniciou')), \
+                self.assertLogs('mapa.management.commands.worker', 'ERROR') as logs:
+            call_command('worker', uma_vez=True, stdout=saida)
+        self.assertIn('servidor reiniciou', logs.output[0])
+        # Banco de volta: a próxima passada consome a fila
+        call_command('worker', uma_vez=True, stdout=saida)
+        self.assertEqual(self.chamadas, [{'n': 1}])
+
+    def test_migracao_enfileira_cada_mapa_uma_vez(self):
+        from django.apps import apps
+        a, b = MapaMundo.objects.bulk_create([
+            MapaMundo(nome='A', imagem='mapas/a.png', checksum='a' * 64, tiles_origem='a' * 64),
+            MapaMundo(nome='B', imagem='mapas/b.png', checksum='b' * 64),
+        ])
+        Tarefa.objects.create(nome='process_mapa', argumentos={'mapa_id': a.pk})
+        # Os arquivos nem existem: a migração não pode depender do storage
+        with mock.patch('django.core.files.storage.FileSystemStorage.size', side_effect=AssertionError('storage')):
+            importlib.import_module('mapa.migrations.0018_blob').reprocessar_mapas(apps, None)
+        self.assertEqual(sorted(Tarefa.objects.values_list('argumentos__mapa_id', flat=True)), [a.pk, b.pk])
+        self.assertEqual(MapaMundo.objects.get(pk=a.pk).tiles_origem, '')
+        # O Blob (com o tamanho real) fica para o process_mapa
+        self.assertFalse(Blob.objects.exists())
+
+    def test_reserva_unica(self):
+        t = tarefas.enfileirar('teste', n=1)
+        self.assertEqual(tarefas.reservar_proxima().pk, t.pk)
+        self.assertIsNone(tarefas.reservar_proxima())
+        tarefas.executar(Tarefa.objects.get(pk=t.pk))
+        t.refresh_from_db()
+        self.assertEqual((t.estado, t.tentativas, t.reservada_ate), ('concluida', 1, None))
+        self.assertEqual(self.chamadas, [{'n': 1}])
+
+    def test_espera_crescente_entre_tentativas(self):
+        def falhar():
+            raise RuntimeError('falhou')
+        self.durante = falhar
+        t = tarefas.enfileirar('teste')
+        esperas = []
+        with self.assertLogs('mapa.tarefas', 'ERROR'):
+            for _ in range(3):
+                antes = timezone.now()
+                tarefas.executar_proxima()
+                t.refresh_from_db()
+                esperas.append((t.disponivel_em - antes).total_seconds())
+                # Ainda esperando: nada a reservar
+                self.assertIsNone(tarefas.reservar_proxima())
+                self.vencer()
+        self.assertEqual((t.estado, t.tentativas), ('erro', 3))
+        self.assertIn('RuntimeError', t.erro)
+        self.assertEqual([round(e) for e in esperas[:2]], [30, 60])
+        self.assertEqual(len(self.chamadas), 3)
+
+    def test_reserva_vencida_e_retomada(self):
+        t = tarefas.enfileirar('teste')
+        tarefas.reservar_proxima()
+        # Reserva em dia: outro worker não pega
+        self.assertIsNone(tarefas.reservar_proxima())
+        self.vencer(reservada_ate=True)
+        retomada = tarefas.reservar_proxima()
+        self.assertEqual((retomada.pk, retomada.tentativas), (t.pk, 2))
+        tarefas.executar(retomada)
+        self.assertEqual(Tarefa.objects.get(pk=t.pk).estado, 'concluida')
+
+    def test_renovar_reserva_durante_a_execucao(self):
+        t = tarefas.enfileirar('teste')
+        reservada = tarefas.reservar_proxima()
+        Tarefa.objects.filter(pk=t.pk).update(reservada_ate=timezone.now())
+        renovadas = []
+
+        def batimento():
+            tarefas.renovar_reserva()
+            renovadas.append(Tarefa.objects.get(pk=t.pk).reservada_ate)
+        self.durante = batimento
+        tarefas.executar(reservada)
+        self.assertGreater(renovadas[0], timezone.now() + timedelta(seconds=settings.MAPA_TAREFAS_RESERVA - 60))
+
+    def test_worker_morto_em_todas_as_tentativas(self):
+        mapa = MapaMundo.objects.create(nome='Mundo')
+        t = Tarefa.objects.create(nome='process_mapa', argumentos={'mapa_id': mapa.pk})
+        MapaMundo.objects.filter(pk=mapa.pk).update(status='processando')
+        for _ in range(settings.MAPA_TAREFAS_MAX_TENTATIVAS):
+            self.assertEqual(tarefas.reservar_proxima().pk, t.pk)
+            self.vencer(reservada_ate=True)  # o worker morre sem concluir
+        with self.assertLogs('mapa.tarefas', 'ERROR'):
+            self.assertIsNone(tarefas.reservar_proxima())
+        t.refresh_from_db()
+        self.assertEqual((t.estado, t.tentativas), ('erro', settings.MAPA_TAREFAS_MAX_TENTATIVAS))
+        mapa.refresh_from_db()
+        self.assertEqual(mapa.status, 'erro')
+
+
+class PiramideTilesTests(APITestCase):
+    def setUp(self):
+        usar_storage_local(self)
+        self.mapa = MapaMundo.objects.create(nome='Mundo', imagem=SimpleUploadedFile('mundo.png', imagem_png(600, 300)))
+
+    def test_zoom_maximo(self):
+        self.assertEqual(imagens.zoom_maximo(1, 1), 0)
+        self.assertEqual(imagens.zoom_maximo(256, 100), 0)
+        self.assertEqual(imagens.zoom_maximo(257, 100), 1)
+        self.assertEqual(imagens.zoom_maximo(600, 300), 2)
+        self.assertEqual(imagens.zoom_maximo(1500, 3000), 4)
+
+    def test_piramide_z_x_y(self):
+        from PIL import Image
+        self.assertEqual(imagens.gerar_tiles(self.mapa), 2)
+        storage = self.mapa.imagem.storage
+        # 600x300 -> 300x150 -> 150x75: 3x2, 2x1 e 1x1 tiles
+        esperados = {(2, x, y) for x in range(3) for y in range(2)} | {(1, 0, 0), (1, 1, 0), (0, 0, 0)}
+        for z, x, y in esperados:
+            self.assertTrue(storage.exists(imagens.caminho_tile(self.mapa.checksum, z, x, y)), (z, x, y))
+        self.assertFalse(storage.exists(imagens.caminho_tile(self.mapa.checksum, 1, 0, 1)))
+        # Tile de borda completado com transparência
+        with storage.open(imagens.caminho_tile(self.mapa.checksum, 2, 2, 1)) as f:
+            tile = Image.open(f)
+            tile.load()
+        self.assertEqual(tile.size, (imagens.TILE_SIZE, imagens.TILE_SIZE))
+        self.assertEqual(tile.getpixel((0, 0))[3], 255)
+        self.assertEqual(tile.getpixel((100, 100))[3], 0)
+
+    def test_redireciona_para_o_tile(self):
+        MapaMundo.objects.filter(pk=self.mapa.pk).update(tiles_zoom_max=2, tiles_origem='abc', largura=600, altura=300)
+        url = f'/api/mapas/{self.mapa.pk}/imagem'
+        resposta = self.client.get(f'{url}/2/2/1/')
+        self.assertEqual(resposta.status_code, 302)
+        self.assertTrue(resposta['Location'].endswith('mapas/tiles/abc/2/2/1.png'))
+        for fora in ('3/0/0', '2/3/0', '2/0/2', '0/1/0'):
+            self.assertEqual(self.client.get(f'{url}/{fora}/').status_code, 404, fora)
+
+
+_ARMAZENAMENTO_LOCAL = tempfile.mkdtemp()
+
+
+@override_settings(STORAGES={
+    nome: {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': _ARMAZENAMENTO_LOCAL}}
+    for nome in ('default', 'staticfiles', 'tiles', 'derivados')
+})
+class DerivadosTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(_ARMAZENAMENTO_LOCAL, ignore_errors=True)
+
+    def setUp(self):
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.new('RGB', (3000, 1500), '#336699').save(buf, format='PNG')
+        self.png = buf.getvalue()
+        self.mapa = MapaMundo.objects.create(nome='Mundo', imagem=SimpleUploadedFile('mundo.png', self.png))
+
+    def test_derivados_gerados_uma_vez(self):
+        processar_mapa(self.mapa.pk)
+        self.mapa.refresh_from_db()
+        self.assertEqual(self.mapa.status, 'pronto')
+        self.assertEqual(self.mapa.derivados_origem, self.mapa.checksum)
+        self.assertIn('previa', self.mapa.derivados)
+        if 'WEBP' in [f[1] for f in imagens.formatos_suportados()]:
+            self.assertIn('miniatura_webp', self.mapa.derivados)
+
+        from PIL import Image
+        with self.mapa.imagem.storage.open(self.mapa.derivados['miniatura']) as f:
+            self.assertEqual(Image.open(f).size, (imagens.MINIATURA_LADO, imagens.MINIATURA_LADO // 2))
+
+        # Mesma imagem de origem: nada é regerado
+        with mock.patch.object(imagens, 'gerar_derivados') as gerar:
+            processar_mapa(self.mapa.pk)
+        gerar.assert_not_called()
+
+        dados = self.client.get(f'/api/mapas/{self.mapa.pk}/').json()
+        self.assertTrue(dados['miniatura_url'].endswith('miniatura.jpg'))
+        self.assertEqual(set(dados['derivados_urls']), set(self.mapa.derivados))
+
+    def test_bootstrap_acompanha_o_processamento(self):
+        cache.clear()
+        # Imagem própria: os derivados são gravados por checksum no storage compartilhado pela classe
+        mapa = MapaMundo.objects.create(nome='Vale', imagem=SimpleUploadedFile('vale.png', imagem_png(900, 600, '#228822')))
+        url = f'/api/mapas/{mapa.pk}/bootstrap/'
+        self.assertNotEqual(self.client.get(url).json()['mapa']['status'], 'pronto')
+        processar_mapa(mapa.pk)
+        dados = self.client.get(url).json()['mapa']
+        self.assertEqual(dados['status'], 'pronto')
+        self.assertEqual((dados['largura'], dados['altura']), (900, 600))
+
+        # Falha no processamento também aparece no bootstrap
+        MapaMundo.objects.filter(pk=mapa.pk).update(tiles_origem='')
+        with mock.patch.object(imagens, 'gerar_tiles', side_effect=OSError('disco cheio')), self.assertRaises(OSError):
+            processar_mapa(mapa.pk)
+        self.assertEqual(self.client.get(url).json()['mapa']['status'], 'erro')
+
+    def test_imagem_menor_que_os_derivados(self):
+        pequeno = MapaMundo.objects.create(nome='Ilha', imagem=SimpleUploadedFile('ilha.png', imagem_png(600, 300, '#aa5500')))
+        processar_mapa(pequeno.pk)
+        pequeno.refresh_from_db()
+        self.assertEqual(pequeno.status, 'pronto')
+        from PIL import Image
+        with pequeno.imagem.storage.open(pequeno.derivados['previa']) as f:
+            self.assertEqual(Image.open(f).size, (600, 300))
+
+    def test_imagem_repetida_compartilha_arquivo_e_derivados(self):
+        processar_mapa(self.mapa.pk)
+        copia = MapaMundo.objects.create(nome='Cópia', imagem=SimpleUploadedFile('outro-nome.png', self.png))
+        self.assertEqual(copia.imagem.name, self.mapa.imagem.name)
+        self.assertEqual(Blob.objects.get().referencias, 2)
+
+        with mock.patch.object(imagens, 'gerar_tiles') as tiles, mock.patch.object(imagens, 'gerar_derivados') as derivados:
+            processar_mapa(copia.pk)
+        tiles.assert_not_called()
+        derivados.assert_not_called()
+        copia.refresh_from_db()
+        self.mapa.refresh_from_db()
+        self.assertEqual((copia.tiles_zoom_max, copia.derivados), (self.mapa.tiles_zoom_max, self.mapa.derivados))
+
+        storage = self.mapa.imagem.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_login(User.objects.create_user('mestre', password='x'))
+            self.client.post(f'/mapas/{copia.pk}/delete/')
+        self.assertTrue(storage.exists(self.mapa.imagem.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mapa.delete()
+        self.assertFalse(storage.exists(self.mapa.imagem.name))
+        self.assertFalse(storage.exists(self.mapa.derivados['miniatura']))
+        self.assertFalse(Blob.objects.exists())
+
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto é opcional (só para estes testes)
+    mock_aws = None
+
+
+_S3_TESTE = {'bucket_name': 'mapas-teste', 'region_name': 'us-east-1', 'endpoint_url': None,
+             'access_key': 'teste', 'secret_key': 'teste'}
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'setup.storage_backends.MediaStorage', 'OPTIONS': _S3_TESTE},
+    'derivados': {'BACKEND': 'setup.storage_backends.GeneratedStorage', 'OPTIONS': _S3_TESTE},
+})
+class UploadsClienteSimuladoTests(TestCase):
+    """Chamadas de mapa.uploads ao S3 conferidas com o Stubber do botocore (sem moto nem rede)."""
+
+    def setUp(self):
+        import boto3
+        cliente = boto3.client('s3', region_name='us-east-1', aws_access_key_id='teste', aws_secret_access_key='teste')
+        self.stub = Stubber(cliente)
+        self.stub.activate()
+        self.addCleanup(self.stub.deactivate)
+        patcher = mock.patch.object(uploads, '_cliente', return_value=cliente)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _iniciar(self, tamanho):
+        self.stub.add_response('create_multipart_upload', {'UploadId': 'u1'}, {
+            'Bucket': 'mapas-teste', 'Key': ANY, 'ContentType': 'image/png', 'CacheControl': ANY,
+        })
+        return uploads.ler_token(uploads.iniciar('../Mundo Novo.png', tamanho, 7)['token'], 7)
+
+    def _listar(self, partes):
+        self.stub.add_response('list_parts', {'Parts': partes}, {
+            'Bucket': 'mapas-teste', 'Key': ANY, 'UploadId': 'u1',
+        })
+
+    def test_fluxo_completo(self):
+        dados = self._iniciar(1024)
+        self.assertTrue(dados['nome'].endswith('/Mundo_Novo.png'))
+        url = uploads.assinar_partes(dados, [1])[1]
+        self.assertIn('partNumber=1', url)
+        self.assertIn('uploadId=u1', url)
+
+        self._listar([{'PartNumber': 1, 'ETag': '"e1"', 'Size': 1024}])
+        self.stub.add_response('complete_multipart_upload', {}, {
+            'Bucket': 'mapas-teste', 'Key': f"media/{dados['nome']}", 'UploadId': 'u1',
+            'MultipartUpload': {'Parts': [{'PartNumber': 1, 'ETag': '"e1"'}]},
+        })
+        self.assertEqual(uploads.concluir(dados), dados['nome'])
+        self.stub.assert_no_pending_responses()
+
+    def test_concluir_recusa_upload_incompleto(self):
+        dados = self._iniciar(uploads.TAMANHO_PARTE + 1)
+        self._listar([{'PartNumber': 1, 'ETag': '"e1"', 'Size': uploads.TAMANHO_PARTE}])
+        with self.assertRaisesMessage(uploads.UploadInvalido, '1 de 2 partes'):
+            uploads.concluir(dados)
+        with self.assertRaises(uploads.UploadInvalido):
+            uploads.assinar_partes(dados, [3])
+
+    def _concluir_pela_api(self, nome):
+        usuario = User.objects.create_user('mestre', password='x')
+        self.client.force_login(usuario)
+        self.stub.add_response('create_multipart_upload', {'UploadId': 'u1'}, {
+            'Bucket': 'mapas-teste', 'Key': ANY, 'ContentType': 'image/png', 'CacheControl': ANY,
+        })
+        token = uploads.iniciar('mundo.png', 1024, usuario.pk)['token']
+        self._listar([{'PartNumber': 1, 'ETag': '"e1"', 'Size': 1024}])
+        self.stub.add_response('complete_multipart_upload', {}, {
+            'Bucket': 'mapas-teste', 'Key': ANY, 'UploadId': 'u1', 'MultipartUpload': ANY,
+        })
+        resposta = self.client.post('/api/uploads/concluir/', {'token': token, 'nome': nome}, content_type='application/json')
+        return token, resposta
+
+    def test_concluir_de_novo_responde_400(self):
+        token, resposta = self._concluir_pela_api('Novo')
+        self.assertEqual(resposta.status_code, 201)
+        # Clique duplo / nova tentativa: o upload já foi concluído no S3
+        self.stub.add_client_error('list_parts', service_error_code='NoSuchUpload', http_status_code=404)
+        resposta = self.client.post('/api/uploads/concluir/', {'token': token, 'nome': 'Outro'}, content_type='application/json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn('já concluído', resposta.json()['detail'])
+        self.assertFalse(MapaMundo.objects.filter(nome='Outro').exists())
+
+    def test_nome_criado_em_paralelo_responde_400(self):
+        # Outro request grava o mesmo nome entre a verificação do nome e o save
+        concluir = uploads.concluir
+
+        def concorrente(dados):
+            MapaMundo.objects.create(nome='Novo')
+            return concluir(dados)
+
+        with mock.patch.object(uploads, 'concluir', concorrente):
+            _, resposta = self._concluir_pela_api('Novo')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(resposta.json(), {'nome': 'Já existe um mapa com este nome.'})
+        self.assertEqual(MapaMundo.objects.filter(nome='Novo').count(), 1)
+
+
+@unittest.skipUnless(mock_aws, 'moto não instalado')
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'setup.storage_backends.MediaStorage', 'OPTIONS': _S3_TESTE},
+    'derivados': {'BACKEND': 'setup.storage_backends.GeneratedStorage', 'OPTIONS': _S3_TESTE},
+})
+class ImagemS3Tests(APITestCase):
+    """Upload direto e leitura das imagens de mapa num S3 simulado (moto)."""
+
+    def setUp(self):
+        self.aws = mock_aws()
+        self.aws.start()
+        self.addCleanup(self.aws.stop)
+        import boto3
+        self.s3 = boto3.client('s3', region_name='us-east-1', aws_access_key_id='teste', aws_secret_access_key='teste')
+        self.s3.create_bucket(Bucket='mapas-teste')
+        self.usuario = User.objects.create_user('mestre', password='x')
+        self.client.force_authenticate(self.usuario)
+
+    def _enviar_parte(self, inicio, numero, conteudo):
+        # Faz o papel do navegador, que usaria a URL pré-assinada
+        dados = uploads.ler_token(inicio['token'], self.usuario.pk)
+        self.s3.upload_part(Bucket='mapas-teste', Key=f"media/{inicio['nome']}", UploadId=dados['upload_id'],
+                            PartNumber=numero, Body=conteudo)
+
+    def test_fluxo_completo_com_retomada(self):
+        conteudo = b'x' * 1024
+        inicio = self.client.post('/api/uploads/', {'nome_arquivo': '../Mundo Novo.png', 'tamanho': len(conteudo)}, format='json').json()
+        self.assertEqual(inicio['total_partes'], 1)
+        self.assertTrue(inicio['nome'].endswith('/Mundo_Novo.png'))
+
+        urls = self.client.post('/api/uploads/partes/', {'token': inicio['token'], 'numeros': [1]}, format='json').json()['urls']
+        self.assertIn('partNumber=1', urls['1'])
+        # Concluir antes de todas as partes chegarem é recusado
+        self.assertEqual(self.client.post('/api/uploads/concluir/', {'token': inicio['token'], 'nome': 'Novo'}, format='json').status_code, 400)
+
+        self._enviar_parte(inicio, 1, conteudo)
+        enviadas = self.client.get('/api/uploads/enviadas/', {'token': inicio['token']}).json()['partes']
+        self.assertEqual([p['numero'] for p in enviadas], [1])
+
+        resposta = self.client.post('/api/uploads/concluir/', {'token': inicio['token'], 'nome': 'Novo'}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        mapa = MapaMundo.objects.get(nome='Novo')
+        self.assertEqual(mapa.imagem.name, inicio['nome'])
+        self.assertEqual(self.s3.get_object(Bucket='mapas-teste', Key=f"media/{inicio['nome']}")['Body'].read(), conteudo)
+        self.assertTrue(Tarefa.objects.filter(nome='process_mapa', argumentos={'mapa_id': mapa.pk}).exists())
+
+    def test_token_de_outro_usuario(self):
+        inicio = self.client.post('/api/uploads/', {'nome_arquivo': 'a.png', 'tamanho': 10}, format='json').json()
+        self.client.force_authenticate(User.objects.create_user('outro', password='x'))
+        self.assertEqual(self.client.get('/api/uploads/enviadas/', {'token': inicio['token']}).status_code, 400)
+
+    def test_sondagem_le_so_o_cabecalho(self):
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.effect_noise((1500, 1200), 64).save(buf, format='PNG')
+        self.assertGreater(len(buf.getvalue()), 1024 * 1024)
+        mapa = MapaMundo.objects.create(nome='Grande', imagem=SimpleUploadedFile('grande.png', buf.getvalue()))
+
+        with mock.patch.object(imagens, '_ler_faixa', wraps=imagens._ler_faixa) as ler:
+            self.assertEqual(imagens.sondar_imagem(mapa.imagem), (1500, 1200, 'PNG'))
+        # Uma única leitura com Range dos primeiros KB
+        self.assertEqual([c.args[2:] for c in ler.call_args_list], [(0, imagens.SONDAGEM_FAIXAS[0])])
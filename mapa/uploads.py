@@ -0,0 +1,159 @@
+"""
+Upload direto ao S3 das imagens de MapaMundo (multipart com URLs pré-assinadas).
+
+O navegador envia as partes direto ao bucket do MediaStorage, em paralelo; o
+Django só inicia o upload, assina as URLs das partes e, no fim, completa o
+upload e registra o MapaMundo apontando para a chave já gravada, sem re-upload.
+O estado do upload viaja num token assinado (django.core.signing): com ele o
+cliente retoma um envio interrompido pedindo as partes que já chegaram.
+"""
+import math
+import mimetypes
+import os
+import posixpath
+import uuid
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+from django.core import signing
+from django.core.files.storage import storages
+from django.utils.text import get_valid_filename
+
+# Tamanho de cada parte (o S3 exige >= 5 MiB em todas menos a última)
+TAMANHO_PARTE = 16 * 1024 * 1024
+MAX_PARTES = 10_000
+TAMANHO_MAXIMO = TAMANHO_PARTE * MAX_PARTES
+# Validade das URLs pré-assinadas e do token do upload (s)
+EXPIRACAO_URL = 3600
+EXPIRACAO_TOKEN = 24 * 3600
+_SALT = 'mapa.uploads'
+
+
+class UploadInvalido(ValueError):
+    """Token expirado/adulterado ou parâmetros de upload fora dos limites."""
+
+
+@contextmanager
+def _recusas_do_s3():
+    """ClientError do S3 (ex.: NoSuchUpload de um upload já concluído, abortado ou expirado) vira UploadInvalido."""
+    try:
+        yield
+    except ClientError as exc:
+        codigo = exc.response.get('Error', {}).get('Code', '')
+        if codigo == 'NoSuchUpload':
+            raise UploadInvalido('upload inexistente: já concluído, abortado ou expirado')
+        raise UploadInvalido(f'o S3 recusou a operação no upload ({codigo})')
+
+
+def _storage():
+    return storages['default']
+
+
+def _cliente(storage):
+    return storage.connection.meta.client
+
+
+def _chave(storage, nome):
+    """Chave do arquivo no bucket: o prefixo (location) do storage mais o nome."""
+    return posixpath.join(storage.location, nome) if storage.location else nome
+
+
+def _parametros_de_escrita(storage, nome):
+    """Parâmetros do objeto como o storage gravaria: AWS_S3_OBJECT_PARAMETERS, tipo e ACL configurados."""
+    parametros = {**(storage.object_parameters or {}),
+                  'ContentType': mimetypes.guess_type(nome)[0] or 'application/octet-stream'}
+    if storage.default_acl:
+        parametros['ACL'] = storage.default_acl
+    return parametros
+
+
+def _alvo(storage, dados):
+    return {'Bucket': storage.bucket_name, 'Key': _chave(storage, dados['nome']), 'UploadId': dados['upload_id']}
+
+
+def iniciar(nome_arquivo, tamanho, usuario_id):
+    """Cria o multipart upload e retorna {token, nome, tamanho_parte, total_partes}."""
+    try:
+        tamanho = int(tamanho)
+    except (TypeError, ValueError):
+        tamanho = 0
+    if not 0 < tamanho <= TAMANHO_MAXIMO:
+        raise UploadInvalido(f'tamanho deve estar entre 1 e {TAMANHO_MAXIMO} bytes')
+    base = get_valid_filename(os.path.basename(nome_arquivo or '')) or 'mapa'
+    # Prefixo único: a chave nunca colide com outro upload (MediaStorage não sobrescreve)
+    nome = f"mapas/{uuid.uuid4().hex}/{base}"
+
+    storage = _storage()
+    resposta = _cliente(storage).create_multipart_upload(
+        Bucket=storage.bucket_name, Key=_chave(storage, nome), **_parametros_de_escrita(storage, nome),
+    )
+    dados = {'nome': nome, 'upload_id': resposta['UploadId'], 'tamanho': tamanho, 'usuario': usuario_id}
+    return {
+        'token': signing.dumps(dados, salt=_SALT),
+        'nome': nome,
+        'tamanho_parte': TAMANHO_PARTE,
+        'total_partes': math.ceil(tamanho / TAMANHO_PARTE),
+    }
+
+
+def ler_token(token, usuario_id):
+    """Dados do upload guardados no token; UploadInvalido se expirado, adulterado ou de outro usuário."""
+    try:
+        dados = signing.loads(token or '', salt=_SALT, max_age=EXPIRACAO_TOKEN)
+    except signing.BadSignature:
+        raise UploadInvalido('token de upload inválido ou expirado')
+    if dados.get('usuario') != usuario_id:
+        raise UploadInvalido('token de upload de outro usuário')
+    return dados
+
+
+def assinar_partes(dados, numeros):
+    """{número: URL pré-assinada de PUT} para as partes pedidas."""
+    total = math.ceil(dados['tamanho'] / TAMANHO_PARTE)
+    if not numeros or any(not isinstance(n, int) or not 1 <= n <= total for n in numeros):
+        raise UploadInvalido(f'partes devem estar entre 1 e {total}')
+    storage = _storage()
+    cliente = _cliente(storage)
+    alvo = _alvo(storage, dados)
+    return {
+        n: cliente.generate_presigned_url(
+            'upload_part', Params={**alvo, 'PartNumber': n}, ExpiresIn=EXPIRACAO_URL,
+        )
+        for n in sorted(set(numeros))
+    }
+
+
+def partes_enviadas(dados):
+    """Partes que já chegaram ao bucket: [{numero, etag, tamanho}] (para retomar o envio)."""
+    storage = _storage()
+    paginador = _cliente(storage).get_paginator('list_parts')
+    partes = []
+    with _recusas_do_s3():
+        for pagina in paginador.paginate(**_alvo(storage, dados)):
+            partes.extend(
+                {'numero': p['PartNumber'], 'etag': p['ETag'], 'tamanho': p['Size']} for p in pagina.get('Parts', [])
+            )
+    return partes
+
+
+def concluir(dados):
+    """Completa o multipart upload com as partes presentes no bucket e retorna o nome no storage."""
+    partes = partes_enviadas(dados)
+    total = math.ceil(dados['tamanho'] / TAMANHO_PARTE)
+    if sorted(p['numero'] for p in partes) != list(range(1, total + 1)):
+        raise UploadInvalido(f"upload incompleto: {len(partes)} de {total} partes")
+    if sum(p['tamanho'] for p in partes) != dados['tamanho']:
+        raise UploadInvalido('o tamanho enviado não confere com o anunciado')
+    storage = _storage()
+    with _recusas_do_s3():
+        _cliente(storage).complete_multipart_upload(
+            **_alvo(storage, dados),
+            MultipartUpload={'Parts': [{'PartNumber': p['numero'], 'ETag': p['etag']} for p in partes]},
+        )
+    return dados['nome']
+
+
+def abortar(dados):
+    storage = _storage()
+    with _recusas_do_s3():
+        _cliente(storage).abort_multipart_upload(**_alvo(storage, dados))
@@ -0,0 +1,47 @@
+"""
+Tiles vetoriais de biomas e assentamentos (JSON) para o cliente Leaflet.
+
+A grade é a do CRS.Simple: no zoom z do Leaflet (0 = resolução original,
+negativo = afastado) o tile (x, y) cobre TILE_SIZE * 2^-z px da imagem por lado.
+Os polígonos vêm no nível de detalhe do zoom e recortados à caixa do tile.
+"""
+from mapa.filters import biomas_na_caixa
+from mapa.geometria import aneis, recortar_anel, tolerancia_do_zoom
+from mapa.imagens import TILE_SIZE
+from mapa.models import Assentamento, Bioma
+
+# Zooms aceitos pelo endpoint (evita caixas degeneradas ou gigantes)
+ZOOM_MIN, ZOOM_MAX = -20, 8
+
+
+def caixa_do_tile(z, x, y):
+    """(min_x, min_y, max_x, max_y) em px da imagem do tile z/x/y."""
+    lado = TILE_SIZE * 2.0 ** -z
+    return x * lado, y * lado, (x + 1) * lado, (y + 1) * lado
+
+
+def _arredondar(anel):
+    return [[round(px, 1), round(py, 1)] for px, py in anel]
+
+
+def montar_tile(mapa_id, z, x, y):
+    """Payload do tile: biomas recortados e assentamentos contidos na caixa."""
+    caixa = min_x, min_y, max_x, max_y = caixa_do_tile(z, x, y)
+    tolerancia = tolerancia_do_zoom(z)
+
+    biomas = []
+    qs = (biomas_na_caixa(Bioma.objects.filter(mapa_id=mapa_id), caixa)
+          .only('id', 'nome', 'cor', *Bioma.CAMPOS_GEOMETRIA))
+    for bioma in qs:
+        recortados = [_arredondar(r) for r in (recortar_anel(a, caixa) for a in aneis(bioma.poligonos_para(tolerancia))) if r]
+        if recortados:
+            biomas.append({'id': bioma.id, 'nome': bioma.nome, 'cor': bioma.cor, 'poligonos': recortados})
+
+    # Meio-aberto à direita/embaixo: um ponto na borda pertence a um só tile
+    assentamentos = [
+        {'id': a['id'], 'nome': a['nome'], 'tipo': a['tipo'], 'x': a['pos_x'], 'y': a['pos_y']}
+        for a in Assentamento.objects
+        .filter(mapa_id=mapa_id, pos_x__gte=min_x, pos_x__lt=max_x, pos_y__gte=min_y, pos_y__lt=max_y)
+        .order_by('id').values('id', 'nome', 'tipo', 'pos_x', 'pos_y')
+    ]
+    return {'z': z, 'x': x, 'y': y, 'caixa': list(caixa), 'biomas': biomas, 'assentamentos': assentamentos}
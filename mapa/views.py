@@ -1,13 +1,28 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import Group, User
 from rest_framework import permissions, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.db.models import Count
-from mapa.models import Bioma, Personagem, Loja, Assentamento, MapaMundo, ponto_em_poligono
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch
+from mapa.models import Bioma, Personagem, Loja, Assentamento, MapaMundo
+from mapa.geometria import tolerancia_do_zoom
+from mapa.imagens import TILE_SIZE, caminho_tile
+from mapa.indice import atribuir_biomas, biomas_do_ponto, caixa_do_bioma, reatribuir_bioma, reatribuir_biomas
+from mapa.lote import LoteMixin
+from mapa import intercambio, metricas, uploads
+from mapa.agrupamento import agrupar_em_grade
+from mapa.filters import AssentamentoFilter, BiomaFilter, ler_caixa, pontos_na_caixa
+from mapa.pagination import NomeCursorPagination
+from mapa.vetorial import ZOOM_MAX, ZOOM_MIN, caixa_do_tile, montar_tile
+from mapa.cache import TODOS, aplicar_validadores, obter_payload, resposta_condicional
 from mapa.serializers import (
     GroupSerializer,
     UserSerializer,
     BiomaSerializer,
+    BiomaResumoSerializer,
+    BiomaGeometriaSerializer,
     PersonagemSerializer,
     LojaSerializer,
     AssentamentoSerializer,
@@ -16,14 +31,17 @@ from mapa.serializers import (
 )
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.core.files.storage import storages
 from django.views.decorators.http import require_http_methods
 from django.urls import reverse
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login as auth_login
 from django.contrib.auth import logout as auth_logout
+import hmac
+import itertools
 import logging
-import boto3
-from botocore.exceptions import ClientError
 import os
 
 logger = logging.getLogger(__name__)
@@ -49,32 +67,112 @@ class GroupViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 class BiomaViewSet(viewsets.ModelViewSet):
+    """
+    Listagens trazem o resumo do bioma (sem polígonos); a geometria completa
+    vem no detalhe, em /biomas/{id}/geometria/ ou em lote em /biomas/geometrias/?mapa=.
+    """
     queryset = Bioma.objects.all()
     serializer_class = BiomaSerializer
-    filterset_fields = ['mapa', 'tipo', 'nome']
+    pagination_class = NomeCursorPagination
+    filterset_class = BiomaFilter
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == 'list':
+            # A coluna JSON dos polígonos é de longe a mais pesada
+            qs = qs.defer(*Bioma.CAMPOS_GEOMETRIA)
+        elif self.action not in ('geometria', 'geometrias'):
+            qs = qs.defer('poligonos_simplificados')
+        return qs
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return BiomaResumoSerializer
+        if self.action in ('geometria', 'geometrias'):
+            return BiomaGeometriaSerializer
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        contexto = super().get_serializer_context()
+        if self.action in ('geometria', 'geometrias'):
+            contexto['tolerancia'] = self._tolerancia()
+        return contexto
+
+    def _tolerancia(self):
+        """Tolerância pedida em ?tolerancia= (px) ou derivada de ?zoom= (Leaflet); None = geometria completa."""
+        params = self.request.query_params
+        try:
+            if params.get('tolerancia'):
+                return max(0.0, float(params['tolerancia']))
+            if params.get('zoom'):
+                return tolerancia_do_zoom(int(params['zoom']))
+        except (ValueError, OverflowError):
+            raise ValidationError({'zoom': 'Informe zoom inteiro ou tolerancia numérica.'})
+        return None
+
+    @action(detail=True, methods=['get'])
+    def geometria(self, request, pk=None):
+        """Polígonos do bioma; ?zoom= ou ?tolerancia= escolhem o nível de detalhe."""
+        return Response(self.get_serializer(self.get_object()).data)
 
-class PersonagemViewSet(viewsets.ModelViewSet):
-    queryset = Personagem.objects.all()
+    @action(detail=False, methods=['get'])
+    def geometrias(self, request):
+        qs = self.filter_queryset(self.get_queryset()).only('id', 'nome', 'cor', *Bioma.CAMPOS_GEOMETRIA)
+        page = self.paginate_queryset(qs)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(qs, many=True).data)
+
+    # Polígonos mudaram: os vínculos deste bioma são recalculados nos assentamentos
+    # dentro da caixa nova e da anterior (os demais vínculos não mudam)
+    def perform_create(self, serializer):
+        reatribuir_bioma(serializer.save())
+
+    def perform_update(self, serializer):
+        mapa_anterior, caixa_anterior = serializer.instance.mapa_id, caixa_do_bioma(serializer.instance)
+        reatribuir_bioma(serializer.save(), mapa_anterior, caixa_anterior)
+
+class PersonagemViewSet(LoteMixin, viewsets.ModelViewSet):
+    # origem_nome do serializer lê personagem.origem.nome
+    queryset = Personagem.objects.select_related('origem')
     serializer_class = PersonagemSerializer
+    pagination_class = NomeCursorPagination
+
+    def mapas_do_lote(self, objetos):
+        origens = {p.origem_id for p in objetos}
+        return set(Assentamento.objects.filter(pk__in=origens, mapa__isnull=False).values_list('mapa_id', flat=True))
 
-class LojaViewSet(viewsets.ModelViewSet):
+class LojaViewSet(LoteMixin, viewsets.ModelViewSet):
     queryset = Loja.objects.all()
     serializer_class = LojaSerializer
+    pagination_class = NomeCursorPagination
     
-class AssentamentoViewSet(viewsets.ModelViewSet):
-    queryset = Assentamento.objects.all().prefetch_related('bioma','personagem_set','mapa')
+class AssentamentoViewSet(LoteMixin, viewsets.ModelViewSet):
+    # Uma consulta por relação aninhada do AssentamentoSerializer, independente do
+    # número de assentamentos. O prefetch reverso de personagem_set já preenche
+    # personagem.origem (usado em origem_nome) e lojista sai só como id.
+    queryset = Assentamento.objects.all()
     serializer_class = AssentamentoSerializer
+    pagination_class = NomeCursorPagination
+    filterset_class = AssentamentoFilter
+    # Prefetch de cada campo aninhado; só entra se o campo for renderizado (?fields / ?expand)
+    prefetch_por_campo = {
+        'bioma': Prefetch('bioma', queryset=Bioma.objects.defer(*Bioma.CAMPOS_GEOMETRIA)),
+        'personagens': Prefetch('personagem_set', queryset=Personagem.objects.order_by('nome')),
+        'lojas': Prefetch('lojas', queryset=Loja.objects.order_by('nome')),
+    }
 
-    @action(detail=False, methods=['get'])
-    def markers(self, request):
-        qs = (self.get_queryset()
-              .annotate(personagem_count=Count('personagem'))
-              .only('id','nome','tipo','pos_x','pos_y','mapa'))
-        mapa_id = request.query_params.get('mapa')
-        if mapa_id:
-            qs = qs.filter(mapa_id=mapa_id)
-        serializer = AssentamentoMarkerSerializer(qs, many=True, context={'request': request})
-        return Response(serializer.data)
+    def get_queryset(self):
+        incluidos = AssentamentoSerializer.campos_incluidos(self.request)
+        prefetch = [p for campo, p in self.prefetch_por_campo.items() if incluidos is None or campo in incluidos]
+        return super().get_queryset().prefetch_related(*prefetch)
+
+    def mapas_do_lote(self, objetos):
+        return {a.mapa_id for a in objetos} - {None}
+
+    def depois_de_criar_lote(self, objetos):
+        # Como no perform_create: biomas atribuídos pelo ponto, aqui em lote
+        atribuir_biomas(objetos)
 
     def perform_create(self, serializer):
         """Cria o assentamento e, se bioma não for enviado, tenta auto-atribuir
@@ -93,20 +191,86 @@ class AssentamentoViewSet(viewsets.ModelViewSet):
         if instance.bioma.exists():
             return
         if instance.mapa_id and instance.pos_x is not None and instance.pos_y is not None:
-            candidatos = Bioma.objects.filter(mapa_id=instance.mapa_id)
-            biomas_ids = []
-            for b in candidatos:
-                try:
-                    for poli in b.poligonos or []:
-                        if ponto_em_poligono(instance.pos_x, instance.pos_y, poli):
-                            biomas_ids.append(b.id)
-                            break
-                except Exception:
-                    # ignora biomas com dados inválidos
-                    continue
+            # Índice espacial: só testa os biomas cuja caixa envolvente contém o ponto
+            biomas_ids = biomas_do_ponto(instance.mapa_id, instance.pos_x, instance.pos_y)
             if biomas_ids:
                 instance.bioma.set(biomas_ids)
 
+
+def _ler_zoom(valor):
+    """Zoom do Leaflet da query string (None se ausente); ValueError fora de ZOOM_MIN..ZOOM_MAX."""
+    zoom = int(valor) if valor else None
+    if zoom is not None and not ZOOM_MIN <= zoom <= ZOOM_MAX:
+        raise ValueError(valor)
+    return zoom
+
+
+def _montar_markers(request, chave_mapa, caixa=None):
+    qs = (Assentamento.objects
+          .prefetch_related(Prefetch('bioma', queryset=Bioma.objects.only('id')))
+          .annotate(personagem_count=Count('personagem'))
+          .only('id','nome','tipo','pos_x','pos_y','mapa'))
+    if chave_mapa != TODOS:
+        qs = qs.filter(mapa_id=chave_mapa)
+    if caixa is not None:
+        qs = pontos_na_caixa(qs, caixa)
+    serializer = AssentamentoMarkerSerializer(qs, many=True, context={'request': request})
+    return list(serializer.data)
+
+
+def _payload_markers(request, chave_mapa, caixa, zoom):
+    def montar():
+        return _montar_markers(request, chave_mapa, caixa)
+
+    partes = [','.join(f'{v:g}' for v in caixa)] if caixa else []
+    if zoom is None:
+        return obter_payload(chave_mapa, 'markers', montar, *partes)
+    # Agrupa a partir da lista (também em cache) dos mesmos mapa/bbox
+    return obter_payload(
+        chave_mapa, 'markers',
+        lambda: agrupar_em_grade(obter_payload(chave_mapa, 'markers', montar, *partes)['dados'], zoom),
+        *partes, f'z{zoom}',
+    )
+
+
+@require_http_methods(["GET", "HEAD"])
+async def assentamentos_markers(request):
+    """GET /api/assentamentos/markers/: lista leve para os marcadores do mapa, em cache por
+    mapa (e bbox) e com ETag/Last-Modified.
+
+    Com ?zoom= (zoom do Leaflet) devolve os marcadores agrupados em grade
+    (mapa.agrupamento), também em cache por zoom. View assíncrona: sob ASGI a
+    consulta/cache roda numa thread e não prende o worker.
+    """
+    mapa_id = request.GET.get('mapa')
+    try:
+        chave_mapa = int(mapa_id) if mapa_id else TODOS
+    except ValueError:
+        return JsonResponse({'mapa': 'Informe um id numérico.'}, status=400)
+    bbox = request.GET.get('bbox')
+    try:
+        caixa = ler_caixa(bbox) if bbox else None
+    except ValueError:
+        return JsonResponse({'bbox': 'Use bbox=min_x,min_y,max_x,max_y (números, min <= max).'}, status=400)
+    try:
+        zoom = _ler_zoom(request.GET.get('zoom'))
+    except ValueError:
+        return JsonResponse({'zoom': f'Informe um zoom inteiro entre {ZOOM_MIN} e {ZOOM_MAX}.'}, status=400)
+
+    payload = await sync_to_async(_payload_markers)(request, chave_mapa, caixa, zoom)
+    nao_modificado = resposta_condicional(request, payload)
+    if nao_modificado is not None:
+        return nao_modificado
+    return aplicar_validadores(JsonResponse(payload['dados'], safe=False), payload)
+
+
+async def _em_blocos(linhas, tamanho=500):
+    """Iterador assíncrono sobre um gerador síncrono (com acesso ao banco), `tamanho` linhas por vez."""
+    proximo = sync_to_async(lambda: ''.join(itertools.islice(linhas, tamanho)))
+    while bloco := await proximo():
+        yield bloco
+
+
 class MapaMundoViewSet(viewsets.ModelViewSet):
     queryset = MapaMundo.objects.all().order_by('-criado_em')
     serializer_class = MapaMundoSerializer
@@ -119,6 +283,149 @@ class MapaMundoViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(obj)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def bootstrap(self, request, pk=None):
+        """Tudo que a página do mapa usa ao abrir, numa resposta: metadados, resumo dos
+        biomas e marcadores (agrupados com ?zoom=), em cache por MapaMundo.revisao.
+        """
+        mapa = self.get_object()
+        try:
+            zoom = _ler_zoom(request.query_params.get('zoom'))
+        except ValueError:
+            raise ValidationError({'zoom': f'Informe um zoom inteiro entre {ZOOM_MIN} e {ZOOM_MAX}.'})
+
+        def montar():
+            # Monta tudo direto do banco (não dos payloads em cache): a revisão vem
+            # do banco e a versão do cache local pode estar atrasada em outro processo
+            biomas = Bioma.objects.filter(mapa=mapa).defer(*Bioma.CAMPOS_GEOMETRIA).order_by('nome')
+            marcadores = _montar_markers(request, mapa.pk)
+            return {
+                'revisao': mapa.revisao,
+                'mapa': dict(MapaMundoSerializer(mapa, context={'request': request}).data),
+                'biomas': list(BiomaResumoSerializer(biomas, many=True).data),
+                'marcadores': marcadores if zoom is None else agrupar_em_grade(marcadores, zoom),
+            }
+
+        partes = [f'r{mapa.revisao}'] + ([f'z{zoom}'] if zoom is not None else [])
+        payload = obter_payload(mapa.pk, 'bootstrap', montar, *partes)
+        nao_modificado = resposta_condicional(request, payload)
+        if nao_modificado is not None:
+            return nao_modificado
+        return aplicar_validadores(Response(payload['dados']), payload)
+
+    @action(detail=True, methods=['get'])
+    def exportar(self, request, pk=None):
+        """Mundo do mapa em NDJSON (mapa.intercambio), transmitido enquanto é lido do banco."""
+        mapa = self.get_object()
+        linhas = intercambio.linhas_ndjson(intercambio.exportar(mapa))
+        if isinstance(request._request, ASGIRequest):
+            # Sob ASGI um iterador síncrono seria lido inteiro antes de enviar
+            linhas = _em_blocos(linhas)
+        resposta = StreamingHttpResponse(linhas, content_type='application/x-ndjson')
+        resposta['Content-Disposition'] = f'attachment; filename="mundo-{mapa.pk}.ndjson"'
+        return resposta
+
+    @action(detail=False, methods=['post'])
+    def importar(self, request):
+        """Cria um mapa a partir do NDJSON enviado em `arquivo` (opcional `nome` para renomear)."""
+        arquivo = request.FILES.get('arquivo')
+        if arquivo is None:
+            return Response({'arquivo': 'Envie o arquivo NDJSON exportado.'}, status=400)
+        try:
+            mapa, totais = intercambio.importar(intercambio.ler_ndjson(arquivo), nome=request.data.get('nome') or None)
+        except intercambio.ImportacaoInvalida as exc:
+            return Response({'detail': str(exc)}, status=400)
+        return Response({'mapa': self.get_serializer(mapa).data, 'totais': totais}, status=201)
+
+    @action(detail=True, methods=['post'], url_path='reatribuir-biomas')
+    def reatribuir(self, request, pk=None):
+        """Recalcula os biomas de todos os assentamentos do mapa a partir dos polígonos."""
+        mapa = self.get_object()
+        return Response(reatribuir_biomas(mapa.pk))
+
+    @action(detail=True, methods=['get'], url_path=r'imagem/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)')
+    def tile(self, request, pk=None, z=None, x=None, y=None):
+        """Redireciona para o tile z/x/y da pirâmide no storage (usado pelo L.tileLayer)."""
+        mapa = self.get_object()
+        z, x, y = int(z), int(x), int(y)
+        if mapa.tiles_zoom_max is None or z > mapa.tiles_zoom_max:
+            raise Http404
+        # Fora da grade do nível z não existe tile
+        lado = TILE_SIZE * 2 ** (mapa.tiles_zoom_max - z)
+        if x * lado >= (mapa.largura or 0) or y * lado >= (mapa.altura or 0):
+            raise Http404
+        resposta = HttpResponseRedirect(storages['tiles'].url(caminho_tile(mapa.tiles_origem, z, x, y)))
+        resposta['Cache-Control'] = 'max-age=300'
+        return resposta
+
+    @action(detail=True, methods=['get'], url_path=r'tiles/(?P<z>-?\d+)/(?P<x>\d+)/(?P<y>\d+)')
+    def tiles(self, request, pk=None, z=None, x=None, y=None):
+        """Tile vetorial z/x/y (zoom do Leaflet): biomas recortados e assentamentos, em cache por tile."""
+        mapa = self.get_object()
+        z, x, y = int(z), int(x), int(y)
+        if not ZOOM_MIN <= z <= ZOOM_MAX:
+            raise Http404
+        min_x, min_y, _, _ = caixa_do_tile(z, x, y)
+        if (mapa.largura and min_x >= mapa.largura) or (mapa.altura and min_y >= mapa.altura):
+            raise Http404
+        payload = obter_payload(mapa.pk, 'tile', lambda: montar_tile(mapa.pk, z, x, y), z, x, y)
+        nao_modificado = resposta_condicional(request, payload)
+        if nao_modificado is not None:
+            return nao_modificado
+        return aplicar_validadores(Response(payload['dados']), payload)
+
+
+class UploadMapaViewSet(viewsets.ViewSet):
+    """
+    Upload direto ao S3 da imagem de um mapa (multipart com URLs pré-assinadas, ver mapa.uploads):
+    POST /uploads/ inicia, /uploads/partes/ assina URLs de partes, /uploads/enviadas/ lista o
+    que já chegou (retomada), /uploads/concluir/ completa e cria o MapaMundo, /uploads/abortar/ descarta.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def _dados(self, request):
+        token = request.data.get('token') if request.method == 'POST' else request.query_params.get('token')
+        return uploads.ler_token(token, request.user.pk)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, uploads.UploadInvalido):
+            return Response({'detail': str(exc)}, status=400)
+        return super().handle_exception(exc)
+
+    def create(self, request):
+        tamanho = request.data.get('tamanho')
+        return Response(uploads.iniciar(request.data.get('nome_arquivo'), tamanho, request.user.pk), status=201)
+
+    @action(detail=False, methods=['post'])
+    def partes(self, request):
+        return Response({'urls': uploads.assinar_partes(self._dados(request), request.data.get('numeros'))})
+
+    @action(detail=False, methods=['get'])
+    def enviadas(self, request):
+        return Response({'partes': uploads.partes_enviadas(self._dados(request))})
+
+    @action(detail=False, methods=['post'])
+    def concluir(self, request):
+        dados = self._dados(request)
+        nome = (request.data.get('nome') or 'Mapa sem nome').strip()
+        if MapaMundo.objects.filter(nome=nome).exists():
+            return Response({'nome': 'Já existe um mapa com este nome.'}, status=400)
+        mapa = MapaMundo(nome=nome)
+        # O arquivo já está no bucket: só a referência é gravada (o save enfileira process_mapa)
+        mapa.imagem.name = uploads.concluir(dados)
+        try:
+            with transaction.atomic():
+                mapa.save()
+        except IntegrityError:
+            # Outro request criou um mapa com o mesmo nome desde a verificação acima
+            return Response({'nome': 'Já existe um mapa com este nome.'}, status=400)
+        return Response(MapaMundoSerializer(mapa, context={'request': request}).data, status=201)
+
+    @action(detail=False, methods=['post'])
+    def abortar(self, request):
+        uploads.abortar(self._dados(request))
+        return Response(status=204)
+
 
 # ----------------------- Views HTML (autenticadas) -----------------------
 
@@ -134,6 +441,7 @@ def maps_list(request):
         nome = request.POST.get('nome') or 'Mapa sem nome'
         imagem = request.FILES['imagem']
         try:
+            # Dimensões, tiles e miniatura ficam para a tarefa process_mapa (worker)
             novo = MapaMundo.objects.create(nome=nome, imagem=imagem)
             try:
                 logger.warning("Mapa salvo nome=%s chave=%s url=%s", novo.nome, novo.imagem.name, getattr(novo.imagem, 'url', 'SEM_URL'))
@@ -145,21 +453,22 @@ def maps_list(request):
             error_message = f"Falha ao enviar imagem: {e}"
 
     mapas = MapaMundo.objects.all().order_by('-criado_em')
-    return render(request, 'mapa/map_list.html', {'mapas': mapas, 'error_message': error_message})
+    processando = any(m.status in ('pendente', 'processando') for m in mapas)
+    return render(request, 'mapa/map_list.html', {'mapas': mapas, 'error_message': error_message, 'processando': processando})
 
 
 @login_required
-def s3_health(request):
+async def s3_health(request):
     """Retorna informações de saúde do backend S3 para diagnóstico rápido."""
-    info = {}
     from django.conf import settings
-    info['DEFAULT_FILE_STORAGE'] = settings.DEFAULT_FILE_STORAGE
-    info['STATICFILES_STORAGE'] = settings.STATICFILES_STORAGE
-    info['AWS_BUCKET'] = settings.AWS_STORAGE_BUCKET_NAME
-    info['AWS_DOMAIN'] = settings.AWS_S3_CUSTOM_DOMAIN
-    info['AWS_MEDIA_LOCATION'] = settings.AWS_MEDIA_LOCATION
-    info['AWS_QUERYSTRING_AUTH'] = settings.AWS_QUERYSTRING_AUTH
-    ultimo = MapaMundo.objects.order_by('-id').first()
+    info = {
+        'STORAGES': {nome: cfg['BACKEND'] for nome, cfg in settings.STORAGES.items()},
+        'AWS_BUCKET': settings.AWS_STORAGE_BUCKET_NAME,
+        'AWS_DOMAIN': settings.AWS_S3_CUSTOM_DOMAIN,
+        'AWS_MEDIA_LOCATION': settings.AWS_MEDIA_LOCATION,
+        'AWS_QUERYSTRING_AUTH': settings.AWS_QUERYSTRING_AUTH,
+    }
+    ultimo = await MapaMundo.objects.order_by('-id').afirst()
     if ultimo and ultimo.imagem:
         info['ultimo_mapa_nome'] = ultimo.nome
         info['ultimo_mapa_chave'] = ultimo.imagem.name
@@ -167,23 +476,31 @@ def s3_health(request):
             info['ultimo_mapa_url'] = ultimo.imagem.url
         except Exception as e:
             info['ultimo_mapa_url_error'] = str(e)
-        # Tenta HEAD no objeto
+        # HEAD no objeto (storage.exists), fora do event loop
         try:
-            s3 = boto3.client('s3', region_name=os.getenv('AWS_S3_REGION_NAME'))
-            s3.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=ultimo.imagem.name)
-            info['head_object'] = 'OK'
-        except ClientError as ce:
-            info['head_object_error'] = str(ce)
-    return Response(info)
+            existe = await sync_to_async(ultimo.imagem.storage.exists, thread_sensitive=False)(ultimo.imagem.name)
+            info['head_object'] = 'OK' if existe else 'NAO_ENCONTRADO'
+        except Exception as e:
+            info['head_object_error'] = str(e)
+    return JsonResponse(info)
+
+
+@require_http_methods(["GET", "HEAD"])
+def metricas_health(request):
+    """Percentis por rota das métricas deste processo; só staff ou com METRICAS_TOKEN."""
+    from django.conf import settings
+    token = settings.METRICAS_TOKEN
+    enviado = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not (request.user.is_staff or (token and hmac.compare_digest(enviado, token))):
+        return JsonResponse({'detail': 'Acesso restrito.'}, status=403)
+    return JsonResponse({'pid': os.getpid(), 'rotas': metricas.agregador.resumo()})
 
 
 @require_http_methods(["POST"])
 @login_required
 def map_delete(request, mapa_id: int):
     mapa = get_object_or_404(MapaMundo, pk=mapa_id)
-    # Remove arquivo físico antes de deletar o objeto (opcional)
-    if mapa.imagem:
-        mapa.imagem.delete(save=False)
+    # O arquivo é compartilhado por conteúdo: só sai do storage com a última referência (signals)
     mapa.delete()
     return redirect('map_list')
 
@@ -49,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primeiro: mede o request inteiro (Server-Timing, log e /health/metrics)
+    'mapa.metricas.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,12 +82,46 @@ WSGI_APPLICATION = 'setup.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PostgreSQL quando POSTGRES_DB estiver definido; senão SQLite (dev).
+if os.getenv('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB'),
+            'USER': os.getenv('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            # Conexões persistentes por worker, verificadas antes de reutilizar. Sob ASGI
+            # cada thread do sync_to_async abriria a sua: lá o padrão é fechar por request
+            # (ou usar DB_POOL)
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0' if os.getenv('SERVER_MODE') == 'asgi' else '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    # Pool do psycopg (psycopg[pool]); substitui as conexões persistentes
+    if os.getenv('DB_POOL', 'False').lower() in ('1', 'true', 'yes', 'on'):
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN', '2')),
+            'max_size': int(os.getenv('DB_POOL_MAX', '10')),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # WAL: leitores não bloqueiam a escrita (e vice-versa); escritas esperam
+                # o lock em vez de falhar com "database is locked"
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                'timeout': int(os.getenv('SQLITE_TIMEOUT', '20')),
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -144,13 +180,23 @@ AWS_MEDIA_LOCATION = os.getenv('AWS_MEDIA_LOCATION', 'media')
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
+# default, tiles e derivados usam as variantes de mapa.metricas, que somam o
+# tempo das chamadas ao storage à métrica do request (Server-Timing)
 STORAGES = {
     "default": {
-        "BACKEND": "setup.storage_backends.MediaStorage",
+        "BACKEND": "mapa.metricas.MediaStorageMedido",
     },
     "staticfiles": {
         "BACKEND": "setup.storage_backends.StaticStorage",
     },
+    # Pirâmide de tiles z/x/y gerada a partir das imagens de MapaMundo
+    "tiles": {
+        "BACKEND": "mapa.metricas.GeneratedStorageMedido",
+    },
+    # Derivados das imagens de MapaMundo (miniaturas)
+    "derivados": {
+        "BACKEND": "mapa.metricas.GeneratedStorageMedido",
+    },
 }
 
 STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{AWS_STATIC_LOCATION}/'
@@ -166,11 +212,56 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'map_list'
 LOGOUT_REDIRECT_URL = 'login'
 
+# Cache (payloads de API por mapa, ex.: markers). 'locmem' é por processo;
+# 'file' compartilha o cache entre os workers do gunicorn na mesma máquina.
+# A versão de cada mapa vive no cache: com mais de um worker (WEB_WORKERS, do
+# entrypoint.sh) o cache precisa ser compartilhado, senão a invalidação feita
+# num processo não chega aos outros (checagem mapa.E001).
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))
+if os.getenv('CACHE_BACKEND', 'file' if WEB_WORKERS > 1 else 'locmem').lower() == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / '.cache')),
+            'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', '3600')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', '3600')),
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # JSON com o tempo de renderização na métrica de serialização (mapa.metricas)
+    'DEFAULT_RENDERER_CLASSES': [
+        'mapa.metricas.JSONRendererMedido',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# Fila de tarefas (processamento de imagens de mapa).
+# Em produção um `python manage.py worker` consome a fila; com
+# MAPA_TAREFAS_SINCRONAS=True as tarefas rodam no próprio request (dev/testes).
+MAPA_TAREFAS_SINCRONAS = os.getenv('MAPA_TAREFAS_SINCRONAS', 'False').lower() in ('1', 'true', 'yes', 'on')
+MAPA_TAREFAS_MAX_TENTATIVAS = int(os.getenv('MAPA_TAREFAS_MAX_TENTATIVAS', '3'))
+# Segundos de reserva de uma tarefa (renovada enquanto ela avança); vencida, outro
+# worker a retoma. Espera base (s) antes de repetir uma tarefa que falhou, dobrando a cada falha.
+MAPA_TAREFAS_RESERVA = int(os.getenv('MAPA_TAREFAS_RESERVA', '900'))
+MAPA_TAREFAS_ESPERA = int(os.getenv('MAPA_TAREFAS_ESPERA', '30'))
+
+# Métricas por request (mapa.metricas): amostras guardadas por rota para os
+# percentis de /health/metrics, limite (ms) para logar o request como lento e
+# token opcional (Authorization: Bearer) para coletores sem sessão de staff.
+METRICAS_AMOSTRAS = int(os.getenv('METRICAS_AMOSTRAS', '1000'))
+METRICAS_LENTO_MS = float(os.getenv('METRICAS_LENTO_MS', '1000'))
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN', '')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -207,5 +298,11 @@ LOGGING = {
             'level': 'WARNING',
             'propagate': False,
         },
+        # Uma linha JSON por request em INFO; requests lentos sempre saem (WARNING)
+        'mapa.metricas': {
+            'handlers': ['console'],
+            'level': os.getenv('METRICAS_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
     },
 }
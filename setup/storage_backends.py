@@ -16,3 +16,7 @@ class MediaStorage(S3Boto3Storage):
     location = MEDIA_LOCATION
     default_acl = (os.getenv('AWS_DEFAULT_ACL') or None)
     file_overwrite = False  # keep user uploads distinct
+
+class GeneratedStorage(MediaStorage):
+    """Storage for assets generated from uploads (tiles, thumbnails); regenerating overwrites them."""
+    file_overwrite = True
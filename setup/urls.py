@@ -27,11 +27,14 @@ from mapa.views import (
     LojaViewSet,
     AssentamentoViewSet,
     MapaMundoViewSet,
+    UploadMapaViewSet,
+    assentamentos_markers,
     maps_list,
     map_editor,
     map_delete,
     bioma_editor,
     s3_health,
+    metricas_health,
     custom_logout,
 )
 
@@ -41,6 +44,7 @@ router.register('personagens', PersonagemViewSet, basename='Personagenss')
 router.register('lojas', LojaViewSet, basename='Lojas')
 router.register('assentamentos', AssentamentoViewSet, basename='Assentamentos')
 router.register('mapas', MapaMundoViewSet, basename='Mapas')
+router.register('uploads', UploadMapaViewSet, basename='Uploads')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -50,7 +54,8 @@ urlpatterns = [
     path('accounts/', include('mapa.urls')),
     # Logout direto na raiz
     path('logout/', custom_logout, name='logout'),
-    # API
+    # API (markers é assíncrona; vem antes do router para não cair no detalhe de assentamento)
+    path('api/assentamentos/markers/', assentamentos_markers, name='assentamentos-markers'),
     path('api/', include(router.urls)),
     # HTML pages
     path('', maps_list, name='map_list'),
@@ -59,6 +64,8 @@ urlpatterns = [
     path('mapas/<int:mapa_id>/delete/', map_delete, name='map_delete'),
     path('health/s3/', s3_health, name='s3_health'),      # com barra
     path('health/s3', s3_health, name='s3_health_noslash'),  # sem barra para evitar 404
+    path('health/metrics/', metricas_health, name='metricas_health'),
+    path('health/metrics', metricas_health, name='metricas_health_noslash'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 # Serve media in production if no reverse proxy is configured